@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: bench_pipeline.py
+
+- General description:
+This script measures each stage of plotZcurve.py on random genomes of increasing length (10 kb to 100 Mb by default)
+and on the real genomes of the sample data, and writes the results as JSON, so that the results of two commits can be
+compared. For each stage and genome, it records the wall time, the throughput in bases per second and the peak memory
+(RSS) of the process. It does not need internet access; the R stages are skipped if R, rpy2 or the R packages are
+missing, and the matplotlib stages if matplotlib is missing.
+
+- Procedure:
+1. generates the random genomes (the seed is fixed, so the runs can be compared) as FASTA files in a temporary folder
+2. runs each stage on each genome in a new process (so that the peak memory is the one of that stage only): the inputs
+of the stage (e.g. the sequence and the coordinates) are prepared first, then the stage is timed -r times and the
+fastest run is kept
+3. prints one line for each stage and genome, and writes all results to the JSON file of -o
+4. with --compare, prints the ratio between the times of this run and the times of a previous JSON file
+
+- Stages:
+read: checks the FASTA header and reads the sequence (reads_genome)
+gc: counts the bases of the file in chunks, without keeping the sequence (counts_total, GC_counts)
+coord: calculates the coordinates of the whole sequence (calculates_coord_parallel, with 1 worker)
+decimate: keeps at most --max-points points (decimates_coord, lttb)
+windows: GC content and GC skew in windows of --window bases (calculates_windows)
+r_convert: copies the decimated coordinates into an R dataframe (converts_coord)
+r_zcurve, r_ws: draws and saves the Z-curve and the W/S plot with R (plotZcurve, plotWS)
+mpl_zcurve, mpl_ws: draws and saves the same plots with matplotlib (plots_zcurve, plots_ws)
+
+- Usage:
+It is run in the command line, from the parent directory of the repo, as:
+
+bench_pipeline.py [-h] [-n LENGTH [LENGTH ...]] [-g GENOME [GENOME ...]] [--stages STAGE [STAGE ...]] [-r REPEATS]
+                  [-o OUTPUT_JSON] [--compare OLD_JSON] [--max-points MAX_POINTS] [--window SIZE] [-f FORMAT]
+
+- List of imported modules:
+1. argparse: to input the different parameters
+2. os, sys, platform, subprocess and datetime: to find the scripts folder of the repo, and to describe the run
+(machine, python version, commit) in the JSON file
+3. time: to measure the wall time
+4. json: to write and read the results
+5. tempfile and multiprocessing: to run each stage in a new process, on genomes written to a temporary folder;
+importlib: to check if matplotlib is installed
+6. resource: to measure the peak memory (not available on Windows, where it is not reported)
+7. numpy: to generate the random genomes
+8. zcurve: the stages of plotZcurve.py, from the zcurve package found in the scripts folder
+
+"""
+#%% IMPORT MODULES
+
+import argparse
+import os
+import sys
+import platform
+import subprocess
+import datetime
+import time
+import json
+import tempfile
+import importlib.util
+import multiprocessing
+import numpy as np
+# the peak memory is read from the operating system, which is not possible on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the stages are found in the zcurve package, in the scripts folder of the repo
+scripts_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts')
+sys.path.append(scripts_path)
+
+#%% CONSTANTS
+
+# stages of the pipeline, in the order in which they are run by plotZcurve.py
+STAGES = ['read', 'gc', 'coord', 'decimate', 'windows', 'r_convert', 'r_zcurve', 'r_ws', 'mpl_zcurve', 'mpl_ws']
+
+# real genomes measured by default, from the sample data of the repo
+SAMPLE_GENOMES = [os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'samples_data', 'zika_genome.fna')]
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''GENERATES_GENOME
+
+    Parameters
+    ----------
+    genome_path: string
+        path of the FASTA file to be written
+
+    length: int
+        number of bases
+
+    seed: int
+        seed of the random generator
+
+'''
+
+def generates_genome(genome_path, length, seed=0):
+    rng = np.random.default_rng(seed)
+    bases = np.frombuffer(b'acgt', dtype=np.uint8)
+    with open(genome_path, 'wb') as genome:
+        genome.write('>random_{}\n' .format(length).encode())
+        # the sequence is written in blocks of lines of 80 bases, so a 100 Mb genome is never in memory twice
+        for start in range(0, length, 80 * 100_000):
+            block = bases[rng.integers(0, 4, min(80 * 100_000, length - start))]
+            full = block.size // 80 * 80
+            # each line of 80 bases is followed by a newline
+            lines = np.full((full // 80, 81), ord('\n'), dtype=np.uint8)
+            lines[:, :80] = block[:full].reshape(-1, 80)
+            genome.write(lines.tobytes())
+            if block.size > full:
+                genome.write(block[full:].tobytes() + b'\n')
+
+
+'''READS_PEAK_RSS
+
+    Returns
+    -------
+    peak: float
+        peak memory (RSS) of this process so far, in MB, or None on Windows
+
+'''
+
+def reads_peak_rss():
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kB on Linux
+    return(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10)
+
+
+'''CHECKS_R
+
+    Returns
+    -------
+    reason: string
+        why the R stages cannot be run, or None if R, rpy2 and the R packages are all available
+
+'''
+
+def checks_r():
+    # rpy2 cannot be imported without R
+    try:
+        import rpy2.robjects.packages as rpackages
+    except Exception as error:
+        return('rpy2 or R not available ({})' .format(error))
+    # the packages would be installed from CRAN by the renderer, which needs internet access
+    missing = [package for package in ['plot3D', 'ggplot2'] if not rpackages.isinstalled(package)]
+    if missing:
+        return('R packages not installed: {}' .format(', '.join(missing)))
+    return(None)
+
+
+'''PREPARES_STAGE
+
+    Parameters
+    ----------
+    stage: string
+        one of STAGES
+
+    genome_path: string
+        path of the FASTA file
+
+    options: dict
+        max_points, window, out_format and out_dir of the run
+
+    Returns
+    -------
+    run: function
+        runs the stage once, on inputs already prepared
+
+    points: int
+        number of points of the stage (the points of the decimated coordinates for the plots), or None if the stage
+        reads the whole file
+
+'''
+
+def prepares_stage(stage, genome_path, options):
+    from zcurve import pipeline, render
+    from zcurve.core import TR_MATRIX, counts_total, GC_counts, calculates_coord_parallel, decimates_coord, calculates_windows
+    # the stages which read the file only need its path
+    if stage == 'read':
+        def run():
+            with open(genome_path, 'rb') as genome:
+                pipeline.checks_input(genome)
+                return(pipeline.reads_genome(genome))
+        return(run, None)
+    if stage == 'gc':
+        def run():
+            with open(genome_path, 'rb') as genome:
+                return(GC_counts(counts_total(genome, start_line=2)))
+        return(run, None)
+    # the other stages start from the sequence
+    with open(genome_path, 'rb') as genome:
+        pipeline.checks_input(genome)
+        seq, _ = pipeline.reads_genome(genome)
+    if stage == 'coord':
+        return(lambda: calculates_coord_parallel(seq, TR_MATRIX, workers=1), len(seq))
+    if stage == 'windows':
+        return(lambda: calculates_windows([seq], options['window'], options['window']), len(seq))
+    coord, _ = calculates_coord_parallel(seq, TR_MATRIX, workers=1)
+    if stage == 'decimate':
+        return(lambda: decimates_coord(coord, options['max_points'], 'lttb'), len(seq))
+    # the plots are drawn from the decimated coordinates, as in plotZcurve.py
+    coord, step = decimates_coord(coord, options['max_points'], 'lttb')
+    out_name = os.path.join(options['out_dir'], stage)
+    if stage.startswith('mpl_'):
+        render.initializes_renderer(scripts_path, 'matplotlib')
+        plots = render.render_state['plots']
+        plot_func = plots.plots_zcurve if stage == 'mpl_zcurve' else plots.plots_ws
+        return(lambda: plot_func(coord, step, out_name, options['out_format'], 'benchmark'), len(coord))
+    # the R stages
+    render.initializes_renderer(scripts_path, 'r')
+    if stage == 'r_convert':
+        return(lambda: render.converts_coord(coord, step), len(coord))
+    r_coord = render.converts_coord(coord, step)
+    if stage == 'r_zcurve':
+        return(lambda: render.render_state['Zcurve'].plotZcurve(r_coord, out_name, options['out_format'], 'benchmark'), len(coord))
+    return(lambda: render.render_state['WSplot'].plotWS(r_coord, out_name, options['out_format'], 'benchmark'), len(coord))
+
+
+'''RUNS_STAGE
+
+    Parameters
+    ----------
+    task: tuple
+        stage, name and path of the genome, number of bases, repeats and options of the run
+
+    Returns
+    -------
+    result: dict
+        wall time (fastest run and all runs), throughput, peak memory and status of the stage on the genome
+
+'''
+
+def runs_stage(task):
+    stage, genome_name, genome_path, length, repeats, options = task
+    result = {'stage': stage, 'genome': genome_name, 'bases': length, 'status': 'ok', 'reason': None}
+    # the stages are skipped if their backend is not available
+    if stage.startswith('r_'):
+        result['reason'] = checks_r()
+    elif stage.startswith('mpl_'):
+        if importlib.util.find_spec('matplotlib') is None:
+            result['reason'] = 'matplotlib not installed'
+    if result['reason']:
+        result['status'] = 'skipped'
+        return(result)
+    run, points = prepares_stage(stage, genome_path, options)
+    # memory used by the process and the inputs, before the stage
+    rss_before = reads_peak_rss()
+    wall_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        wall_times.append(time.perf_counter() - start)
+    peak_rss = reads_peak_rss()
+    result.update({'points': points or length, 'wall_time': min(wall_times), 'wall_times': wall_times,
+                   'bases_per_s': length / min(wall_times), 'peak_rss_mb': peak_rss,
+                   'stage_rss_mb': None if peak_rss is None else peak_rss - rss_before})
+    return(result)
+
+
+'''DESCRIBES_RUN
+
+    Returns
+    -------
+    run: dict
+        date, machine, python and numpy versions, and commit of the repo (if it is a git repository)
+
+'''
+
+def describes_run():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=scripts_path, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return({'date': datetime.datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'machine': platform.machine(),
+            'system': platform.platform(), 'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__})
+
+
+'''COMPARES_RESULTS
+
+    Parameters
+    ----------
+    results: list
+        results of this run
+
+    old_path: string
+        JSON file of a previous run
+
+'''
+
+def compares_results(results, old_path):
+    with open(old_path) as old_file:
+        old = json.load(old_file)
+    old_times = {(result['stage'], result['genome']): result['wall_time'] for result in old['results'] if result['status'] == 'ok'}
+    print('Compared to {} (commit {}): time of this run / time of the previous run' .format(old_path, old['run']['commit']))
+    for result in results:
+        key = (result['stage'], result['genome'])
+        if result['status'] == 'ok' and key in old_times:
+            print('{:>11} {:>18} {:>8.2f}' .format(result['stage'], result['genome'], result['wall_time'] / old_times[key]))
+
+
+#%% MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures each stage of plotZcurve.py, and writes the results as JSON.')
+    parser.add_argument('-n', metavar='LENGTH', dest='lengths', type=int, nargs='+',
+                        default=[10_000, 100_000, 1_000_000, 10_000_000, 100_000_000],
+                        help="optional: lengths of the random genomes (default 10000 100000 1000000 10000000 100000000)")
+    parser.add_argument('-g', metavar='GENOME', dest='genomes', nargs='*', default=SAMPLE_GENOMES,
+                        help="optional: real genomes in FASTA format, not compressed (default: zika_genome.fna of the sample data; -g alone for none)")
+    parser.add_argument('--stages', metavar='STAGE', dest='stages', nargs='+', choices=STAGES, default=STAGES,
+                        help="optional: stages to be measured (default: all of them, {})" .format(' '.join(STAGES)))
+    parser.add_argument('-r', metavar='REPEATS', dest='repeats', type=int, default=3,
+                        help="optional: number of runs of each stage; the fastest is kept (default 3)")
+    parser.add_argument('-o', metavar='OUTPUT_JSON', dest='output', default='bench_pipeline.json',
+                        help="optional: JSON file where the results are written (default bench_pipeline.json)")
+    parser.add_argument('--compare', metavar='OLD_JSON', dest='compare', default=None,
+                        help="optional: JSON file of a previous run, whose times are compared to this run")
+    parser.add_argument('--max-points', metavar='MAX_POINTS', dest='max_points', type=int, default=20000,
+                        help="optional: maximum number of points of the plots, as in plotZcurve.py (default 20000)")
+    parser.add_argument('--window', metavar='SIZE', dest='window', type=int, default=10000,
+                        help="optional: size of the windows of the windows stage (default 10000)")
+    parser.add_argument('-f', metavar='FORMAT', dest='out_format', nargs='+', default=['png'],
+                        help="optional: formats of the plots (default png)")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        options = {'max_points': args.max_points, 'window': args.window, 'out_format': args.out_format, 'out_dir': tmp_dir}
+        # random genomes, then the real ones
+        genomes = []
+        for length in args.lengths:
+            genome_path = os.path.join(tmp_dir, 'random_{}.fa' .format(length))
+            generates_genome(genome_path, length)
+            genomes.append(('random_{}' .format(length), genome_path, length))
+        for genome_path in args.genomes:
+            with open(genome_path, 'rb') as genome:
+                genome.readline()
+                length = sum(len(line.strip()) for line in genome)
+            genomes.append((os.path.basename(genome_path).split('.')[0], genome_path, length))
+
+        # each stage runs in a new process (spawn, so that nothing is inherited), which is then closed
+        tasks = [(stage, name, path, length, args.repeats, options) for name, path, length in genomes for stage in args.stages]
+        print('{:>11} {:>18} {:>12} {:>10} {:>14} {:>10}' .format('stage', 'genome', 'bases', 'time (s)', 'bases/s', 'RSS (MB)'))
+        with multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1) as pool:
+            for result in pool.imap(runs_stage, tasks):
+                results.append(result)
+                if result['status'] == 'skipped':
+                    print('{:>11} {:>18} {:>12}  skipped: {}' .format(result['stage'], result['genome'], result['bases'], result['reason']))
+                    continue
+                print('{:>11} {:>18} {:>12} {:>10.4f} {:>14.3e} {:>10}'
+                      .format(result['stage'], result['genome'], result['bases'], result['wall_time'], result['bases_per_s'],
+                              '-' if result['peak_rss_mb'] is None else '{:.0f}' .format(result['peak_rss_mb'])))
+
+    # writes all the results, with the description of the run
+    with open(args.output, 'w') as output:
+        json.dump({'run': describes_run(), 'options': vars(args), 'results': results}, output, indent=2)
+    print('Results written to {}' .format(args.output))
+    if args.compare:
+        compares_results(results, args.compare)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: bench_startup.py
+
+- General description:
+This script measures how long plotZcurve.py takes to start, and checks that it does not import more than it needs:
+plotZcurve.py -h should not import numpy, and a run with --no-plot should import neither R (rpy2), pandas nor
+matplotlib. It exits with an error if a run is slower than its threshold, or imports one of these modules, so it can be
+used as a check before a release.
+
+- Procedure:
+1. generates a small random genome in a temporary folder (the seed is fixed, so the runs can be compared)
+2. runs plotZcurve.py -h and plotZcurve.py --no-plot --no-cache on the genome, each in a new python process, and keeps
+the fastest of the runs
+3. runs each command once more with python -X importtime, and lists the modules which should not have been imported
+4. prints the time of each command, its threshold and the modules, and exits with 1 if a check failed
+
+- Usage:
+It is run in the command line, from the parent directory of the repo, as:
+
+bench_startup.py [-h] [-n LENGTH] [-r REPEATS] [--max-help SECONDS] [--max-compute SECONDS]
+
+- List of imported modules:
+1. argparse: to input the different parameters
+2. os, sys: to find plotZcurve.py in the scripts folder of the repo, and the python interpreter
+3. time: to measure the wall time
+4. random: to generate the random genome
+5. subprocess and tempfile: to run plotZcurve.py in a new process, in a temporary folder
+
+"""
+#%% IMPORT MODULES
+
+import argparse
+import os
+import sys
+import time
+import random
+import subprocess
+import tempfile
+
+# plotZcurve.py is found in the scripts folder of the repo
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts', 'plotZcurve.py')
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''TIMES_COMMAND
+
+    Parameters
+    ----------
+    command: list
+        arguments of plotZcurve.py
+
+    repeats: int
+        number of runs; the fastest is kept
+
+    cwd: string
+        folder where the command is run
+
+    Returns
+    -------
+    best: float
+        fastest wall time, in seconds, including the start of python
+
+'''
+
+def times_command(command, repeats, cwd):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        # the output is not needed, but an error of plotZcurve.py stops the benchmark
+        subprocess.run([sys.executable, script] + command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return(best)
+
+
+'''LISTS_IMPORTS
+
+    Parameters
+    ----------
+    command: list
+        arguments of plotZcurve.py
+
+    cwd: string
+        folder where the command is run
+
+    Returns
+    -------
+    modules: set
+        names of the top-level modules imported by the command (from the report of python -X importtime)
+
+'''
+
+def lists_imports(command, cwd):
+    run = subprocess.run([sys.executable, '-X', 'importtime', script] + command, cwd=cwd, check=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    # each line of the report is 'import time: self | cumulative | name', the name indented by its depth
+    return({line.split('|')[-1].strip().split('.')[0] for line in run.stderr.splitlines() if line.startswith('import time:')})
+
+
+#%% MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the startup time of plotZcurve.py, and checks the modules it imports.')
+    parser.add_argument('-n', metavar='LENGTH', dest='length', type=int, default=100_000,
+                        help="optional: length of the random genome of the --no-plot run (default 100000)")
+    parser.add_argument('-r', metavar='REPEATS', dest='repeats', type=int, default=5,
+                        help="optional: number of runs of each command; the fastest is kept (default 5)")
+    parser.add_argument('--max-help', metavar='SECONDS', dest='max_help', type=float, default=0.3,
+                        help="optional: maximum time of plotZcurve.py -h, in seconds (default 0.3)")
+    parser.add_argument('--max-compute', metavar='SECONDS', dest='max_compute', type=float, default=1.0,
+                        help="optional: maximum time of plotZcurve.py --no-plot on the random genome, in seconds (default 1.0)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # random genome, with a fixed seed, written as a FASTA file with lines of 80 bases
+        rng = random.Random(0)
+        seq = ''.join(rng.choice('acgt') for _ in range(args.length))
+        with open(os.path.join(tmp_dir, 'random.fa'), 'w') as genome:
+            genome.write('>random\n' + '\n'.join(seq[i:i+80] for i in range(0, len(seq), 80)) + '\n')
+
+        # each command, with its threshold and the modules it should not import
+        commands = [('-h', ['-h'], args.max_help, {'numpy', 'rpy2', 'pandas', 'matplotlib'}),
+                    ('--no-plot', ['-i', 'random.fa', '--no-plot', '--no-cache', '-gc'], args.max_compute,
+                     {'rpy2', 'pandas', 'matplotlib'})]
+        failed = False
+        print('{:>10} {:>10} {:>10}  {}' .format('command', 'time (s)', 'max (s)', 'unexpected imports'))
+        for name, command, max_time, forbidden in commands:
+            run_time = times_command(command, args.repeats, tmp_dir)
+            unexpected = sorted(lists_imports(command, tmp_dir) & forbidden)
+            failed = failed or run_time > max_time or bool(unexpected)
+            print('{:>10} {:>10.3f} {:>10.3f}  {}' .format(name, run_time, max_time, ', '.join(unexpected) or '-'))
+
+    # the exit status tells if all the checks passed
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: bench_workers.py
+
+- General description:
+This script measures how the calculation of the Z-curve coordinates scales with the number of
+worker processes (--workers in plotZcurve.py).
+
+- Procedure:
+1. generates a random genome of the given length (the seed is fixed, so the runs can be compared)
+2. calculates the coordinates with one worker, which is the reference
+3. calculates the coordinates again with each number of workers, and checks that the result is exactly the same
+4. prints the time, the speedup compared to one worker and the throughput in bases per second
+
+- Usage:
+It is run in the command line, from the parent directory of the repo, as:
+
+bench_workers.py [-h] [-n LENGTH] [-w WORKERS [WORKERS ...]] [-r REPEATS]
+
+- List of imported modules:
+1. argparse: to input the different parameters
+2. os, sys: to find the scripts folder of the repo
+3. time: to measure the wall time
+4. numpy: to generate the random genome
+5. zcurve.core: the Z-curve calculations and the transformation matrix, from the zcurve package found in the scripts folder
+
+"""
+#%% IMPORT MODULES
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+# the Z-curve functions are found in the scripts folder of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from zcurve.core import calculates_coord, calculates_coord_parallel, TR_MATRIX
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''TIMES_RUN
+
+    Parameters
+    ----------
+    func: function
+        function to be timed
+
+    repeats: int
+        number of runs; the fastest is kept
+
+    Returns
+    -------
+    best: float
+        fastest wall time, in seconds
+
+    result: any
+        result of the last run
+
+'''
+
+def times_run(func, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return(best, result)
+
+
+#%% MAIN
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the scaling of the Z-curve calculation with the number of workers.')
+    parser.add_argument('-n', metavar='LENGTH', dest='length', type=int, default=50_000_000,
+                        help="optional: length of the random genome (default 50000000)")
+    parser.add_argument('-w', metavar='WORKERS', dest='workers', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help="optional: numbers of workers to be tested (default 1 2 4 8 16 32)")
+    parser.add_argument('-r', metavar='REPEATS', dest='repeats', type=int, default=3,
+                        help="optional: number of runs for each number of workers; the fastest is kept (default 3)")
+    args = parser.parse_args()
+
+    # same transformation matrix as plotZcurve.py
+    tr_matrix = TR_MATRIX
+    # random genome, with a fixed seed
+    rng = np.random.default_rng(0)
+    seq = np.frombuffer(b'acgt', dtype=np.uint8)[rng.integers(0, 4, args.length)].tobytes()
+
+    # reference: one worker
+    serial_time, reference = times_run(lambda: calculates_coord(seq, tr_matrix), args.repeats)
+    print('{:>8} {:>10} {:>8} {:>14} {:>6}' .format('workers', 'time (s)', 'speedup', 'bases/s', 'equal'))
+    for workers in args.workers:
+        run_time, (coord, totals) = times_run(lambda: calculates_coord_parallel(seq, tr_matrix, workers), args.repeats)
+        print('{:>8} {:>10.3f} {:>8.2f} {:>14.3e} {:>6}'
+              .format(workers, run_time, serial_time / run_time, args.length / run_time, str(np.array_equal(coord, reference))))
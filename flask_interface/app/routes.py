@@ -1,30 +1,38 @@
 # imports the necessary modules for Flask to run
-from flask import Flask,render_template, request, abort
+from flask import Flask,render_template, request, abort, jsonify, redirect, url_for, send_file
 # imports our custom module call 'app'
 from app import app
 # imports the secure_filename from the werkzeug module, to ensure secure transmission of files, since we have input files
 from werkzeug.utils import secure_filename 
+# the multipart body of the uploads is parsed as it arrives, so the uploads are never spooled to temporary files
+from werkzeug.sansio.multipart import MultipartDecoder, File, Data, Epilogue, NEED_DATA
 
 # same modules imported in the main python plotZcurve.py, excluding argaparse
 import os
-import re
-import pandas as pd
 import numpy as np
-import math
-
-# Modules for R
-# imports the rpy2 module
-import rpy2.robjects as robjects
-# imports rpackages, used to check if necessary R packages are installed
-import rpy2.robjects.packages as rpackages
-# for installing the packages if missing
-from rpy2.robjects.vectors import StrVector
-# creates and export to Python a custom function made in R
-from rpy2.robjects.packages import STAP
-# needed for conversion from pandas dataframe to R datraframe
-from rpy2.robjects import pandas2ri
-# needed for conversion from pandas dataframe to R datraframe
-from rpy2.robjects.conversion import localconverter
+import sys
+import threading
+import multiprocessing
+import collections
+import uuid
+import shutil
+import gzip
+import io
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# the vectorized Z-curve calculations are shared with plotZcurve.py, in the zcurve package found in the scripts folder of the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+from zcurve.core import scans_genome, counts_bases, transforms_counts, counts_composition, decimates_coord, TR_MATRIX
+from zcurve.core import InvalidInput, InvalidNucleotide
+# the plots are drawn by a pool of worker processes, each with its own R -> R is never started in the flask process
+from zcurve import render as zcurve_render
+# the results are stored in a content-addressed cache, so the same genome is never processed twice
+from zcurve import cache as zcurve_cache
+# decompression of the uploads compressed with gzip or bgzip
+from zcurve.decompress import opens_genome, DECOMPRESS_THREADS
+# time, CPU and memory of each stage of each upload, when app.config['PROFILE'] is set
+from zcurve import metrics
 
 # creates a path for a new directory, where the images will be temporarily stored
 download_folder='app/static/images/'
@@ -33,188 +41,498 @@ download_folder='app/static/images/'
 if not os.path.exists(download_folder):
   os.mkdir(download_folder)
 
-# accepts only .fna files for upload
-app.config['UPLOAD_EXTENSIONS'] = ['.fna']
-# sets the upload path, sp the files can be checked - please insert your own path
-app.config['UPLOAD_PATH']= ''
-# sets where the images will be downloaded and later retrieved from to be displayed
+# accepts only .fna files for upload, also compressed with gzip or bgzip
+app.config['UPLOAD_EXTENSIONS'] = ['.fna', '.fna.gz']
+# maximum size of one upload request in bytes; larger uploads are refused with 413 before they are read
+app.config['MAX_CONTENT_LENGTH'] = 256 * 1024 * 1024
+# maximum size of a compressed upload once decompressed, in bytes; larger files are reported as failed
+app.config['MAX_GENOME_LENGTH'] = 256 * 1024 * 1024
+# number of threads decompressing the uploads compressed with bgzip
+app.config['DECOMPRESS_THREADS'] = DECOMPRESS_THREADS
+# sets where the images will be downloaded and later retrieved from to be displayed; it is also the result cache,
+# where each result (GC content, coordinates and plots) is stored in a folder named after the hash of the sequence
 app.config['DOWNLOAD_PATH'] = download_folder
+# maximum size of the result cache in bytes; when it is full, the least recently used results are removed
+app.config['CACHE_MAX_BYTES'] = 1 << 30
 # sets the path where the R scripts are - please insert your own path
 app.config['SCRIPT_PATH'] = ''
+# maximum number of points sent to R for each plot, and how they are chosen (stride, minmax or lttb)
+app.config['MAX_POINTS'] = 20000
+app.config['DECIMATION'] = 'lttb'
+# if True, the Z-curve and W/S plots are also drawn on the server (by R or matplotlib) as png; otherwise, they are only
+# drawn in the browser, from the coordinates served by /coords/<key>, and R is never started
+app.config['SERVER_PLOTS'] = True
+# gzip level of the coordinates served to the browser; they are compressed once, when the result is stored
+app.config['COORD_COMPRESSION'] = 6
+# if True, the R worker processes are started and set up when the app starts; otherwise, at the first request
+app.config['R_PRELOAD'] = False
+# how the plots are drawn: 'r' with the R scripts, or 'matplotlib', which does not need R (see scripts/zcurve/render.py)
+app.config['RENDER_BACKEND'] = 'r'
+# number of worker processes drawing the plots, each with its own R (or matplotlib)
+app.config['RENDER_WORKERS'] = 2
+# number of plot jobs which can wait for a free worker; when the queue is full, the files of a job wait (stage
+# 'waiting') until a place is free
+app.config['RENDER_QUEUE'] = 8
+# number of background threads processing the uploads, and number of jobs kept in memory for the job pages
+app.config['JOB_THREADS'] = 2
+app.config['JOB_HISTORY'] = 100
+# number of jobs which can wait for a free background thread; each of them keeps its uploads in memory, so when
+# JOB_THREADS + JOB_QUEUE jobs are not finished yet, new uploads are refused with 503 (server busy) before they are read
+app.config['JOB_QUEUE'] = 4
+# file where the wall time, CPU time, peak memory and number of bases of each stage of each upload are written (read,
+# coord, decimate, cache_store, and convert and plot_zcurve/plot_ws in the render workers), or None; the format is
+# 'jsonl' (one JSON line per stage) or 'prometheus' (text file rewritten after each job, for a Prometheus scraper);
+# PROFILE_CPROFILE is a folder where the hot stages are profiled with cProfile, and PROFILE_TRACEMALLOC measures the
+# memory allocated by each stage too (see scripts/zcurve/metrics.py)
+app.config['PROFILE'] = None
+app.config['PROFILE_FORMAT'] = 'jsonl'
+app.config['PROFILE_CPROFILE'] = None
+app.config['PROFILE_TRACEMALLOC'] = False
+
+# options of the metrics, from the settings above, or None if they are not used
+def profile_options():
+  if not app.config['PROFILE']:
+    return(None)
+  return({'path': os.path.abspath(app.config['PROFILE']), 'format': app.config['PROFILE_FORMAT'],
+          'cprofile_dir': app.config['PROFILE_CPROFILE'] and os.path.abspath(app.config['PROFILE_CPROFILE']),
+          'tracemalloc': app.config['PROFILE_TRACEMALLOC']})
 
 # loads the main page, where the files are uploaded
 @app.route('/')
 def main_page():
   return render_template('main_input.html')
 
-# runs the functions contained in plotZcurve.py -> method=POST so the server knows to expect input
+# receives the uploaded files -> method=POST so the server knows to expect input; each upload is read here once, from
+# the body of the request as it arrives (request.files is never used, since werkzeug would first copy the large uploads
+# to temporary files), then the files are processed by a background thread, and the user gets a job ID right away
 @app.route('/', methods=['POST'])
 def plot_all():
-  # initializes an empty dictionary
-  file_dict={}
-  # initializes a set with the allowed nucleotides
-  bases = set(['a', 'c', 'g', 't'])
-  # defines the transformation matrix
-  tr_matrix = np.array([[1,1,-1,-1], [1,1,-1,-1], [1,-1,-1,1]])
-  # multiplies the matrix for the square root of 3 divided by 4
-  tr_matrix = tr_matrix*math.sqrt(3)/4
-  # retrieves the R function
-  Zcurve=get_Rfunc('Zcurve_func.R', 'Zcurve', 'plot3D')
-  WSplot=get_Rfunc('WS_func.R', 'WSplot', 'ggplot2')
+  # back-pressure: a new job is accepted only if there is a place for it, and the upload is not read otherwise
+  if not job_slots.acquire(blocking=False):
+    abort(503, description='The server is busy with other files, please try again in a few minutes')
+  # the place is given back if the job is not created (e.g. no file, or an invalid request)
+  try:
+    job_id=reads_uploads()
+  except BaseException:
+    job_slots.release()
+    raise
+  # API clients receive the job ID as JSON, with the addresses to follow its progress
+  if request.accept_mimetypes.best == 'application/json':
+    return jsonify(job_id=job_id, status_url=url_for('job_status', job_id=job_id), result_url=url_for('job_page', job_id=job_id)), 202
+  # browsers are sent to the job page, which shows the progress and then the results
+  return redirect(url_for('job_page', job_id=job_id), code=303)
+
+# reads the files of the request, and creates their job
+def reads_uploads():
+  # initializes an empty list, to contain the filename and the genome read from each file
+  files=[]
+  # the metrics follow the settings, which can be changed while the app runs
+  metrics.enables_metrics(profile_options())
   # for each file uploaded:
-  for uploaded_file in request.files.getlist('file'):
-    # checks if the file exists; if so, returns the filename name and its path as a list
-    file_check=check_files(uploaded_file)
-    # filename
-    filename=file_check[0].split('/')[-1].split('.')[0]
-    # full path
-    full_path=file_check[1]
-    # checks if the file is in FASTA format
-    checks_format(full_path)
-    # reads the genome and returns the sequence in one string
-    seq=reads_genome(full_path, bases)
-    # calculates the GC content
-    gc=round(GC_cont(seq),2)
-    # adds the gc content to the dictionary under the filename key
-    file_dict[filename] = [gc]
-    # creates the matrix for plotting
-    plot_matrix=creates_matrix(seq, tr_matrix)
-    # puts together the full path to the plot directory where it will be saved - Zcurve plot
-    out_name=os.path.join(app.config['DOWNLOAD_PATH'], filename)
-    # puts together the full path to the plot directory where it will be saved - WS plot
-    ws_out_name=os.path.join(app.config['DOWNLOAD_PATH'], filename + '_WS')
-    # executes the R plotZcurve function -> in this case, it saves the plot only as png
-    Zcurve.plotZcurve(plot_matrix, out_name, 'png', filename)
-    # retrieves the plot filename
-    plot_name = 'images/' +  filename + '.png'
-    # adds the plot filename to the dictionary under the same key as the gc content
-    file_dict[filename].append([plot_name])
-    # executes the R plotWS function -> in this case, it saves the plot only as png
-    WSplot.plotWS(plot_matrix, ws_out_name, 'png', filename)
-    # retrieves the plot filename
-    ws_plot_name = 'images/' +  filename + '_WS.png'
-    # adds the plot filename to the dictionary under the same key as the gc content
-    file_dict[filename].append([ws_plot_name])
-    print(file_dict)
+  for uploaded_name, upload in iter_uploads('file'):
+    # checks if the file exists; if so, returns the filename
+    filename=check_files(uploaded_name)
+    # empty file fields are skipped
+    if filename is None:
+      continue
+    # the files of the job are named after their whole filename, so e.g. a.fna and a.fna.gz are two different files;
+    # a filename uploaded more than once is numbered
+    name=filename
+    number=1
+    while name in [other for other, genome in files]:
+      number+=1
+      name='{} ({})' .format(filename, number)
+    # the body is only available during the request, so it is read now; the errors are reported in the job
+    try:
+      with metrics.measures_stage('read', name) as record:
+        genome=reads_genome(upload, filename)
+        record['bases']=genome[0].size
+    except (InvalidInput, InvalidNucleotide) as error:
+      genome=error
+    # name of the file, used in the page and as title of the plots, and base codes and counts (or the error)
+    files.append((name, genome))
+  # if no file was uploaded, the server aborts
+  if not files:
+    abort(400, description='Please choose at least one .fna file')
+  # creates the job and puts it in the queue
+  return(submits_job(files))
+
+# shows the progress of the job while it runs, and the html template with the results when it is done
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+  job=gets_job(job_id)
   # returns the html template, which will print the GC content and display the plot in the server, with an option to download the plot as png
-  return render_template('print_results.html', file_dict=file_dict)
+  if job['status'] in ('done', 'failed'):
+    return render_template('print_results.html', file_dict=job['file_dict'], failed=job['failed'])
+  # otherwise, a page with the stage of each file, which reloads itself until the job is done
+  return render_template('job_status.html', job_id=job_id, job=job)
+
+# reports the progress of the job as JSON: the status of the job, and the stage of each file
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+  job=gets_job(job_id)
+  return jsonify(job_id=job_id, status=job['status'], files=job['files'])
+
+
+# the jobs are kept in memory: each job has a status (queued, running, done or failed), and each of its files has
+# a stage (queued, coordinates, waiting for a free place in the render queue, plotting, done or failed)
+jobs = collections.OrderedDict()
+jobs_lock = threading.Lock()
+# the jobs are processed by a small pool of background threads; the plots themselves are drawn by the R workers
+job_threads = ThreadPoolExecutor(app.config['JOB_THREADS'])
+# one place for each job which is running or waiting for a thread; it is taken by plot_all, and given back when the job ends
+job_slots = threading.BoundedSemaphore(app.config['JOB_THREADS'] + app.config['JOB_QUEUE'])
+
+# creates a new job, and puts it in the queue
+def submits_job(files):
+  job_id=uuid.uuid4().hex
+  job={'status': 'queued', 'files': {filename: {'stage': 'queued', 'error': ''} for filename, genome in files},
+       'file_dict': {}, 'failed': {}}
+  with jobs_lock:
+    jobs[job_id]=job
+    # only the last JOB_HISTORY jobs are kept; the oldest finished ones are removed
+    finished=[old_id for old_id, old_job in jobs.items() if old_job['status'] in ('done', 'failed')]
+    for old_id in finished[:max(0, len(jobs) - app.config['JOB_HISTORY'])]:
+      del jobs[old_id]
+  job_threads.submit(processes_job, job, files)
+  return(job_id)
+
+# retrieves a job, or aborts if it does not exist
+def gets_job(job_id):
+  with jobs_lock:
+    job=jobs.get(job_id)
+  if job is None:
+    abort(404, description='Unknown job {}' .format(job_id))
+  return(job)
+
+# runs the functions contained in plotZcurve.py on each file of the job, in the background
+def processes_job(job, files):
+  # the place of the job is given back when it ends, whatever happens
+  try:
+    runs_job(job, files)
+  finally:
+    job_slots.release()
+
+# processes the files of one job
+def runs_job(job, files):
+  job['status']='running'
+  # initializes an empty list, to contain the plot jobs sent to the R workers
+  render_jobs=[]
+  # the transformation matrix, shared with plotZcurve.py
+  tr_matrix = TR_MATRIX
+  # for each file uploaded:
+  for filename, genome in files:
+    progress=job['files'][filename]
+    # temporary folder of the result, removed if the file fails before its result is stored
+    tmp_path=None
+    # the errors of one file are reported in its stage, and the other files are still processed
+    try:
+      # the file was not valid FASTA, or contained invalid characters
+      if isinstance(genome, Exception):
+        raise genome
+      # base codes and total count of each base, found while reading the upload
+      codes, totals=genome
+      # the coordinates are stored under the hash of the sequence and of the parameters of the coordinates, so the same
+      # sequence uploaded under two names is calculated and stored only once
+      key=zcurve_cache.hashes_entry(codes, {'max_points': app.config['MAX_POINTS'], 'decimation': app.config['DECIMATION'],
+                                          'version': 4})
+      # the plots drawn on the server are stored on their own, under the key of the coordinates and of everything else
+      # drawn in the plots: the title is in the images
+      plot_key=zcurve_cache.hashes_entry(key, {'formats': ['png'], 'title': filename, 'backend': app.config['RENDER_BACKEND'],
+                                               'version': 4}) if app.config['SERVER_PLOTS'] else None
+      # if the same genome was already processed, the stored result is used and nothing is calculated
+      meta=zcurve_cache.loads_entry(app.config['DOWNLOAD_PATH'], key)
+      coord=None
+      if meta is None:
+        # the GC content, the count of each base and the skews are calculated from the counts of the bases,
+        # without reading the sequence again
+        composition=counts_composition(totals)
+        meta={'gc': round(composition['GC'],2), 'composition': composition, 'bases': int(codes.size)}
+        progress['stage']='coordinates'
+        # creates the matrix for plotting
+        coord, step=creates_matrix(codes, tr_matrix, filename)
+        # the coordinates are written in a temporary folder of the cache, which becomes the result once it is complete
+        tmp_path=zcurve_cache.creates_tmp_entry(app.config['DOWNLOAD_PATH'])
+        # the coordinates drawn by the browser are written (and compressed) once, with the result
+        writes_coord_payload(tmp_path, coord, step)
+        with metrics.measures_stage('cache_store', filename) as record:
+          zcurve_cache.commits_entry(app.config['DOWNLOAD_PATH'], key, tmp_path, meta, {'coord': coord, 'step': step})
+          record['bases']=len(coord)
+        tmp_path=None
+      # without the server plots, or if they were already drawn with the same title, the result is complete
+      if plot_key is None or zcurve_cache.loads_entry(app.config['DOWNLOAD_PATH'], plot_key) is not None:
+        records_result(job, filename, key, plot_key, meta)
+        continue
+      # the coordinates of a sequence already stored under another name are read from the cache
+      if coord is None:
+        arrays=zcurve_cache.loads_arrays(app.config['DOWNLOAD_PATH'], key)
+        coord, step=arrays['coord'], arrays['step']
+      # the plots are drawn in a temporary folder of the cache, which becomes their result once they are done
+      tmp_path=zcurve_cache.creates_tmp_entry(app.config['DOWNLOAD_PATH'])
+      # puts together the full path to the plot directory where it will be saved - Zcurve plot
+      out_name=os.path.join(tmp_path, 'zcurve')
+      # puts together the full path to the plot directory where it will be saved - WS plot
+      ws_out_name=os.path.join(tmp_path, 'zcurve_WS')
+      # sends both plots to the R workers -> in this case, they are saved only as png; the files are plotted
+      # in parallel, and the results are collected below
+      render_jobs.append((filename, key, plot_key, tmp_path, meta, submits_render(coord, step, out_name, ws_out_name, filename, progress)))
+    except Exception as error:
+      if tmp_path is not None:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+      records_failure(job, filename, error)
+  # waits until all plots are drawn
+  for filename, key, plot_key, tmp_path, meta, render_job in render_jobs:
+    try:
+      pid = render_job.result()
+      with render_lock:
+        render_state['warm_workers'].add(pid)
+      # stores the plots in the cache
+      with metrics.measures_stage('cache_store', filename) as record:
+        zcurve_cache.commits_entry(app.config['DOWNLOAD_PATH'], plot_key, tmp_path, {'title': filename}, None)
+    except Exception as error:
+      shutil.rmtree(tmp_path, ignore_errors=True)
+      records_failure(job, filename, error)
+      continue
+    records_result(job, filename, key, plot_key, meta)
+  # if the cache is now too large, the least recently used results are removed
+  zcurve_cache.evicts_entries(app.config['DOWNLOAD_PATH'], app.config['CACHE_MAX_BYTES'])
+  # with the prometheus format, the metrics file is rewritten with the records of all jobs so far
+  metrics.finishes_metrics(profile_options(), keep_records=True)
+  # the job failed only if none of its files could be processed
+  job['status']='done' if job['file_dict'] else 'failed'
+
+# records the result of one file of the job, with the paths of its plots in the cache
+def records_result(job, filename, key, plot_key, meta):
+  # adds the gc content to the dictionary under the filename key
+  job['file_dict'][filename] = [meta['gc']]
+  # retrieves the plot filename; the folder is named after the key of the plots, so files with the same name never
+  # collide; without the server plots, there is no png, and the plots are only drawn in the browser
+  plot_name = 'images/' + plot_key + '/zcurve.png' if plot_key else None
+  # adds the plot filename to the dictionary under the same key as the gc content
+  job['file_dict'][filename].append(plot_name)
+  # retrieves the plot filename
+  ws_plot_name = 'images/' + plot_key + '/zcurve_WS.png' if plot_key else None
+  # adds the plot filename to the dictionary under the same key as the gc content
+  job['file_dict'][filename].append(ws_plot_name)
+  # adds the count of each base and the skews
+  job['file_dict'][filename].append(meta['composition'])
+  # adds the key of the coordinates, which the page downloads to draw the plots in the browser
+  job['file_dict'][filename].append(key)
+  job['files'][filename]['stage']='done'
+
+# records the error of one file of the job
+def records_failure(job, filename, error):
+  # the errors raised with abort have a description for the user
+  message=getattr(error, 'description', None) or str(error)
+  job['files'][filename]['stage']='failed'
+  job['files'][filename]['error']=message
+  job['failed'][filename]=message
 
 
+# size of the blocks read from the body of the request
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# reads the files of a multipart request straight from its body: yields the name and a readable stream of each file
+# of the field, whose content is read from the body only when the stream is read; the stream of a file must be read
+# (or dropped) before the next file, and what is left of it is skipped
+def iter_uploads(field):
+  if request.mimetype != 'multipart/form-data' or 'boundary' not in request.mimetype_params:
+    abort(400, description='Please upload the files as multipart/form-data')
+  decoder=MultipartDecoder(request.mimetype_params['boundary'].encode('latin-1'))
+  # request.stream stops at the content length, and refuses bodies larger than MAX_CONTENT_LENGTH (413)
+  body=request.stream
+  # events of the body (start of a field or file, its data, end of the body), parsed as the blocks arrive
+  def iter_events():
+    while True:
+      # a body which does not follow the multipart format (e.g. cut before its end) is refused
+      try:
+        event=decoder.next_event()
+      except ValueError:
+        abort(400, description='The upload is not valid multipart/form-data')
+      if event is NEED_DATA:
+        block=body.read(UPLOAD_CHUNK_SIZE)
+        # an empty block is the end of the body; the decoder then reports the last events, or an error
+        decoder.receive_data(block or None)
+      elif isinstance(event, Epilogue):
+        return
+      else:
+        yield event
+  events=iter_events()
+  # the data of one file, until its last block
+  def iter_data():
+    for event in events:
+      if isinstance(event, Data):
+        if event.data:
+          yield event.data
+        if not event.more_data:
+          return
+  # the data events of the other fields, and of the files which were not read to the end, are skipped here
+  for event in events:
+    if isinstance(event, File) and event.name == field:
+      yield event.filename, io.BufferedReader(ChunksReader(iter_data()), UPLOAD_CHUNK_SIZE)
+
+# readable stream over blocks of bytes, so that the upload can be read (and peeked at) as a file
+class ChunksReader(io.RawIOBase):
+  def __init__(self, chunks):
+    self.chunks=chunks
+    self.pending=memoryview(b'')
+  def readable(self):
+    return(True)
+  # fills the buffer with as many bytes as possible, so the first bytes of the file (gzip header) can be peeked at
+  def readinto(self, buffer):
+    size=0
+    while size < len(buffer):
+      # the blocks are sliced without copying them
+      if not self.pending:
+        self.pending=memoryview(next(self.chunks, b''))
+        if not self.pending:
+          break
+      taken=self.pending[:len(buffer) - size]
+      buffer[size:size + len(taken)]=taken
+      self.pending=self.pending[len(taken):]
+      size+=len(taken)
+    return(size)
+
 # checks if the uploaded file exists
-def check_files(file):
+def check_files(uploaded_name):
   # retrieves the filename
-  filename=secure_filename(file.filename)
+  filename=secure_filename(uploaded_name or '')
   # if it is not an empty string
   if filename != '':
-    # extracts the file extension
-    file_ext=os.path.splitext(filename)[1]
-    # if it is not in the allowed formats
-    if file_ext not in app.config['UPLOAD_EXTENSIONS']:
+    # if it does not end with one of the allowed extensions (which can be double, e.g. .fna.gz)
+    if not filename.endswith(tuple(app.config['UPLOAD_EXTENSIONS'])):
       # server aborts
       abort(400)
-    # otherwise
+    # otherwise, returns the filename
     else:
-      # builds back the full path to the file, necessary to read it
-      full_path = os.path.join(app.config['UPLOAD_PATH'], filename)
-      # returns the filename and the path as list   
-      return(filename, full_path)
-
-# checks if the file is in FASTA format
-def checks_format(genome):
-  # opens the file
-  with open(genome, 'r') as genome_file:
-    # assign the first line of the file to a variable
-    first_line = genome_file.readline()
-    # checks if file is valid FASTA file or not
-    if not first_line.startswith('>'):
-      # server aborts
-      abort(400)
+      return(filename)
 
-# retrieves the genome sequence
-def reads_genome(genome, bases):
-  # initializes an empty string
-  seq = ''
-  # opens the file
-  with open(genome, 'r') as genome_input:
-    # reads the lines in the genome input file
-    for line in genome_input:
-      # if the line does not start with > (FASTA format)
-      if not line.startswith('>'):
-        # removes the newline and makes all letters lower case
-        fragment = line.strip().lower()
-        # checks if all nucleotides in the sequence are valid
-        for base in fragment:            
-          # if not, it raises an error and exits the script
-          if base not in bases:
-            # server aborts
-            abort(400)
-        # adds the line to the string after lowering the letters and removing the newline
-        seq+=fragment
-  # returns the genome sequence and the string to be used in the title       
-  return(seq)
-
-# defines a new function to count the GC content
-def GC_cont(seq):
-    # counts all matches of g or c in the string
-    gc = len(re.findall('[gc]', seq))
-    # calculates the length of the sequence, excluding Ns
-    tot = len(re.findall('[acgt]', seq))
-    # calculates the percentage using the whole sequence length
-    perc_gc = gc * 100 / tot
-    # returns the percentage
-    return(perc_gc)
+# reads the uploaded genome in one pass over its stream (see iter_uploads), in chunks: checks that it is in FASTA format,
+# validates the sequence, and counts the bases -> the upload is never written to disk or read twice; compressed uploads are
+# decompressed while they are read
+def reads_genome(stream, filename):
+  stream=opens_genome(stream, app.config['DECOMPRESS_THREADS'], app.config['MAX_GENOME_LENGTH'], filename)
+  # base codes of the sequence (1 byte per base) and total count of each base; a file with only a header raises InvalidInput
+  codes, totals = scans_genome(stream, filename)
+  return(codes, totals)
 
 # calculates the coordinates matrix to be plotted
-def creates_matrix(seq, tr_matrix):
-    # initializes a dictionary where the frequencies are stored
-    bases_freq = {'a':0, 'g':0, 'c':0, 't':0}
-    # initializes an empty dictionary, to contain the list of values to be plotted on the 3 axes
-    coordinates = {'x':[], 'y':[], 'z':[]}
-    # for each index in the genome
-    for i in range(len(seq)):
-        # adds to the value of the base at index i (seq[i]) 1 divided by the length of the sequence, 
-        # corresponding to the frequency of one base in the whole sequence -> cumulative frequency
-        bases_freq[seq[i]] += 1/(len(seq)+1)
-        # creates a list with the current values present in bases_freq dictionary
-        freq_values=list(bases_freq.values())
-        # for each axis in the coordinates dictionary:
-        for index,coord in enumerate(coordinates.keys()):
-            # adds to each axis' list the sum of the transformed values using the corresponding row in the tr_matrix
-            coordinates[coord].append(np.sum(freq_values*tr_matrix[index]))
-    # creates a pandas dataframe out of the vertically stackes lists from the coordinates dictionary, and
-    # labels the 3 columns as the correspondent axes
-    py_df = pd.DataFrame(data=np.column_stack(list(coordinates.values())), columns=['X', 'Y', 'Z'])
-    # converts the pandas dataframe to a R dataframe
-    with localconverter(robjects.default_converter + pandas2ri.converter):
-      r_coord = robjects.conversion.py2rpy(py_df)
-    # assigns a name to the R object
-    robjects.r.assign("r_coord", r_coord)
-    # returns the coordinates dictionary
-    return(r_coord)
-
-# imports the R function
-def get_Rfunc(script_name, module_name, library_name):
-  # defines a list of packages needed for the R function to run
-  packageNames = [library_name]
-  # imports a R package which is used ot check if the package in packageNames is installed
-  utils = rpackages.importr('utils')
-  # defines which CRAN mirror to check, commonly is 1
-  utils.chooseCRANmirror(ind=1)
-  # checks if the libraries are installed
-  packnames_to_install = [x for x in packageNames if not rpackages.isinstalled(x)]
-  # if there are libraries not previously installed:
-  if len(packnames_to_install) > 0:
-    # it installs them
-    utils.install_packages(StrVector(packnames_to_install))
-  # imports the library plot3D
-  plot3D=rpackages.importr(library_name)
-  R_func_path =os.path.join(app.config['SCRIPT_PATH'], script_name)
-  with open(R_func_path, 'r') as R_func:
-    # reads the file containing R function given in the command line, and saves it in string
-    string = R_func.read()
-  # creates a custom module, Zcurve, which contains the R function -> now this can be used as a 
-  # regular python module
-  Rmodule = STAP(string, module_name)
-  # returns the function as a python module now
-  return Rmodule
-  
+def creates_matrix(codes, tr_matrix, filename):
+    # calculates the X, Y and Z coordinates for all positions of the sequence at once, from the base codes
+    with metrics.measures_stage('coord', filename) as record:
+      coord = transforms_counts(counts_bases(codes), codes.size, tr_matrix)
+      record['bases'] = codes.size
+    # keeps at most MAX_POINTS points, since R does not need millions of points to draw a plot
+    with metrics.measures_stage('decimate', filename) as record:
+      coord, step = decimates_coord(coord, app.config['MAX_POINTS'], app.config['DECIMATION'])
+      record['bases'] = codes.size
+    # returns the coordinates and the position of each point, which are sent to R as binary arrays
+    return(coord, step)
+
+# layout of the coordinates served to the browser: 4 columns of little-endian float32 numbers, one after the other
+# (X, Y and Z of each point, then its position in the sequence), which the browser reads as they are
+COORD_PAYLOAD = 'coord.f32'
+COORD_COLUMNS = 4
+
+# writes the coordinates served to the browser in the folder of the result, as they are and compressed with gzip
+def writes_coord_payload(tmp_path, coord, step):
+  payload = np.empty((COORD_COLUMNS, len(coord)), dtype='<f4')
+  payload[:3] = coord.T
+  payload[3] = step
+  data = payload.tobytes()
+  with open(os.path.join(tmp_path, COORD_PAYLOAD), 'wb') as payload_file:
+    payload_file.write(data)
+  # compressed once here, so each view only sends the file
+  with open(os.path.join(tmp_path, COORD_PAYLOAD + '.gz'), 'wb') as payload_file:
+    payload_file.write(gzip.compress(data, compresslevel=app.config['COORD_COMPRESSION'], mtime=0))
+
+# serves the decimated coordinates of a result to the browser, which draws the Z-curve and W/S plots itself: nothing
+# is calculated, the stored file is sent (compressed with gzip if the browser accepts it), and the browser can keep it
+# since the key changes with the sequence and the settings
+@app.route('/coords/<key>')
+def coordinates(key):
+  # the key is the name of a folder of the cache, so nothing else is accepted
+  if not re.fullmatch('[0-9a-f]{64}', key):
+    abort(404)
+  meta=zcurve_cache.loads_entry(app.config['DOWNLOAD_PATH'], key)
+  # the folders of the server plots have no coordinates
+  if meta is None or 'bases' not in meta:
+    abort(404, description='Unknown result {}' .format(key))
+  payload_path=os.path.join(os.path.abspath(zcurve_cache.entry_path(app.config['DOWNLOAD_PATH'], key)), COORD_PAYLOAD)
+  compressed='gzip' in request.accept_encodings
+  response=send_file(payload_path + '.gz' if compressed else payload_path, mimetype='application/octet-stream',
+                     conditional=True, max_age=365 * 24 * 3600)
+  if compressed:
+    response.headers['Content-Encoding']='gzip'
+  response.headers['Vary']='Accept-Encoding'
+  response.cache_control.immutable=True
+  # number of points and of bases, needed to read the columns and to draw the axes
+  response.headers['X-Zcurve-Points']=str(os.path.getsize(payload_path) // (4 * COORD_COLUMNS))
+  response.headers['X-Zcurve-Bases']=str(meta['bases'])
+  return(response)
+
+# the plots are drawn by a pool of long-lived worker processes, each with its own embedded R, set up once when the
+# worker starts -> embedded R is not thread-safe, so it is never used in the flask process itself
+# warm_workers holds the pids of the workers which returned a call, so their R is set up; it is checked against the
+# workers still alive in the pool before it is reported
+render_state = {'pool': None, 'slots': None, 'warm_workers': set()}
+render_lock = threading.Lock()
+
+# starts the pool of R workers, only the first time it is needed
+def gets_render_pool():
+  with render_lock:
+    if render_state['pool'] is None:
+      # the workers are started from scratch (spawn), so they do not inherit anything from the flask process
+      render_state['pool'] = ProcessPoolExecutor(app.config['RENDER_WORKERS'], mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=metrics.initializes_process,
+                                                 initargs=(profile_options(), zcurve_render.initializes_renderer, (app.config['SCRIPT_PATH'], app.config['RENDER_BACKEND'])))
+      # one slot for each running job and each job waiting in the queue
+      render_state['slots'] = threading.BoundedSemaphore(app.config['RENDER_WORKERS'] + app.config['RENDER_QUEUE'])
+    return(render_state['pool'])
+
+# sends one file to the R workers; the coordinates are sent as binary arrays, not as a pandas dataframe
+def submits_render(coord, step, out_name, ws_out_name, filename, progress):
+  pool = gets_render_pool()
+  # back-pressure: if all slots are taken, the file waits for a free one, which is shown on the job page (the
+  # upload was already accepted, so it is not refused here)
+  if not render_state['slots'].acquire(blocking=False):
+    progress['stage'] = 'waiting'
+    render_state['slots'].acquire()
+  progress['stage'] = 'plotting'
+  job = pool.submit(zcurve_render.renders_plots, np.ascontiguousarray(coord, dtype=np.float64).tobytes(),
+                    np.ascontiguousarray(step, dtype=np.int64).tobytes(), out_name, ws_out_name, ['png'], filename)
+  # the slot is released as soon as the job is done
+  job.add_done_callback(lambda job: render_state['slots'].release())
+  return(job)
+
+# starts all R workers, and waits until each of them has set up R
+def warms_render_pool():
+  pool = gets_render_pool()
+  # the pool starts its workers one by one, only when no worker is free: the barrier keeps every call busy until all
+  # the workers took one, so each worker is started and runs the initializer, which sets up R
+  with multiprocessing.get_context('spawn').Manager() as manager:
+    barrier = manager.Barrier(app.config['RENDER_WORKERS'])
+    for job in [pool.submit(zcurve_render.warms_renderer, barrier) for _ in range(app.config['RENDER_WORKERS'])]:
+      with render_lock:
+        render_state['warm_workers'].add(job.result())
+
+# counts the R workers which are set up and still alive; the pids of the workers which stopped are removed
+def counts_warm_workers():
+  with render_lock:
+    pool = render_state['pool']
+    # _processes maps the pid of each worker of the pool to its process
+    alive = set() if pool is None else {pid for pid, process in dict(pool._processes or {}).items() if process.is_alive()}
+    render_state['warm_workers'] &= alive
+    return(len(render_state['warm_workers']))
+
+# reports if the app is running, and if the R workers are already set up (warm) or not (cold)
+@app.route('/health')
+def health():
+  # number of R workers, still alive, which already drew a plot or were warmed up
+  warm_workers = counts_warm_workers()
+  return jsonify(status='ok', r_backend='warm' if warm_workers > 0 else 'cold', render_workers=app.config['RENDER_WORKERS'],
+                 warm_workers=warm_workers)
+
+# if R_PRELOAD is set, the R workers are set up when the app starts, and not at the first request
+if app.config['R_PRELOAD'] and app.config['SERVER_PLOTS']:
+  warms_render_pool()
@@ -8,51 +8,89 @@ Title: plotZcurve.py
 This script takes a genome as input, and plots the resulting Z-curve. 
 
 - Procedure:
-1. imports all necessary python modules
-2. imports the R function, needed to generate the plots
-3. for each genome, reads the genome and stores it in a variable as a concatenated string (if the file is indeed in FASTA format)
-4. creates an empty dictionary (bases_freq), with the nucleotides (a,c,g,t) as keys and 0 as values
+1. imports all necessary python modules; the stages of steps 3-13 are in the zcurve package (zcurve/pipeline.py), found in
+the same folder as this script, which is imported only after the arguments are parsed, so that -h and the errors in the
+arguments do not wait for numpy, R or matplotlib. With --no-plot, only the GC content (and the windows) are calculated,
+and no backend is set up
+2. sets up the backend which draws the plots (zcurve/render.py): the R functions (--backend r, the default), or
+matplotlib (--backend matplotlib, zcurve/plot.py), which draws the same plots without starting R
+3. files compressed with gzip or bgzip are decompressed while they are read (the blocks of bgzip files in parallel
+threads, see zcurve/decompress.py), and are then read as the other files, as one sequence. For each other genome, finds its records with a .fai index (built once with zcurve/index.py, and reused); each record (e.g.
+each contig or chromosome) is processed on its own, reading only its bytes of the memory-mapped file; --records selects
+some of them. With --region chr:start-end, only the bases of the region are read from the memory-mapped file, and their
+coordinates are calculated from the count of the bases before the region, so they are the same as in the whole curve
+(see zcurve/index.py). Otherwise, for each record, reads the sequence and stores it in a variable as a concatenated string (if the file is indeed in FASTA format)
+(with --out-of-core, the genome is streamed in chunks instead, and the coordinates of steps 4-7 are written to a
+disk-backed array, from which the plots and the GC content are then read; with --workers, steps 4-7 are split in
+chunks calculated in parallel by a pool of processes)
+4. converts the sequence into an array of integer codes, one per nucleotide (a,g,c,t)
 5. initiliazes a matrix needed for the transformation of the Z-curve (see README.md for more info)
-6. initiliazes a new dictionary, to contain the values of the plot axes X, Y and Z
-7. reads the genome in each position, and calculates the cumulative frequency for all bases
-8. trasforms the frequencies for all bases according to the matrix, and stores the values for X, Y 
-and Z in the coordinates dictionary
-9. trasforms the dictionary into a pandas dataframe, which is then rendered into an R dataframe
-10. plotZcurve function is used on the dataframe, and the plots are saved, either in the working 
-directory or a user-defined filename, as PNG (default) or other formats. 
-11. if the -ws flag is used, the script will generate additional plot(s) only for sequence length vs Z-axis (W/S) which
+6. calculates the cumulative count of each base along the whole sequence at once (numpy.cumsum), and
+divides it by the sequence length to obtain the cumulative frequency for all bases
+7. trasforms the frequencies for all bases according to the matrix with a single matrix product, which gives
+the values for X, Y and Z (the vectorized functions are in zcurve/core.py)
+8. if the sequence is longer than --max-points, decimates the coordinates (the position of each point is kept for the
+colour scale); with R, the arrays are converted to an R dataframe column by column, while matplotlib uses them directly
+9. plotZcurve function (or its matplotlib version) is used on the coordinates, and the plots are saved, either in the working 
+directory or a user-defined filename, as PNG (default) or other formats. Each plot is drawn once, and its formats are
+saved one after the other, or at the same time with --format-jobs; the time taken by each format is printed
+10. if the -ws flag is used, the script will generate additional plot(s) only for sequence length vs Z-axis (W/S) which
 can give an indication of the GC content throughout the sequence; the plots will be saved in the same formats as the main plot
+11. if the --window flag is used, the GC content and the GC skew are calculated in sliding windows, from the cumulative
+counts of g and c (each window takes the same time, whatever its size), and written as TSV or binary numpy arrays;
+with --window-plot, they are also plotted with the plotWindows R function (WS_func.R)
+12. the coordinates (as a .npy file which can be memory-mapped) and the GC content are saved in a cache, by default in a
+.zcurve_cache folder next to the genome; when the same file is plotted again (e.g. in another format, or with -ws), steps 3-7
+are skipped and the coordinates are read from the cache. The files are found by their path, size, modification time and
+inode (or by the hash of their content, with --cache-hash); with --out-of-core, the disk-backed array is linked into the
+cache rather than copied, and the least recently used genomes are removed when the cache is larger than --cache-max-size
+13. steps 9-11 (R or matplotlib) are run in a separate render process (zcurve/render.py), while steps 3-8 of the next genome or record are run
+in this one; at most --render-queue genomes wait for R, and with --render-queue 0 the plots are drawn in this process
+14. with --profile, the wall time, CPU time, peak memory and number of bases of each stage of each genome (reading,
+coordinates, cache, decimation, windows, conversion for R and each plot) are written to a metrics file, as JSON lines or in
+the Prometheus text format, by all the processes of the run (zcurve/metrics.py); --profile-cprofile also runs the hot
+stages under cProfile
+15. with --export, all the coordinates (before the decimation of step 8) are written to <genome>_zcurve.npy, as three rows
+X, Y and Z of float32 (or float64, --export-dtype) numbers, copied chunk by chunk, so even a disk-backed array is never
+read as a whole; with --export-counts, the cumulative counts of a, g, c and t are written to <genome>_counts.npy too. Both
+files can be memory-mapped by numpy (or any tool reading .npy files) without copying them, and <genome>_zcurve.json
+describes them
 
 - Usage:
 This script reads an input genome file in a FASTA format and returns a Z-curve plot, the GC content in the sequence and optionally a W/S disparity plot. 
 
 It is run in the command line as:
 
-plotZcurve.py [-h] -i INPUT_GENOME [INPUT_GENOME ...] [-f OUTPUT_FORMAT [OUTPUT_FORMAT ...]] [-o OUTPUT_PATH] [-s SCRIPT_PATH] [-gc] [-out_gc OUTPUT_GC] [-ws]
+plotZcurve.py [-h] -i INPUT_GENOME [INPUT_GENOME ...] [-f OUTPUT_FORMAT [OUTPUT_FORMAT ...]] [-o OUTPUT_PATH] [-s SCRIPT_PATH] [-gc] [-out_gc OUTPUT_GC] [--composition] [-ws] [--out-of-core STORE_DIR] [--workers WORKERS] [--batch PROCESSES] [--max-points MAX_POINTS] [--decimation METHOD] [--cache-dir CACHE_DIR] [--no-cache] [--cache-max-size GB] [--cache-hash] [--window SIZE] [--window-step STEP] [--window-format FORMAT] [--window-plot] [--records NAME [NAME ...]] [--region REGION [REGION ...]] [--decompress-threads THREADS] [--render-queue DEPTH] [--format-jobs JOBS] [--backend BACKEND] [--no-plot] [--profile METRICS_FILE] [--profile-format FORMAT] [--profile-cprofile DIR] [--profile-tracemalloc] [--export] [--export-dtype DTYPE] [--export-counts]
 
 - List of user-defined functions:
 1. dir_path: checkes if the directory exists
-2. checks_input: checks if the genome is in FASTA format
-3. reads_genome: cretaes one string from the genome sequence and extract the filename, used later
-4. GC_cont: calculates the GC content in the sequence
-5. creates_matrix: from the genome sequence string, creates the matrix with coordinates to be plotted 
 
-plotZcurve and plotWS: custom R functions are imported; a brief description is given further down, but please refer to the R scripts for more details. 
+The functions which read the genomes, calculate the coordinates and the GC content, and send the plots to the backend
+are in the zcurve package (zcurve/pipeline.py): checks_input, reads_genome, processes_genome, writes_gc, processes_batch,
+hashes_genome, stores_cache, processes_file, names_record, prepares_plot, processes_regions, renders_plot, submits_plot
+and skips_plot; please refer to zcurve/pipeline.py for more details.
+
+plotZcurve, plotWS and plotWindows: custom R functions, loaded by zcurve/render.py with the R backend; please refer to the R scripts for more details. 
 
 
 - List of imported modules:
 1. argparse: a module which is used to input the different parameters
 2. os: to retrieve the current working directory
-3. re: to work with Regex
-4. math: to calculate the square root of 3
-5. numpy: to create a temporary matrix which will then be saved as dataframe 
-6. pandas: to create a dataframe to then input it in R
-7. rpy2 and all submodules: to install the necessary packages and to import a 
-custom function from R (detailed documentation in the code)
+3. zcurve.defaults: the choices and default values of the options, which do not need numpy
+4. multiprocessing and concurrent.futures: for --batch and the render process; collections and functools: to draw the
+plots in a separate process while the next genome is calculated
+5. zcurve.pipeline: reads and processes each genome (imports numpy and the other modules of the zcurve package)
+6. zcurve.render: to draw the plots with R (rpy2 is imported only by the R backend, when it is set up) or with
+matplotlib (zcurve/plot.py)
+7. zcurve.core: the vectorized Z-curve calculations and the transformation matrix, shared with the flask web interface
+8. zcurve.metrics: to measure each stage with --profile
+(modules 4-8 are imported after the arguments are parsed)
 
 - Possible errors addressed in the script:
 1. InvalidInput: if the input file does not start either with > (fasta format)
-2. InvalidNucleotide: if there are non-nucleotides characters in the sequence
+2. InvalidNucleotide: if there are non-nucleotides characters in the sequence; the first invalid character
+and its position are reported
 
 
 - List of known/possible bugs:
@@ -62,36 +100,23 @@ certain operating systems. However, the code still runs, so it is not addressed
 the GC content on the terminal and not in the output GC filename specified
 3. The script requires a series of python modules and R libraries. While there 
 is a check for the R library to be imported, the python modules are not checked for. 
-If for example rpy2 is not installed, this will create an error and the script 
-will exit. 
+If for example rpy2 is not installed, the R backend will create an error and the script 
+will exit (--backend matplotlib does not need rpy2 nor R). 
 I have added instructions in the README to install these packages before running the script. 
-4. The input file has to be in FASTA format, and the script will not recognize if multiple genes/genomes 
-are concatenated in the same file; they will be treated as one sequence. 
+4. The input file has to be in FASTA format. Files with multiple records are processed one record at a time,
+but only if they can be indexed (all lines of a record have the same length, except the last one), and not
+when read from the standard input or from a compressed file; otherwise, all records are still treated as one sequence. 
 
 """
 #%% IMPORT MODULES
 
 # Python modules
 import argparse
-import re
 import os 
-import math
-import numpy as np
-import pandas as pd
-
-# Modules for R
-# imports the rpy2 module
-import rpy2.robjects as robjects
-# imports rpackages, used to check if necessary R packages are installed
-import rpy2.robjects.packages as rpackages
-# for installing the packages if missing
-from rpy2.robjects.vectors import StrVector
-# creates and export to Python a custom function made in R
-from rpy2.robjects.packages import STAP
-# needed for conversion from pandas dataframe to R datraframe
-from rpy2.robjects import pandas2ri
-# needed for conversion from pandas dataframe to R datraframe
-from rpy2.robjects.conversion import localconverter
+
+# choices and default values of the options, from the zcurve package found in the same folder as this script; the
+# other modules of the package (and numpy) are imported only once the arguments are parsed
+from zcurve.defaults import DECIMATION_METHODS, WINDOW_FORMATS, DECOMPRESS_THREADS, RENDER_BACKENDS, METRICS_FORMATS, EXPORT_DTYPES
 
 #%% ARGPARSE
 
@@ -107,10 +132,10 @@ parser.add_argument(
     '-i',
     metavar = 'INPUT_GENOME',
     dest = 'genome',
-    type=argparse.FileType('r'), # readable file
+    type=argparse.FileType('rb'), # readable file, read as bytes
     required=True, 
     nargs='+', # there must be at least one argument if this flag is used
-    help="input genome(s) to calculate the Z-curve, can be more than one - example: -i zika_genome.fna ecoli_genome.fna" 
+    help="input genome(s) to calculate the Z-curve, can be more than one; files compressed with gzip or bgzip (e.g. .fna.gz) are decompressed while they are read - example: -i zika_genome.fna ecoli_genome.fna.gz" 
     )
 
 # types of plot formats to be produced - optional
@@ -143,6 +168,16 @@ parser.add_argument(
     help="path to R scripts, needed if the R scripts are not in the current working directory - example: -s scripts/" 
     )
 
+# backend - R or matplotlib, to draw the plots - optional
+parser.add_argument(
+    '--backend',
+    metavar = 'BACKEND',
+    dest = 'backend',
+    choices = RENDER_BACKENDS,
+    default = 'r',
+    help="optional: how the plots are drawn: 'r' with the R scripts (plot3D and ggplot2, through rpy2), or 'matplotlib', which draws the same plots in python and does not need R nor the -s flag (default r) - example: --backend matplotlib" 
+    )
+
 # GC content - if the user wants the GC content saved in a file instead of printed on the screen - optional
 parser.add_argument(
     '-gc', 
@@ -160,6 +195,14 @@ parser.add_argument(
     help= "optional: output file where the GC content will be written in the -gc flag is used (default 'GC_content_output.txt' in the working directory) - example: -out_gc gc_results.txt" 
     )
 
+# base composition - if the user wants the counts of each base and the GC/AT skews too - optional
+parser.add_argument(
+    '--composition',
+    dest = 'composition',
+    action="store_true",
+    help="optional: in case --composition is used, the count of A, C, G, T and N, the GC skew (G-C)/(G+C) and the AT skew (A-T)/(A+T) are reported after the GC content; they are taken from the same counts, so the sequence is not read again"
+    )
+
 # W/S plot - if the user wants also to save a W/S plot, which is an indication of GC content through the sequence
 parser.add_argument(
     '-ws', 
@@ -168,111 +211,252 @@ parser.add_argument(
     help="optional: in case -ws is used, the script will also generate a W/S plot only, corresponding to GC content; the plot(s) will be saved in the same format as the main Z-curve plot" 
     )
 
-# returns result of parsing 'parser' to the class args
-args = parser.parse_args()
-
-
-#%% CUSTOM ERRORS
-
-'Creates a new class of custom error messages in this script'
-class CustomError(Exception):
-    pass
-
-'Raised if input file is not a fasta file'
-class InvalidInput(CustomError):
-    pass
-
-'Raised if a sequence contains non-nucleotide characters'
-class InvalidNucleotide(CustomError):
-    pass
-
+# out-of-core - if the genome is larger than the memory, the coordinates are written to a disk-backed array - optional
+parser.add_argument(
+    '--out-of-core',
+    metavar = 'STORE_DIR',
+    dest = 'store_dir',
+    type=os.path.abspath, # extracts the absolute path, easier to navigate through the tree
+    default=None,
+    help="optional: streams the genome in chunks and writes the coordinates to a disk-backed array (STORE_DIR/<genome>_coord.npy), so the memory used does not grow with the genome size; the plots and the GC content are then read from that array - example: --out-of-core /scratch/zcurve"
+    )
 
-#%% IMPORTING USER-DEFINED R FUNCTION
+# workers - number of processes used to calculate the coordinates of each genome - optional
+parser.add_argument(
+    '--workers',
+    metavar = 'WORKERS',
+    dest = 'workers',
+    type=int,
+    default=1,
+    help="optional: number of processes used to calculate the coordinates of each genome; the sequence is split in chunks, which are calculated in parallel and then joined, giving the same result as with 1 worker (default 1) - example: --workers 8"
+    )
 
-# defines a list of packages needed for the R functions to run
-packageNames = ['plot3D', 'ggplot2']
-# imports a R package which is used to check if the packages in packageNames are installed
-utils = rpackages.importr('utils')
-# defines which CRAN mirror to check, commonly is 1
-utils.chooseCRANmirror(ind=1)
+# batch - number of genomes processed at the same time, each in its own process - optional
+parser.add_argument(
+    '--batch',
+    metavar = 'PROCESSES',
+    dest = 'batch',
+    type=int,
+    default=1,
+    help="optional: number of genomes of the -i list processed at the same time, each in its own process with its own R; a failing genome does not stop the others, the GC content is written in the input order and a summary with the status of each genome is printed at the end (default 1) - example: --batch 16"
+    )
 
-# checks if the libraries are installed
-packnames_to_install = [x for x in packageNames if not rpackages.isinstalled(x)]
+# maximum number of points - the coordinates are decimated before being sent to R - optional
+parser.add_argument(
+    '--max-points',
+    metavar = 'MAX_POINTS',
+    dest = 'max_points',
+    type=int,
+    default=20000,
+    help="optional: maximum number of points sent to R (or matplotlib) for each plot; longer sequences are decimated, keeping the position of each point for the colour scale (default 20000, 0 to plot every base) - example: --max-points 50000"
+    )
 
-# if there are libraries not previously installed:
-if len(packnames_to_install) > 0:
-    # it installs them
-    utils.install_packages(StrVector(packnames_to_install))
+# decimation method - how the points are chosen when the sequence is longer than --max-points - optional
+parser.add_argument(
+    '--decimation',
+    metavar = 'METHOD',
+    dest = 'decimation',
+    choices=DECIMATION_METHODS,
+    default='lttb',
+    help="optional: how the points are chosen when the sequence is longer than --max-points: 'stride' (fixed distance), 'minmax' (minimum and maximum of each axis in each bucket) or 'lttb' (shape-preserving Largest-Triangle-Three-Buckets in 3D) (default lttb) - example: --decimation minmax"
+    )
 
-# imports the libraries from R
-plot3D=rpackages.importr('plot3D')
-plot3D=rpackages.importr('ggplot2')
+# cache directory - where the coordinates and the GC content of each genome are saved - optional
+parser.add_argument(
+    '--cache-dir',
+    metavar = 'CACHE_DIR',
+    dest = 'cache_dir',
+    type=os.path.abspath, # extracts the absolute path, easier to navigate through the tree
+    default=None,
+    help="optional: folder where the coordinates and the GC content are cached, so that plotting the same file again (e.g. in another format, or with -ws) does not calculate them again (default: a .zcurve_cache folder next to each genome) - example: --cache-dir ~/.cache/zcurve"
+    )
 
+# no cache - the coordinates are always calculated, and never saved - optional
+parser.add_argument(
+    '--no-cache',
+    dest = 'use_cache',
+    action="store_false",
+    help="optional: in case --no-cache is used, the coordinates are always calculated from the genome, and the cache is neither read nor written"
+    )
 
-# Z-curve custom R script
-Zplot_func_path = args.script_path + '/Zcurve_func.R'
+# cache size - maximum size of each cache folder - optional
+parser.add_argument(
+    '--cache-max-size',
+    metavar = 'GB',
+    dest = 'cache_max_size',
+    type=float,
+    default=10,
+    help="optional: maximum size of the cache folder in GB (the coordinates take 24 bytes per base); when it is larger, the genomes which were not plotted for the longest time are removed, and a genome larger than the whole cache is not saved (default 10, 0 for no limit) - example: --cache-max-size 50"
+    )
 
-# opens the file
-with open(Zplot_func_path, 'r') as R_func:
-    # reads the file containing R function given in the command line, and saves it in string
-    string1 = R_func.read()
+# cache hash - the cache key is the hash of the content of the file - optional
+parser.add_argument(
+    '--cache-hash',
+    dest = 'cache_hash',
+    action="store_true",
+    help="optional: in case --cache-hash is used, the genomes are found in the cache by the SHA-256 hash of their content (read once more at each run), so copies and moved files are found too; by default, they are found by their path, size, modification time and inode, without reading them"
+    )
 
-# creates a custom module, Zcurve, which contains the R function -> now this can be used as a 
-# regular python module -> will be called as Zcurve.plotZcurve
-Zcurve = STAP(string1, 'Zcurve')
+# records - names of the records of multi-record files to be plotted - optional
+parser.add_argument(
+    '--records',
+    metavar = 'NAME',
+    dest = 'records',
+    nargs='+', # there must be at least one argument if this flag is used
+    default=None,
+    help="optional: names of the records (the first word of their header, e.g. chr1) to be plotted; by default, each record of a multi-record file is plotted on its own, as <genome>_<record> - example: --records chr1 chr2"
+    )
 
-# description of parameters for Zcurve R function
-'''plotZcurve function
+# decompression - number of threads decompressing the bgzip files - optional
+parser.add_argument(
+    '--decompress-threads',
+    metavar = 'THREADS',
+    dest = 'decompress_threads',
+    type=int,
+    default=DECOMPRESS_THREADS,
+    help="optional: number of threads decompressing the input files compressed with bgzip, whose blocks can be decompressed in parallel (files compressed with gzip are decompressed in one thread) (default: the number of CPUs, at most {}) - example: --decompress-threads 8" .format(DECOMPRESS_THREADS)
+    )
 
-    Parameters:
-    r_coord: R dataframe
-        dataframe containing the values for X, Y and Z to be plotted
+# rendering pipeline - number of genomes whose plots can wait for R - optional
+parser.add_argument(
+    '--render-queue',
+    metavar = 'DEPTH',
+    dest = 'render_queue',
+    type=int,
+    default=2,
+    help="optional: the plots are drawn in a separate process, while the next genomes are read and calculated; at most DEPTH genomes can wait for their plots, which caps the memory used by their coordinates (0 to draw the plots of each genome before reading the next one, as before; not used with --batch) (default 2) - example: --render-queue 4"
+    )
 
-    outname: string
-        full path to generate the output plot
+# format jobs - number of formats of each plot saved at the same time - optional
+parser.add_argument(
+    '--format-jobs',
+    metavar = 'JOBS',
+    dest = 'format_jobs',
+    type=int,
+    default=1,
+    help="optional: each plot is drawn once and then saved in all the formats of -f, one after the other by default; with JOBS above 1, up to JOBS formats are saved at the same time, each in its own forked process (R) or thread (raster formats with matplotlib) (0 for all of them, up to the number of CPUs; 1 with --batch); the time taken by each format is printed (default 1) - example: --format-jobs 2"
+    )
 
-    args.out_format: list
-        list of all formats in which to save the plots
+# regions - intervals of the records to be plotted - optional
+parser.add_argument(
+    '--region',
+    metavar = 'REGION',
+    dest = 'regions',
+    nargs='+', # there must be at least one argument if this flag is used
+    default=None,
+    help="optional: regions to be plotted, as name:start-end (1-based and inclusive, as in samtools faidx); only the bases of each region are read, and the coordinates are the same as in the Z-curve of the whole record - example: --region chr1:1,000,001-1,200,000"
+    )
 
-    file_name: string
-        used for main title of the plot
+# sliding windows - size of the windows of the GC content and GC skew profile - optional
+parser.add_argument(
+    '--window',
+    metavar = 'SIZE',
+    dest = 'window',
+    type=int,
+    default=None,
+    help="optional: if --window is used, the GC content and the GC skew (G-C)/(G+C) are calculated in sliding windows of SIZE bases, and written to <genome>_windows.tsv in the output directory - example: --window 10000"
+    )
 
-    Returns:
-        Zcurve plots
+# sliding windows - distance between the starts of two windows - optional
+parser.add_argument(
+    '--window-step',
+    metavar = 'STEP',
+    dest = 'window_step',
+    type=int,
+    default=None,
+    help="optional: number of bases between the starts of two consecutive windows (default: the window size, so the windows do not overlap) - example: --window-step 1000"
+    )
 
-'''
+# sliding windows - format of the profile - optional
+parser.add_argument(
+    '--window-format',
+    metavar = 'FORMAT',
+    dest = 'window_format',
+    choices=WINDOW_FORMATS,
+    default='tsv',
+    help="optional: format of the sliding-window profile: 'tsv' (text, with a header) or 'npz' (binary numpy arrays, one per column) (default tsv) - example: --window-format npz"
+    )
 
-# WS custom R script
-WSplot_func_path = args.script_path + '/WS_func.R'
+# sliding windows - plot of the profile - optional
+parser.add_argument(
+    '--window-plot',
+    dest = 'window_plot',
+    action="store_true",
+    help="optional: in case --window-plot is used, the GC content, GC skew and cumulative GC skew of the windows are also plotted, in the same formats as the main Z-curve plot"
+    )
 
-# opens the file
-with open(WSplot_func_path, 'r') as WS_func:
-    # reads the file containing R function given in the command line, and saves it in string
-    string2 = WS_func.read()
+# no plot - only the GC content (and the windows) are calculated - optional
+parser.add_argument(
+    '--no-plot',
+    dest = 'no_plot',
+    action="store_true",
+    help="optional: in case --no-plot is used, only the GC content (and with --window the sliding-window profile) are calculated and written, and no plot is drawn, so neither R nor matplotlib is loaded"
+    )
 
-# saves the R function in a custom python module -> will be called as WSplot.plotWS
-WSplot = STAP(string2, 'WSplot')
+# export - all the coordinates, written as columnar .npy files - optional
+parser.add_argument(
+    '--export',
+    dest = 'export',
+    action="store_true",
+    help="optional: in case --export is used, all the coordinates (not decimated) are written to <genome>_zcurve.npy in the output directory, as 3 rows (X, Y, Z) which numpy can memory-map, with a description in <genome>_zcurve.json"
+    )
 
-# description of parameters for WS R function
-'''plotWS function
+# export dtype - type of the exported coordinates - optional
+parser.add_argument(
+    '--export-dtype',
+    metavar = 'DTYPE',
+    dest = 'export_dtype',
+    choices=EXPORT_DTYPES,
+    default='float32',
+    help="optional: with --export, type of the exported coordinates: 'float32' (half the size) or 'float64' (the values used for the plots) (default float32) - example: --export-dtype float64"
+    )
 
-    Parameters:
-    r_coord: R dataframe
-        dataframe containing the values for X, Y and Z to be plotted
+# export counts - cumulative counts of each base - optional
+parser.add_argument(
+    '--export-counts',
+    dest = 'export_counts',
+    action="store_true",
+    help="optional: with --export, the cumulative counts of a, g, c and t at each position are written to <genome>_counts.npy too, as 4 rows of unsigned integers"
+    )
 
-    outname: string
-        full path to generate the output plot
+# profile - file where the time and memory of each stage are written - optional
+parser.add_argument(
+    '--profile',
+    metavar = 'METRICS_FILE',
+    dest = 'profile',
+    type=os.path.abspath, # extracts the absolute path, as the file is also written by the worker processes
+    default=None,
+    help="optional: writes the wall time, CPU time, peak memory (RSS) and number of bases of each stage (read, coord, cache_load, cache_store, decimate, windows, convert, plot_zcurve, plot_ws...) of each genome to METRICS_FILE, one JSON line per stage - example: --profile metrics.jsonl"
+    )
 
-    args.out_format: list
-        list of all formats in which to save the plots
+# profile format - JSON lines or Prometheus text format - optional
+parser.add_argument(
+    '--profile-format',
+    metavar = 'FORMAT',
+    dest = 'profile_format',
+    choices=METRICS_FORMATS,
+    default='jsonl',
+    help="optional: format of the --profile file: 'jsonl' (one JSON object per stage and genome) or 'prometheus' (text format of Prometheus, with the last value of each stage of each genome and the totals of each stage) (default jsonl) - example: --profile-format prometheus"
+    )
 
-    file_name: string
-        used for main title of the plot
+# profile cProfile - folder where the cProfile files of the hot stages are written - optional
+parser.add_argument(
+    '--profile-cprofile',
+    metavar = 'DIR',
+    dest = 'profile_cprofile',
+    type=os.path.abspath, # extracts the absolute path, as the files are also written by the worker processes
+    default=None,
+    help="optional: with --profile, the hot stages (reading, coordinates, decimation, windows, conversion and plots) are also run under cProfile, and their statistics are written to DIR/<genome>_<stage>_<pid>.prof, which can be read with pstats or snakeviz - example: --profile-cprofile profiles"
+    )
 
-    Returns:
-        W/S plots
+# profile tracemalloc - peak memory allocated by each stage - optional
+parser.add_argument(
+    '--profile-tracemalloc',
+    dest = 'profile_tracemalloc',
+    action="store_true",
+    help="optional: with --profile, the peak memory allocated by python and numpy during each stage is measured too, with tracemalloc (which slows the allocations down)"
+    )
 
-'''
 
 #%% USER-DEFINED PYTHON FUNCTIONS
 
@@ -298,197 +482,152 @@ def dir_path(string):
     else:
         raise argparse.ArgumentTypeError("{path_dir} is not a valid path")
 
-'''CHECKS_INPUT
-
-    Parameters
-    ----------
-    genome : file
-        input genome file
-
-'''
-
-def checks_input(genome):
-    # assign the first line of the file to a variable
-    first_line = genome.readline()
-    # checks if file is valid FASTA file or not
-    if not first_line.startswith('>'):
-        raise InvalidInput('Your input file {} is not valid. Please insert a fasta file' .format(genome))
-
-
-'''READS_GENOME
-
-    Parameters
-    ----------
-    genome: file
-        input genome file
-
-    bases: set
-        set containing allowed nucleotides
-
-    Returns
-    -------
-    seq: string
-        genome sequence in one string
-
-    plot_main: string
-        filename without extensions, to be used as title of the plot(s)
-
-'''
-
-def reads_genome(genome, bases):
-    # initializes an empty string
-    seq = ''
-
-    # extracts the filename to be used as title of the plot: splits by /, and retrieves the last element
-    # which is going to be the name, and keeps only the name and not the file format eg '.fna'; 
-    # will also be sued for the output
-    plot_main=genome.name.split('/')[-1].split('.')[0]
-
-    # reads the lines in the genome input file
-    for line in genome:
-        # if the line does not start with > (FASTA format)
-        if not line.startswith('>'):
-            # removes newline and makes all letters lower case
-            fragment = line.strip().lower()
-            # checks if all nucleotides in the sequence are valid
-            for base in fragment:
-                # if not, it raises an error and exits the script
-                if base not in bases:
-                    raise InvalidNucleotide('Your input file contain unvalid nucleotides. Please insert a valid input fasta file')
-            # adds the line to the string after lowering the letters and removing the newline
-            seq+=fragment
-    # returns the genome sequence and the string to be used in the title       
-    return(seq, plot_main)
-
-''' GC_CONT
-
-    Parameters
-    ----------
-    seq : string
-        nucleotide sequence
-
-    Returns
-    -------
-    gc_cont: float
-        GC percentage in the sequence
-'''
-
-# defines a new function to count the GC content
-def GC_cont(seq):
-    # counts all matches of G or C in the string
-    gc = len(re.findall('[gc]', seq))
-    # calculates the length of the sequence, excluding Ns
-    tot = len(re.findall('[acgt]', seq))
-    # calculates the percentage using the whole sequence length
-    perc_gc = gc * 100 / tot
-    # returns the percentage
-    return(perc_gc)
-
-
-''' CREATES_MATRIX
-
-    Parameters
-    ----------
-    seq : string
-        nucleotide sequence
-
-    tr_matrix: numpy.array
-        transformation matrix to calculate the coordinates
-
-    Returns
-    -------
-    r_coord: R object
-        R-compatible dataframe to be used in the R functions
-
-'''
-
-def creates_matrix(seq, tr_matrix):
-    # initializes a dictionary where the frequencies are stored
-    bases_freq = {'a':0, 'g':0, 'c':0, 't':0}
-
-    # initializes an empty dictionary, to contain the list of values to be plotted on the 3 axes
-    coordinates = {'x':[], 'y':[], 'z':[]}
-
-    # for each index in the genome
-    for i in range(len(seq)):
-        # adds to the value of the base at index i (seq[i]) 1 divided by the length of the sequence, 
-        # corresponding to the frequency of one base in the whole sequence -> cumulative frequency
-        bases_freq[seq[i]] += 1/(len(seq)+1)
-        # creates a list with the current values present in bases_freq dictionary
-        freq_values=list(bases_freq.values())
-        # for each axis in the coordinates dictionary:
-        for index,coord in enumerate(coordinates.keys()):
-            # adds to each axis' list the sum of the transformed values using the corresponding row in the tr_matrix
-            coordinates[coord].append(np.sum(freq_values*tr_matrix[index]))
-    # creates a pandas dataframe out of the vertically stackes lists from the coordinates dictionary, and
-    # labels the 3 columns as the correspondent axes
-    py_df = pd.DataFrame(data=np.column_stack(list(coordinates.values())), columns=['X', 'Y', 'Z'])
-    # converts the pandas dataframe to a R dataframe
-    with localconverter(robjects.default_converter + pandas2ri.converter):
-      r_coord = robjects.conversion.py2rpy(py_df)
-    # assigns a name to the R object
-    robjects.r.assign("r_coord", r_coord)
-    # returns the R objects to be plotted
-    return(r_coord)
-
 
 #%% MAIN
 
-out_path=dir_path(args.out_path)
-
-# defines the transformation matrix
-tr_matrix = np.array([[1,1,-1,-1], [1,1,-1,-1], [1,-1,-1,1]])
-# multiplies the matrix for the square root of 3 divided by 4
-tr_matrix = tr_matrix*math.sqrt(3)/4
-# -> needed for the Z-curve calculations
-# initializes a set to check if the sequence contains other characters than nucleotides
-bases = set(['a', 'c', 'g', 't'])
-
-# if -gc flag is used, this will be True
-if args.save_gc:
-    # opens the out_gc as writable file
-    fileOut=open(args.out_gc, 'w')
-# if not, prints to console
-else:
-    print('The GC content will be printed to the terminal. If you want to save the GC content in an output file, please add the -gc flag to the command')
-
-# for each genome in the list provided after the -i flag
-for genome_input in args.genome:
-    # checks if the input is in FASTA format
-    checks_input(genome_input)
-    # extracts the sequence and the genome filename and saves them in a list
-    params=reads_genome(genome_input, bases)
-    # assigns the first element of the list (the whole genome sequence) to seq
-    seq=params[0]
-    # assigns the genome filename
-    file_name=params[1]
-    # after the file has been read, it calculates the GC content on the whole genome
-    gc_file = GC_cont(seq)
-    # if the -gc flag is used
+# the main part runs only when the script is called from the command line, and not when it is
+# imported again by the worker processes used with --workers
+if __name__ == '__main__':
+    # returns result of parsing 'parser' to the class args
+    args = parser.parse_args()
+
+    out_path=dir_path(args.out_path)
+    # checks the directory of the disk-backed arrays, if the --out-of-core flag is used
+    if args.store_dir:
+        dir_path(args.store_dir)
+    # the windows must contain at least one base, and start at least one base apart
+    if (args.window is not None and args.window < 1) or (args.window_step is not None and args.window_step < 1):
+        parser.error('--window and --window-step must be positive integers')
+    if args.workers < 1 or args.batch < 1:
+        parser.error('--workers and --batch must be positive integers')
+    # 0 plots every base, but a negative number of points has no meaning
+    if args.max_points < 0:
+        parser.error('--max-points cannot be negative')
+    if args.decompress_threads < 1:
+        parser.error('--decompress-threads must be a positive integer')
+    if args.render_queue < 0:
+        parser.error('--render-queue cannot be negative')
+    if args.format_jobs < 0:
+        parser.error('--format-jobs cannot be negative')
+    if args.cache_max_size < 0:
+        parser.error('--cache-max-size cannot be negative')
+    # the R process of the rendering pipeline would only fail when it starts, so the R scripts are checked first
+    for script_name in ['Zcurve_func.R', 'WS_func.R', 'formats_func.R'] if args.backend == 'r' and not args.no_plot else []:
+        if not os.path.isfile(os.path.join(args.script_path, script_name)):
+            parser.error('{} not found in {}, please check -s' .format(script_name, args.script_path))
+    if args.window_step is not None and args.window is None:
+        parser.error('--window-step needs --window')
+    if (args.profile_cprofile or args.profile_tracemalloc) and not args.profile:
+        parser.error('--profile-cprofile and --profile-tracemalloc need --profile')
+    if args.export_counts and not args.export:
+        parser.error('--export-counts needs --export')
+    # the regions already select their records
+    if args.records and args.regions:
+        parser.error('--records and --region cannot be used together')
+
+    # the modules needed to process the genomes are imported only now, after the arguments are checked
+    import collections
+    import functools
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from zcurve import pipeline, render, metrics
+    from zcurve.core import TR_MATRIX
+
+    # with --profile, each stage of each genome is measured, in this process and in the worker processes, which all
+    # write to the same metrics file; the records of a previous run are removed
+    profile = {'path': args.profile, 'format': args.profile_format, 'cprofile_dir': args.profile_cprofile,
+               'tracemalloc': args.profile_tracemalloc} if args.profile else None
+    metrics.enables_metrics(profile, new_file=True)
+
+    # the transformation matrix, needed for the Z-curve calculations
+    tr_matrix = TR_MATRIX
+
+    # if -gc flag is used, this will be True
     if args.save_gc:
-        # prints the filename and the GC content to the out_gc file
-        fileOut.write('{}: {:.2f}%\n' .format(file_name, gc_file))
-    # if not, prints to the terminal
+        # opens the out_gc as writable file
+        fileOut=open(args.out_gc, 'w')
+    # if not, prints to console
     else:
-        # prints the filename and the GC content to the console
-        print('{}: {:.2f}%' .format(file_name, gc_file))
-    # combines the output plot name for the Z-curve plot
-    out_name=f'{out_path}/{file_name}'
-    # creates the matrix needed to run the plotting function
-    plot_matrix=creates_matrix(seq, tr_matrix)
-    # message for the user
-    print('Plotting the Z-curve for {}...' .format(file_name))
-    # executes the R function and generates the plot(s)
-    Zcurve.plotZcurve(plot_matrix, out_name, args.out_format, file_name)
-    # if the -ws flag is used
-    if args.plot_ws:
-        # combines the output plot name for the WS plot
-        ws_out_name = f'{out_path}/{file_name}_WS'
-        # message for the user
-        print('Plotting the W/S plot for {}...' .format(file_name))
-        # executes the plotWS R function and generates the W/S plot(s)
-        WSplot.plotWS(plot_matrix, ws_out_name, args.out_format, file_name)
-
-# we have to close the output file, but only if the -gc flag was used
-if args.save_gc:
-    fileOut.close()
\ No newline at end of file
+        fileOut=None
+        print('The GC content will be printed to the terminal. If you want to save the GC content in an output file, please add the -gc flag to the command')
+
+    # options shared by all genomes, to read them and calculate their coordinates
+    options = {'out_path': out_path, 'store_dir': args.store_dir, 'workers': args.workers,
+               'max_points': args.max_points, 'decimation': args.decimation,
+               'use_cache': args.use_cache, 'cache_dir': args.cache_dir, 'cache_hash': args.cache_hash,
+               'cache_max_bytes': int(args.cache_max_size * 2**30) if args.cache_max_size else None,
+               'window': args.window, 'window_step': args.window_step, 'window_format': args.window_format,
+               'records': args.records, 'regions': args.regions, 'decompress_threads': args.decompress_threads,
+               'export': {'dtype': args.export_dtype, 'counts': args.export_counts} if args.export else None}
+    # options of the plots, used when they are drawn
+    # with --batch, the genomes are already drawn at the same time, so by default the formats of each plot are saved one
+    # after the other
+    format_jobs = 1 if args.format_jobs == 0 and args.batch > 1 else args.format_jobs
+    render_options = {'out_format': args.out_format, 'plot_ws': args.plot_ws, 'window_plot': args.window_plot, 'format_jobs': format_jobs}
+    # with --no-plot, the plots are skipped and no backend is set up; the points are still chosen (prepares_plot), so
+    # the cheapest decimation is used
+    if args.no_plot:
+        render_options = None
+        options['decimation'] = 'stride'
+
+    # if the --batch flag is used, the genomes are spread across a pool of processes
+    if args.batch > 1:
+        # the worker processes are started from scratch (spawn), and each of them loads its own R (not with --no-plot)
+        pool_context = multiprocessing.get_context('spawn')
+        initializer, initargs = (None, ()) if args.no_plot else (render.initializes_renderer, (args.script_path, args.backend))
+        # each worker also sets up its metrics, with --profile
+        with ProcessPoolExecutor(args.batch, mp_context=pool_context, initializer=metrics.initializes_process,
+                                 initargs=(profile, initializer, initargs)) as pool:
+            # the results are returned in the same order as the input genomes
+            genome_paths = [genome_input.name for genome_input in args.genome]
+            results = list(pool.map(pipeline.processes_batch, genome_paths, [tr_matrix]*len(genome_paths), [options]*len(genome_paths),
+                                    [render_options]*len(genome_paths)))
+        # writes the GC content in the input order, only for the genomes which did not fail
+        for result in results:
+            for file_name, totals in result['results']:
+                pipeline.writes_gc(file_name, totals, fileOut, args.composition)
+        # prints a summary with the status of each genome
+        print('Summary: {} of {} genomes processed' .format(sum(result['status'] == 'ok' for result in results), len(results)))
+        for result in results:
+            print('  {}: {} ({:.1f} s) {}' .format(result['genome'], result['status'], result['time'], result['error']))
+    # otherwise, the genomes are processed one after the other, and the plots are drawn in a separate process while the
+    # next genome is read and calculated (rpy2 keeps the GIL while R runs, and matplotlib mostly does, so a thread would
+    # not overlap)
+    elif args.render_queue > 0 and not args.no_plot:
+        # the render process is started from scratch (spawn), and sets up its own backend once (zcurve/render.py)
+        pool_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(1, mp_context=pool_context, initializer=metrics.initializes_process,
+                                 initargs=(profile, render.initializes_renderer, (args.script_path, args.backend))) as render_pool:
+            # plots sent to the render process and not finished yet
+            pending = collections.deque()
+            renders = functools.partial(pipeline.submits_plot, render_pool=render_pool, pending=pending, depth=args.render_queue, **render_options)
+            # for each genome in the list provided after the -i flag
+            for genome_input in args.genome:
+                # reads the genome (each of its records, for multi-record files), writes the GC content and sends the plot(s) to the render process
+                for file_name, totals in pipeline.processes_file(genome_input, tr_matrix, renders, **options):
+                    pipeline.writes_gc(file_name, totals, fileOut, args.composition)
+            # waits for the last plots, and raises the errors of the backend, if any
+            while pending:
+                pending.popleft().result()
+    # with --render-queue 0 (or --no-plot), the plots of each genome are drawn in this process, before the next genome is read
+    else:
+        # sets up the backend in this process: imports the R functions, or matplotlib; with --no-plot, the plots are skipped
+        if args.no_plot:
+            renders = pipeline.skips_plot
+        else:
+            render.initializes_renderer(args.script_path, args.backend)
+            renders = functools.partial(pipeline.renders_plot, **render_options)
+        # for each genome in the list provided after the -i flag
+        for genome_input in args.genome:
+            # reads the genome (each of its records, for multi-record files), writes the GC content and generates the plot(s)
+            for file_name, totals in pipeline.processes_file(genome_input, tr_matrix, renders, **options):
+                pipeline.writes_gc(file_name, totals, fileOut, args.composition)
+
+    # we have to close the output file, but only if the -gc flag was used
+    if args.save_gc:
+        fileOut.close()
+
+    # with the prometheus format, the records of all processes are converted to the text format
+    if profile:
+        metrics.finishes_metrics(profile)
+        print('The time and memory of each stage were written to {}' .format(args.profile))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve (package)
+
+- General description:
+The zcurve package contains everything plotZcurve.py and the web interface share: the Z-curve calculations, the cache,
+the index of multi-record files, the decompression of gzip/bgzip files, the processing of one genome file and the
+backends which draw the plots. It is found in the scripts folder of the repo; once that folder is in the python path
+(as plotZcurve.py and the web interface do), it is imported as a regular package:
+
+    import zcurve
+    coord = zcurve.core.calculates_coord(seq, zcurve.core.TR_MATRIX)
+
+Importing the package itself is cheap: each module is imported only the first time it is used (zcurve.core imports
+numpy, zcurve.render sets up R or matplotlib only when asked to), so plotZcurve.py -h does not load any of them.
+
+- List of modules:
+1. defaults: choices and default values of the options, without any dependency
+2. core: the vectorized Z-curve calculations
+3. cache: the content-addressed cache of the coordinates
+4. index: the .fai index of multi-record FASTA files, and the regions
+5. decompress: reading of the files compressed with gzip or bgzip
+6. pipeline: the stages which process one genome file, used by plotZcurve.py
+7. render: sets up the backend (R or matplotlib) and draws the plots
+8. plot: the matplotlib backend
+9. metrics: the time and memory of each stage, with --profile
+
+- List of imported modules:
+1. importlib: to import the modules the first time they are used
+
+"""
+#%% IMPORT MODULES
+
+import importlib
+
+# modules of the package, imported the first time they are used
+__all__ = ['defaults', 'core', 'cache', 'index', 'decompress', 'pipeline', 'render', 'plot', 'metrics']
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''__GETATTR__
+
+    Parameters
+    ----------
+    name: string
+        name of the module, one of __all__
+
+    Returns
+    -------
+    module: python module
+        the module of the package, imported now if it was not imported yet
+
+'''
+
+def __getattr__(name):
+    if name in __all__:
+        return(importlib.import_module('.' + name, __name__))
+    raise AttributeError('module {} has no attribute {}' .format(__name__, name))
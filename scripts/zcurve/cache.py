@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/cache.py
+
+- General description:
+This module stores the results of a genome (GC content, coordinates and plots) in a content-addressed cache on disk,
+so that the same sequence with the same parameters is never processed twice. Each result is stored in its own
+folder, named after the SHA-256 hash of the sequence and of the parameters: two different files with the same name
+never overwrite each other. Only the parameters given to hashes_entry are in the key: the web interface stores the
+coordinates without the filename, so the same sequence uploaded under two names is calculated and stored only once, and
+its server plots, whose title is the filename, in another result keyed by the coordinates and the title.
+
+- Procedure:
+1. the key of a result is the hash of the sequence and of the parameters used to calculate and plot it
+2. a new result is first written in a temporary folder, which is renamed to its key only when it is complete,
+so a result which is still being written is never read
+3. each time a result is read, the modification time of its meta.json file is updated: when the cache is larger
+than its maximum size, the results which were not used for the longest time are removed first (LRU)
+
+- List of user-defined functions:
+1. hashes_entry: calculates the key of a result
+2. entry_path: returns the folder of a result
+3. loads_entry: reads the metadata of a result, if it is in the cache
+4. creates_tmp_entry: creates the temporary folder of a new result
+5. commits_entry: writes the metadata and the arrays of a new result, and moves it to its final folder
+6. loads_arrays: reads the arrays of a result
+7. evicts_entries: removes the least recently used results, until the cache is below its maximum size, and the
+temporary folders left behind
+
+- List of imported modules:
+1. os, shutil, time, uuid: to create, rename and remove the folders
+2. hashlib, json: to calculate the keys and to store the metadata
+3. numpy: to store the arrays
+
+"""
+#%% IMPORT MODULES
+
+import os
+import shutil
+import time
+import uuid
+import hashlib
+import json
+import numpy as np
+
+# name of the metadata file of each result; its modification time is the last time the result was used
+META_NAME = 'meta.json'
+# name of the file containing the arrays of each result
+ARRAYS_NAME = 'arrays.npz'
+# prefix of the temporary folders, which are removed by evicts_entries only once they are older than TMP_MAX_AGE
+TMP_PREFIX = 'tmp-'
+# age in seconds after which a temporary folder is considered left behind (e.g. by a process which was killed): 1 day
+TMP_MAX_AGE = 24 * 3600
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''HASHES_ENTRY
+
+    Parameters
+    ----------
+    seq: string, bytes or numpy.array
+        nucleotide sequence, or its base codes
+
+    params: dict
+        parameters used to calculate and plot the result; they must be serializable as JSON
+
+    Returns
+    -------
+    key: string
+        SHA-256 hash of the sequence and of the parameters, as 64 hexadecimal characters
+
+'''
+
+def hashes_entry(seq, params):
+    if isinstance(seq, str):
+        seq = seq.encode('ascii')
+    sha = hashlib.sha256(seq)
+    # the parameters are sorted, so the same parameters always give the same key
+    sha.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return(sha.hexdigest())
+
+
+'''ENTRY_PATH
+
+    Parameters
+    ----------
+    cache_dir: string
+        folder of the cache
+
+    key: string
+        key of the result
+
+    Returns
+    -------
+    path: string
+        folder of the result
+
+'''
+
+def entry_path(cache_dir, key):
+    return(os.path.join(cache_dir, key))
+
+
+'''LOADS_ENTRY
+
+    Parameters
+    ----------
+    cache_dir: string
+        folder of the cache
+
+    key: string
+        key of the result
+
+    Returns
+    -------
+    meta: dict
+        metadata of the result, or None if the result is not in the cache
+
+'''
+
+def loads_entry(cache_dir, key):
+    meta_path = os.path.join(entry_path(cache_dir, key), META_NAME)
+    try:
+        with open(meta_path, 'r') as meta_file:
+            meta = json.load(meta_file)
+        # the result was just used, so it is the last one to be removed
+        os.utime(meta_path)
+    except (FileNotFoundError, ValueError):
+        return(None)
+    return(meta)
+
+
+'''CREATES_TMP_ENTRY
+
+    Parameters
+    ----------
+    cache_dir: string
+        folder of the cache
+
+    Returns
+    -------
+    tmp_path: string
+        temporary folder, where the files of the new result (e.g. the plots) can be written
+
+'''
+
+def creates_tmp_entry(cache_dir):
+    tmp_path = os.path.join(cache_dir, TMP_PREFIX + uuid.uuid4().hex)
+    os.makedirs(tmp_path)
+    return(tmp_path)
+
+
+'''COMMITS_ENTRY
+
+    Parameters
+    ----------
+    cache_dir: string
+        folder of the cache
+
+    key: string
+        key of the result
+
+    tmp_path: string
+        temporary folder of the result, as returned by creates_tmp_entry
+
+    meta: dict
+        metadata of the result, serializable as JSON
+
+    arrays: dict
+        numpy arrays of the result, saved in one .npz file, or None if the arrays were already written in tmp_path
+
+    Returns
+    -------
+    path: string
+        final folder of the result
+
+'''
+
+def commits_entry(cache_dir, key, tmp_path, meta, arrays):
+    if arrays is not None:
+        np.savez(os.path.join(tmp_path, ARRAYS_NAME), **arrays)
+    # the metadata is written last, since a folder without meta.json is not a valid result
+    with open(os.path.join(tmp_path, META_NAME), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    path = entry_path(cache_dir, key)
+    # the folder is renamed in one step, so the result appears complete or not at all
+    try:
+        os.rename(tmp_path, path)
+    # if the same result was stored in the meantime, the new copy is not needed
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    return(path)
+
+
+'''LOADS_ARRAYS
+
+    Parameters
+    ----------
+    cache_dir: string
+        folder of the cache
+
+    key: string
+        key of the result
+
+    Returns
+    -------
+    arrays: dict
+        numpy arrays of the result
+
+'''
+
+def loads_arrays(cache_dir, key):
+    with np.load(os.path.join(entry_path(cache_dir, key), ARRAYS_NAME)) as arrays:
+        return(dict(arrays))
+
+
+'''EVICTS_ENTRIES
+
+    Parameters
+    ----------
+    cache_dir: string
+        folder of the cache
+
+    max_bytes: int
+        maximum size of the cache, in bytes
+
+    Returns
+    -------
+    removed: list
+        keys of the removed results
+
+'''
+
+def evicts_entries(cache_dir, max_bytes):
+    entries = []
+    total = 0
+    for key in os.listdir(cache_dir):
+        path = entry_path(cache_dir, key)
+        meta_path = os.path.join(path, META_NAME)
+        # a temporary folder may still be written, unless it is much older than any result takes to be written
+        if key.startswith(TMP_PREFIX):
+            try:
+                if time.time() - os.path.getmtime(path) > TMP_MAX_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+            continue
+        # only complete results are considered, not other files
+        if not os.path.isfile(meta_path):
+            continue
+        size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        entries.append((os.path.getmtime(meta_path), key, size))
+        total += size
+    removed = []
+    # removes the least recently used results first
+    for last_used, key, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_path(cache_dir, key), ignore_errors=True)
+        total -= size
+        removed.append(key)
+    return(removed)
@@ -0,0 +1,1155 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/core.py
+
+- General description:
+This module contains the numerical core of the Z-curve calculations, shared by the command line
+script plotZcurve.py and the flask web interface. It does not depend on R, so it can be imported
+without starting an embedded R session.
+
+- Procedure:
+1. the FASTA file is read as bytes in large chunks; each chunk is validated and lowered with a translation
+table (bytes.translate), and the chunks are joined only once at the end
+2. the sequence is converted into an array of integer codes, one per base (a=0, g=1, c=2, t=3)
+3. the cumulative count of each base is calculated with numpy.cumsum
+4. the cumulative counts are divided by the length of the sequence + 1, to obtain the cumulative frequencies
+5. the frequencies are transformed into the X, Y and Z coordinates with one matrix product
+6. for genomes larger than the memory, the FASTA file is streamed twice: first the bases are counted, then
+the coordinates are calculated chunk by chunk, carrying the running counts across chunks, and written
+to a disk-backed numpy array (.npy memmap), so the memory used stays the same whatever the genome size
+7. with more than one worker, the sequence is split in chunks: the total count of each chunk is calculated in parallel,
+the running counts at the start of each chunk are obtained with a prefix sum of those totals, and each chunk is then
+transformed in parallel starting from its offset -> the result is exactly the same as with one worker
+8. before plotting, the coordinates can be decimated to a target number of points (fixed stride, min/max of each
+bucket, or the shape-preserving Largest-Triangle-Three-Buckets in 3D); the position of each kept point in the
+sequence is returned too, so the colour scale of the plots still refers to the whole sequence
+9. for the sliding-window profile, the cumulative counts of g and c are calculated one piece of the sequence at a time,
+and kept only at the first and last base of each window, whose count is then the difference of two values
+10. for the export of the curve, the coordinates (and optionally the cumulative counts of each base, calculated again
+from the sequence chunk by chunk) are copied chunk by chunk to columnar .npy files, which other tools can memory-map
+
+- List of user-defined functions:
+1. iter_seq_chunks: reads an open FASTA file in chunks, and yields the validated sequence
+2. describes_invalid: creates the error message for the first invalid character of the sequence
+3. reads_seq: reads the whole sequence of an open FASTA file in one string
+4. scans_genome: reads a FASTA stream once, checking its format and returning the base codes and the total of each base
+5. encodes_seq: converts the sequence into an array of integer codes
+6. counts_bases: calculates the cumulative count of each base along the sequence
+7. calculates_coord: calculates the X, Y and Z coordinates of the Z-curve
+8. transforms_counts: transforms cumulative counts into X, Y and Z coordinates
+9. counts_total: counts the total of each base in an open FASTA file, one chunk at a time
+10. writes_coord_store: calculates the coordinates chunk by chunk and writes them to a .npy memmap
+11. opens_coord_store: opens a .npy memmap with the coordinates as read-only
+12. GC_counts: calculates the GC content from the total count of each base
+13. counts_composition: calculates the base composition, GC content and GC/AT skews from the total count of each base
+14. calculates_coord_parallel: calculates the coordinates in chunks, with a pool of processes over shared memory,
+and returns the total count of each base too
+15. counts_chunk: worker function, counts the bases of one chunk in shared memory
+16. transforms_chunk: worker function, calculates the coordinates of one chunk in shared memory
+17. stores_chunk: worker function, calculates the coordinates of one chunk and writes them to the .npy memmap
+18. decimates_coord: reduces the coordinates to a target number of points, keeping their positions in the sequence
+19. decimates_stride, decimates_minmax, decimates_lttb: the three decimation methods
+20. triangles_area: compares the areas of the triangles of the candidate points of LTTB
+21. counts_gc_limits: counts g and c before the start and up to the end of each window, one piece at a time
+22. calculates_windows: calculates the GC content and the GC skew in sliding windows
+23. writes_windows: writes the sliding-window profile as TSV or as binary numpy arrays
+24. writes_export: writes the coordinates, and optionally the cumulative counts, to columnar .npy files, chunk by chunk
+
+- List of imported modules:
+1. math: for the transformation matrix; os, json: to describe the exported files
+2. numpy: to vectorize all calculations on the sequence
+3. concurrent.futures: to run the chunks of one sequence in a pool of processes
+4. multiprocessing.shared_memory: to share the sequence and the coordinates with the worker processes without copying them
+
+- Possible errors addressed in the module:
+1. InvalidInput: if the input file does not start either with > (fasta format), or if it contains no sequence
+2. InvalidNucleotide: if there are non-nucleotides characters in the sequence; the message
+reports the first invalid character, its position in the sequence and its line in the file
+
+"""
+#%% IMPORT MODULES
+
+import os
+import math
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# decimation methods, shared with the command line options
+from .defaults import DECIMATION_METHODS
+
+#%% CONSTANTS
+
+# order of the bases in the cumulative counts -> same order as the bases_freq dictionary used
+# in the first release, so the rows of the transformation matrix keep the same meaning
+BASE_ORDER = 'agct'
+
+# transformation matrix of the Z-curve: the X, Y and Z coordinates are the frequencies of the bases (in BASE_ORDER)
+# multiplied by this matrix (see README.md for more info)
+TR_MATRIX = np.array([[1,1,-1,-1], [1,1,-1,-1], [1,-1,-1,1]])*math.sqrt(3)/4
+
+# lookup table from ASCII byte to integer code; all bytes which are not nucleotides are set to 255
+BASE_CODES = np.full(256, 255, dtype=np.uint8)
+# assigns the code of each base, both for lower and upper case letters
+for code, base in enumerate(BASE_ORDER):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.upper())] = code
+
+# columns of the sliding-window profile, in the order written by writes_windows
+WINDOW_COLUMNS = ['start', 'end', 'gc', 'gc_skew', 'cum_gc_skew']
+
+# size of the blocks read from the FASTA file: 4 MB
+CHUNK_SIZE = 1 << 22
+
+# size of the blocks read when the coordinates are written to disk: 1 MB, which keeps
+# the temporary arrays of each block (counts and coordinates) below 100 MB
+STORE_CHUNK_SIZE = 1 << 20
+
+# average number of points per bucket above which decimates_lttb calculates one bucket at a time: the loop then costs
+# little next to the points of each bucket, and is faster than the passes over all buckets at once
+LTTB_LOOP_WIDTH = 128
+
+# characters removed from the sequence lines (newlines and spaces)
+WHITESPACE = b' \t\r\n'
+
+# translation table used to validate and lower the sequence in one step: the nucleotides are
+# translated to lower case, every other byte is translated to 0, which then marks an invalid character
+SEQ_TABLE = bytearray(256)
+for base in BASE_ORDER:
+    SEQ_TABLE[ord(base)] = ord(base)
+    SEQ_TABLE[ord(base.upper())] = ord(base)
+SEQ_TABLE = bytes(SEQ_TABLE)
+
+
+#%% CUSTOM ERRORS
+
+'Creates a new class of custom error messages in this module'
+class CustomError(Exception):
+    pass
+
+'Raised if input file is not a fasta file'
+class InvalidInput(CustomError):
+    pass
+
+'Raised if a sequence contains non-nucleotide characters'
+class InvalidNucleotide(CustomError):
+    pass
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''ITER_SEQ_CHUNKS
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode ('rb')
+
+    chunk_size: int
+        number of bytes read from the file at each step
+
+    start_line: int
+        line number of the first line read from genome, only used in the error messages
+
+    name: string
+        name of the file in the error messages; by default, the name of genome
+
+    Yields
+    -------
+    seq: bytes
+        validated, lower case sequence found in the chunk, without headers and newlines
+
+'''
+
+def iter_seq_chunks(genome, chunk_size=CHUNK_SIZE, start_line=1, name=None):
+    # streams without a name (e.g. uploads) are called 'input' in the error messages
+    if name is None:
+        name = getattr(genome, 'name', 'input')
+    # True while the current line is a header line (starting with >)
+    in_header = False
+    # True if the next byte read is the first of a line
+    line_start = True
+    # number of bases and of lines read so far, used to report the position of invalid characters
+    n_bases = 0
+    n_lines = 0
+    # reads the file one block at a time
+    for block in iter(lambda: genome.read(chunk_size), b''):
+        start = 0
+        while start < len(block):
+            # skips the header until the end of its line, which may be in a later block
+            if in_header:
+                newline = block.find(b'\n', start)
+                if newline == -1:
+                    break
+                start = newline + 1
+                n_lines += 1
+                in_header = False
+                line_start = True
+                continue
+            # a new header begins here
+            if line_start and block[start] == ord('>'):
+                in_header = True
+                continue
+            # the sequence goes on until the next header, or until the end of the block
+            header = block.find(b'\n>', start)
+            stop = len(block) if header == -1 else header + 1
+            raw = block[start:stop]
+            # lowers the nucleotides and removes the newlines; invalid characters become 0
+            seq = raw.translate(SEQ_TABLE, WHITESPACE)
+            invalid = seq.find(0)
+            # if there is an invalid character, the script reports where the first one is and exits
+            if invalid != -1:
+                raise InvalidNucleotide(describes_invalid(name, raw, invalid, n_bases, start_line + n_lines))
+            n_bases += len(seq)
+            n_lines += raw.count(b'\n')
+            line_start = raw.endswith(b'\n')
+            start = stop
+            if seq:
+                yield seq
+
+
+'''DESCRIBES_INVALID
+
+    Parameters
+    ----------
+    name: string
+        name of the input genome file
+
+    raw: bytes
+        block of the file which contains the invalid character
+
+    invalid: int
+        index of the invalid character in raw, once the whitespaces are removed
+
+    n_bases: int
+        number of bases read before raw
+
+    line: int
+        line number of the first line of raw
+
+    Returns
+    -------
+    message: string
+        error message, with the invalid character and its position
+
+'''
+
+def describes_invalid(name, raw, invalid, n_bases, line):
+    # looks for the invalid character in raw, skipping the whitespaces
+    found = -1
+    for index, byte in enumerate(raw):
+        if byte not in WHITESPACE:
+            found += 1
+            if found == invalid:
+                break
+    return('Your input file {} contains the invalid character {!r} at position {} of the sequence (line {}). Please insert a valid input fasta file'
+           .format(name, chr(raw[index]), n_bases + invalid + 1, line + raw.count(b'\n', 0, index)))
+
+
+'''READS_SEQ
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode ('rb')
+
+    start_line: int
+        line number of the first line read from genome, only used in the error messages
+
+    Returns
+    -------
+    seq: string
+        genome sequence in one lower case string
+
+'''
+
+def reads_seq(genome, start_line=1):
+    # the chunks are collected in a list and joined only once, so the sequence is never copied at each line
+    seq = b''.join(iter_seq_chunks(genome, start_line=start_line))
+    # a file with only a header has nothing to plot, as in writes_coord_store
+    if not seq:
+        raise InvalidInput('Your input file {} does not contain any sequence. Please insert a valid input fasta file' .format(getattr(genome, 'name', 'input')))
+    return(seq.decode('ascii'))
+
+
+'''SCANS_GENOME
+
+    Parameters
+    ----------
+    genome: file
+        input genome stream, opened in binary mode; it is read only once, so it can be a stream which
+        cannot be rewound, e.g. an uploaded file
+
+    name: string
+        name of the file in the error messages
+
+    chunk_size: int
+        number of bytes read from the stream at each step
+
+    Returns
+    -------
+    codes: numpy.array
+        uint8 array with one code per base, following BASE_ORDER
+
+    totals: numpy.array
+        int64 array with the total count of each base, in the order given by BASE_ORDER
+
+'''
+
+def scans_genome(genome, name=None, chunk_size=CHUNK_SIZE):
+    if name is None:
+        name = getattr(genome, 'name', 'input')
+    # checks if the stream is a FASTA file, from its first line
+    if not genome.readline().startswith(b'>'):
+        raise InvalidInput('Your input file {} is not valid. Please insert a fasta file' .format(name))
+    chunks = []
+    totals = np.zeros(len(BASE_ORDER), dtype=np.int64)
+    # validates, encodes and counts each chunk as soon as it is read -> the stream is read only once
+    for chunk in iter_seq_chunks(genome, chunk_size, start_line=2, name=name):
+        codes = encodes_seq(chunk)
+        totals += np.bincount(codes, minlength=len(BASE_ORDER))
+        chunks.append(codes)
+    # a file with only a header has nothing to plot
+    if not chunks:
+        raise InvalidInput('Your input file {} does not contain any sequence. Please insert a valid input fasta file' .format(name))
+    # the codes use 1 byte per base, and are joined only once at the end
+    codes = np.concatenate(chunks)
+    return(codes, totals)
+
+
+'''ENCODES_SEQ
+
+    Parameters
+    ----------
+    seq: string or bytes
+        nucleotide sequence
+
+    Returns
+    -------
+    codes: numpy.array
+        uint8 array with one code per base, following BASE_ORDER
+
+'''
+
+def encodes_seq(seq):
+    # the sequence is read as raw bytes, so no intermediate list is created
+    if isinstance(seq, str):
+        seq = seq.encode('ascii')
+    # each byte is translated to its code with the lookup table
+    codes = BASE_CODES[np.frombuffer(seq, dtype=np.uint8)]
+    # the sequence should only contain valid nucleotides at this point
+    if codes.size and codes.max() == 255:
+        raise ValueError('The sequence contains characters which are not nucleotides')
+    return(codes)
+
+
+'''COUNTS_BASES
+
+    Parameters
+    ----------
+    codes: numpy.array
+        uint8 array with one code per base, as returned by encodes_seq
+
+    Returns
+    -------
+    counts: numpy.array
+        int64 array of shape (len(codes), 4) with the cumulative count of each base,
+        in the order given by BASE_ORDER
+
+'''
+
+def counts_bases(codes):
+    # one-hot encoding of the sequence: each row has a 1 in the column of its base
+    counts = np.zeros((codes.size, len(BASE_ORDER)), dtype=np.int64)
+    counts[np.arange(codes.size), codes] = 1
+    # cumulative sum along the sequence, done in place to avoid a second copy
+    np.cumsum(counts, axis=0, out=counts)
+    return(counts)
+
+
+'''CALCULATES_COORD
+
+    Parameters
+    ----------
+    seq: string or bytes
+        nucleotide sequence
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    Returns
+    -------
+    coord: numpy.array
+        float64 array of shape (len(seq), 3), with the X, Y and Z coordinates as columns
+
+'''
+
+def calculates_coord(seq, tr_matrix):
+    # cumulative counts of each base
+    counts = counts_bases(encodes_seq(seq))
+    # transforms all positions at once
+    coord = transforms_counts(counts, counts.shape[0], tr_matrix)
+    return(coord)
+
+
+'''TRANSFORMS_COUNTS
+
+    Parameters
+    ----------
+    counts: numpy.array
+        cumulative counts of each base, as returned by counts_bases; it can be a
+        slice of a longer sequence, as long as the counts are cumulative from its start
+
+    seq_len: int
+        length of the whole sequence
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    Returns
+    -------
+    coord: numpy.array
+        float64 array of shape (len(counts), 3), with the X, Y and Z coordinates as columns
+
+'''
+
+def transforms_counts(counts, seq_len, tr_matrix):
+    # cumulative frequencies: each base adds 1 divided by the length of the sequence + 1
+    freq = counts / (seq_len + 1)
+    # applies the transformation matrix to all positions at once
+    coord = freq @ tr_matrix.T
+    return(coord)
+
+
+'''COUNTS_TOTAL
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode ('rb')
+
+    chunk_size: int
+        number of bytes read from the file at each step
+
+    start_line: int
+        line number of the first line read from genome, only used in the error messages
+
+    Returns
+    -------
+    totals: numpy.array
+        int64 array with the total count of each base, in the order given by BASE_ORDER
+
+'''
+
+def counts_total(genome, chunk_size=CHUNK_SIZE, start_line=1):
+    # initializes the counts of the 4 bases
+    totals = np.zeros(len(BASE_ORDER), dtype=np.int64)
+    # only one chunk of the sequence is kept in memory at a time
+    for chunk in iter_seq_chunks(genome, chunk_size, start_line):
+        totals += np.bincount(encodes_seq(chunk), minlength=len(BASE_ORDER))
+    return(totals)
+
+
+'''WRITES_COORD_STORE
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode ('rb'); it has to be seekable, since it is read twice
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    store_path: string
+        path of the .npy file where the coordinates are written
+
+    chunk_size: int
+        number of bytes read from the file at each step
+
+    start_line: int
+        line number of the first line read from genome, only used in the error messages
+
+    workers: int
+        number of processes used to calculate the coordinates (default 1)
+
+    Returns
+    -------
+    coord: numpy.memmap
+        read-only, disk-backed array of shape (sequence length, 3) with the X, Y and Z coordinates
+
+    totals: numpy.array
+        int64 array with the total count of each base, in the order given by BASE_ORDER
+
+'''
+
+def writes_coord_store(genome, tr_matrix, store_path, chunk_size=STORE_CHUNK_SIZE, start_line=1, workers=1):
+    # the first pass only counts the bases, since the length of the sequence is needed for the frequencies
+    start = genome.tell()
+    totals = counts_total(genome, chunk_size, start_line)
+    seq_len = int(totals.sum())
+    # an empty sequence cannot be plotted
+    if seq_len == 0:
+        raise InvalidInput('Your input file {} does not contain any sequence. Please insert a valid input fasta file' .format(getattr(genome, 'name', 'input')))
+    # creates the disk-backed array, in .npy format so it can be opened again with numpy.load
+    coord = np.lib.format.open_memmap(store_path, mode='w+', dtype=np.float64, shape=(seq_len, 3))
+    # the second pass writes the coordinates chunk by chunk, carrying the running counts across chunks
+    genome.seek(start)
+    running = np.zeros(len(BASE_ORDER), dtype=np.int64)
+    row = 0
+    # with one worker, each chunk is calculated here
+    if workers <= 1:
+        for chunk in iter_seq_chunks(genome, chunk_size, start_line):
+            counts = counts_bases(encodes_seq(chunk))
+            counts += running
+            coord[row:row + len(counts)] = transforms_counts(counts, seq_len, tr_matrix)
+            running = counts[-1].copy()
+            row += len(counts)
+    # otherwise, only the running counts are carried here, and the chunks are sent to the workers, which
+    # write their coordinates directly to the store
+    else:
+        coord.flush()
+        with ProcessPoolExecutor(workers) as pool:
+            pending = []
+            for chunk in iter_seq_chunks(genome, chunk_size, start_line):
+                codes = encodes_seq(chunk)
+                pending.append(pool.submit(stores_chunk, store_path, codes, row, running.copy(), seq_len, tr_matrix))
+                running += np.bincount(codes, minlength=len(BASE_ORDER))
+                row += len(codes)
+                # at most two chunks per worker are waiting, so the memory used stays constant
+                if len(pending) >= 2 * workers:
+                    pending.pop(0).result()
+            for task in pending:
+                task.result()
+    # writes everything to disk and closes the array
+    coord.flush()
+    del coord
+    # opens the store again as read-only
+    return(opens_coord_store(store_path), totals)
+
+
+'''OPENS_COORD_STORE
+
+    Parameters
+    ----------
+    store_path: string
+        path of the .npy file where the coordinates were written
+
+    Returns
+    -------
+    coord: numpy.memmap
+        read-only, disk-backed array with the X, Y and Z coordinates
+
+'''
+
+def opens_coord_store(store_path):
+    return(np.load(store_path, mmap_mode='r'))
+
+
+'''GC_COUNTS
+
+    Parameters
+    ----------
+    totals: numpy.array
+        total count of each base, in the order given by BASE_ORDER
+
+    Returns
+    -------
+    perc_gc: float
+        GC percentage in the sequence
+
+'''
+
+def GC_counts(totals):
+    # g and c counts, divided by the count of all bases
+    gc = totals[BASE_ORDER.index('g')] + totals[BASE_ORDER.index('c')]
+    perc_gc = gc * 100 / totals.sum()
+    return(float(perc_gc))
+
+
+'''COUNTS_COMPOSITION
+
+    Parameters
+    ----------
+    totals: numpy.array
+        total count of each base, in the order given by BASE_ORDER
+
+    Returns
+    -------
+    composition: dict
+        count of A, C, G, T and N (always 0 for now, since Ns are rejected when the sequence is read),
+        GC content in %, GC skew (G-C)/(G+C) and AT skew (A-T)/(A+T)
+
+'''
+
+def counts_composition(totals):
+    a, c, g, t = (int(totals[BASE_ORDER.index(base)]) for base in 'acgt')
+    # the skews are 0 if the sequence has none of the two bases
+    composition = {'A': a, 'C': c, 'G': g, 'T': t, 'N': 0, 'GC': GC_counts(totals),
+                   'GC_skew': (g - c) / (g + c) if g + c else 0.0,
+                   'AT_skew': (a - t) / (a + t) if a + t else 0.0}
+    return(composition)
+
+
+'''CALCULATES_COORD_PARALLEL
+
+    Parameters
+    ----------
+    seq: string or bytes
+        nucleotide sequence
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    workers: int
+        number of processes; with 1 worker, calculates_coord is used directly
+
+    chunk_size: int
+        maximum number of bases in each chunk sent to the workers
+
+    Returns
+    -------
+    coord: numpy.array
+        float64 array of shape (len(seq), 3), exactly equal to the one returned by calculates_coord
+
+    totals: numpy.array
+        int64 array with the total count of each base, in the order given by BASE_ORDER, taken from the
+        cumulative counts -> the base composition does not need another pass over the sequence
+
+'''
+
+def calculates_coord_parallel(seq, tr_matrix, workers=1, chunk_size=STORE_CHUNK_SIZE):
+    # with one worker, or a sequence shorter than one chunk, there is nothing to split
+    if workers <= 1 or len(seq) <= chunk_size:
+        counts = counts_bases(encodes_seq(seq))
+        coord = transforms_counts(counts, counts.shape[0], tr_matrix)
+        # the last row of the cumulative counts is the total count of each base
+        totals = counts[-1].copy() if len(counts) else np.zeros(len(BASE_ORDER), dtype=np.int64)
+        return(coord, totals)
+    if isinstance(seq, str):
+        seq = seq.encode('ascii')
+    seq_len = len(seq)
+    # shared memory for the codes of the sequence and for the coordinates, used by all workers
+    shm_codes = shared_memory.SharedMemory(create=True, size=seq_len)
+    shm_coord = shared_memory.SharedMemory(create=True, size=seq_len * 3 * 8)
+    try:
+        # the sequence is encoded directly into the shared memory
+        codes = np.ndarray(seq_len, dtype=np.uint8, buffer=shm_codes.buf)
+        np.take(BASE_CODES, np.frombuffer(seq, dtype=np.uint8), out=codes)
+        if codes.max() == 255:
+            raise ValueError('The sequence contains characters which are not nucleotides')
+        # limits of the chunks
+        bounds = list(range(0, seq_len, chunk_size)) + [seq_len]
+        chunks = list(zip(bounds[:-1], bounds[1:]))
+        with ProcessPoolExecutor(workers) as pool:
+            # first pass: total count of each chunk
+            totals = list(pool.map(counts_chunk, [(shm_codes.name, seq_len, start, stop) for start, stop in chunks]))
+            # running counts at the start of each chunk: prefix sum of the totals of the chunks before it
+            offsets = np.cumsum([np.zeros(len(BASE_ORDER), dtype=np.int64)] + totals, axis=0)
+            # second pass: coordinates of each chunk, starting from its offset
+            list(pool.map(transforms_chunk, [(shm_codes.name, shm_coord.name, seq_len, start, stop, offset, tr_matrix)
+                                             for (start, stop), offset in zip(chunks, offsets[:-1])]))
+        # copies the coordinates out of the shared memory, which can then be released
+        coord = np.ndarray((seq_len, 3), dtype=np.float64, buffer=shm_coord.buf).copy()
+        del codes
+    finally:
+        for shm in (shm_codes, shm_coord):
+            shm.close()
+            shm.unlink()
+    # the last offset is the total count of each base in the whole sequence
+    return(coord, offsets[-1])
+
+
+'''COUNTS_CHUNK
+
+    Parameters
+    ----------
+    task: tuple
+        name of the shared memory with the codes, length of the sequence, start and stop of the chunk
+
+    Returns
+    -------
+    totals: numpy.array
+        int64 array with the total count of each base in the chunk
+
+'''
+
+def counts_chunk(task):
+    codes_name, seq_len, start, stop = task
+    shm_codes = shared_memory.SharedMemory(name=codes_name)
+    codes = np.ndarray(seq_len, dtype=np.uint8, buffer=shm_codes.buf)
+    totals = np.bincount(codes[start:stop], minlength=len(BASE_ORDER)).astype(np.int64)
+    del codes
+    shm_codes.close()
+    return(totals)
+
+
+'''TRANSFORMS_CHUNK
+
+    Parameters
+    ----------
+    task: tuple
+        names of the shared memories with the codes and the coordinates, length of the sequence,
+        start and stop of the chunk, running counts at the start of the chunk and transformation matrix
+
+'''
+
+def transforms_chunk(task):
+    codes_name, coord_name, seq_len, start, stop, offset, tr_matrix = task
+    shm_codes = shared_memory.SharedMemory(name=codes_name)
+    shm_coord = shared_memory.SharedMemory(name=coord_name)
+    codes = np.ndarray(seq_len, dtype=np.uint8, buffer=shm_codes.buf)
+    coord = np.ndarray((seq_len, 3), dtype=np.float64, buffer=shm_coord.buf)
+    # same calculation as calculates_coord, with the counts shifted by the offset of the chunk
+    counts = counts_bases(codes[start:stop])
+    counts += offset
+    coord[start:stop] = transforms_counts(counts, seq_len, tr_matrix)
+    del codes, coord
+    shm_codes.close()
+    shm_coord.close()
+
+
+'''STORES_CHUNK
+
+    Parameters
+    ----------
+    store_path: string
+        path of the .npy file where the coordinates are written
+
+    codes: numpy.array
+        codes of the chunk, as returned by encodes_seq
+
+    row: int
+        position of the first base of the chunk in the sequence
+
+    offset: numpy.array
+        running counts at the start of the chunk
+
+    seq_len: int
+        length of the whole sequence
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+'''
+
+def stores_chunk(store_path, codes, row, offset, seq_len, tr_matrix):
+    coord = np.load(store_path, mmap_mode='r+')
+    counts = counts_bases(codes)
+    counts += offset
+    coord[row:row + len(codes)] = transforms_counts(counts, seq_len, tr_matrix)
+    coord.flush()
+    del coord
+
+
+'''COUNTS_GC_LIMITS
+
+    Parameters
+    ----------
+    chunks: iterable
+        consecutive pieces of the lower case sequence (string or bytes), e.g. [seq] or the chunks of iter_seq_chunks
+
+    window: int
+        number of bases in each window
+
+    step: int
+        number of bases between the starts of two consecutive windows
+
+    piece_size: int
+        number of bases counted at a time, so the cumulative counts of a whole sequence in memory are never kept
+
+    Returns
+    -------
+    g_starts, c_starts: numpy.array
+        count of g and of c before the first base of each window which fits entirely in the sequence
+
+    g_ends, c_ends: numpy.array
+        count of g and of c up to the last base of each of those windows
+
+'''
+
+def counts_gc_limits(chunks, window, step, piece_size=STORE_CHUNK_SIZE):
+    limits = {'g_starts': [], 'c_starts': [], 'g_ends': [], 'c_ends': []}
+    # number of bases, g and c before the current piece
+    offset = 0
+    running = np.zeros(2, dtype=np.int64)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+        for piece_start in range(0, len(chunk), piece_size):
+            bases = np.frombuffer(chunk, dtype=np.uint8, count=min(piece_size, len(chunk) - piece_start), offset=piece_start)
+            end = offset + len(bases)
+            # the windows start every step bases, and end window bases later: only the counts at those limits are kept,
+            # so the memory used grows with the number of windows, not with the length of the sequence. A limit which
+            # falls between two pieces is taken once: the starts at the beginning of a piece, the ends at its end
+            starts = np.arange(-(-offset // step) * step, end, step) - offset
+            ends = np.arange(max(-(-(offset + 1 - window) // step), 0) * step + window, end + 1, step) - offset
+            # g and c are summed between consecutive limits, and the cumulative sums give the count at each limit; the
+            # limits are sorted and the repeated ones removed (a stable sort of the two runs is much faster than np.unique)
+            cuts = np.sort(np.concatenate([[0], starts, ends, [len(bases)]]), kind='stable')
+            cuts = cuts[np.concatenate([[True], cuts[1:] != cuts[:-1]])]
+            cum_g = np.concatenate([[0], np.cumsum(np.add.reduceat(bases == ord('g'), cuts[:-1], dtype=np.int64))]) + running[0]
+            cum_c = np.concatenate([[0], np.cumsum(np.add.reduceat(bases == ord('c'), cuts[:-1], dtype=np.int64))]) + running[1]
+            starts = np.searchsorted(cuts, starts)
+            ends = np.searchsorted(cuts, ends)
+            limits['g_starts'].append(cum_g[starts])
+            limits['c_starts'].append(cum_c[starts])
+            limits['g_ends'].append(cum_g[ends])
+            limits['c_ends'].append(cum_c[ends])
+            running = np.array([cum_g[-1], cum_c[-1]])
+            offset = end
+    limits = {name: np.concatenate(values) if values else np.zeros(0, dtype=np.int64) for name, values in limits.items()}
+    # only the windows which end within the sequence are kept
+    n_windows = len(limits['g_ends'])
+    return(limits['g_starts'][:n_windows], limits['c_starts'][:n_windows], limits['g_ends'], limits['c_ends'])
+
+
+'''CALCULATES_WINDOWS
+
+    Parameters
+    ----------
+    chunks: iterable
+        consecutive pieces of the lower case sequence (string or bytes), e.g. [seq] or the chunks of iter_seq_chunks
+
+    window: int
+        number of bases in each window
+
+    step: int
+        number of bases between the starts of two consecutive windows
+
+    Returns
+    -------
+    windows: dict
+        numpy arrays with one value per window: start and end (1-based, inclusive), GC content in %,
+        GC skew (G-C)/(G+C) and cumulative GC skew; only the windows which fit entirely in the sequence are kept
+
+'''
+
+def calculates_windows(chunks, window, step):
+    # cumulative counts at the limits of the windows -> the count in any window is the difference of two values,
+    # so each window takes the same time whatever its size
+    g_starts, c_starts, g_ends, c_ends = counts_gc_limits(chunks, window, step)
+    n_windows = len(g_ends)
+    g = g_ends - g_starts
+    c = c_ends - c_starts
+    gc = g + c
+    # the skew is 0 in the windows without g and c
+    gc_skew = np.divide(g - c, gc, out=np.zeros(n_windows), where=gc > 0)
+    # first base of each window, starting from 1
+    start = np.arange(n_windows, dtype=np.int64) * step + 1
+    windows = {'start': start, 'end': start + window - 1, 'gc': gc * 100 / window,
+               'gc_skew': gc_skew, 'cum_gc_skew': np.cumsum(gc_skew)}
+    return(windows)
+
+
+'''WRITES_WINDOWS
+
+    Parameters
+    ----------
+    windows: dict
+        windows as returned by calculates_windows
+
+    out_name: string
+        full path of the output file, without the extension
+
+    out_format: string
+        'tsv' for a tab-separated text file with a header, or 'npz' for a binary numpy file with one array per column
+
+    Returns
+    -------
+    out_file: string
+        full path of the file written
+
+'''
+
+def writes_windows(windows, out_name, out_format):
+    out_file = out_name + '.' + out_format
+    if out_format == 'npz':
+        np.savez(out_file, **windows)
+    else:
+        columns = np.column_stack([windows[column] for column in WINDOW_COLUMNS])
+        np.savetxt(out_file, columns, fmt=['%d', '%d', '%.4f', '%.6f', '%.6f'], delimiter='\t',
+                   header='\t'.join(WINDOW_COLUMNS), comments='')
+    return(out_file)
+
+
+'''WRITES_EXPORT
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates of all positions of the sequence, as columns, in memory or disk-backed
+
+    out_name: string
+        full path of the output files, without the extension
+
+    dtype: string
+        type of the exported coordinates, 'float32' or 'float64'
+
+    chunks: iterable
+        consecutive pieces of the sequence, whose cumulative counts are exported too, or None for the coordinates only
+
+    prefix: numpy.array
+        count of each base before the first position (for a region), or None to start from 0
+
+    first_position: int
+        position of the first base in the record, starting from 1
+
+    chunk_size: int
+        number of positions copied at a time
+
+    Returns
+    -------
+    out_files: list
+        full paths of the files written: <out_name>_zcurve.npy, <out_name>_counts.npy (if chunks is given) and
+        <out_name>_zcurve.json, which describes them
+
+'''
+
+def writes_export(coord, out_name, dtype='float32', chunks=None, prefix=None, first_position=1, chunk_size=STORE_CHUNK_SIZE):
+    seq_len = len(coord)
+    # columnar layout: one row per coordinate, so each of them is contiguous on disk and can be memory-mapped alone
+    coord_file = out_name + '_zcurve.npy'
+    exported = np.lib.format.open_memmap(coord_file, mode='w+', dtype=dtype, shape=(3, seq_len))
+    # the coordinates are copied (and converted) one chunk at a time, so a disk-backed array is never read as a whole
+    for start in range(0, seq_len, chunk_size):
+        exported[:, start:start + chunk_size] = coord[start:start + chunk_size].T
+    exported.flush()
+    del exported
+    out_files = [coord_file]
+    description = {'genome': os.path.basename(out_name), 'bases': seq_len, 'first_position': first_position, 'coord': os.path.basename(coord_file),
+                   'coord_rows': ['X', 'Y', 'Z'], 'coord_dtype': dtype, 'counts': None}
+    # the cumulative counts are calculated again from the sequence, carrying the running counts across chunks as in
+    # writes_coord_store; they fit in 32 bits for all but the largest records
+    if chunks is not None:
+        counts_file = out_name + '_counts.npy'
+        counts_dtype = 'uint32' if seq_len + (0 if prefix is None else int(prefix.sum())) < 2**32 else 'uint64'
+        exported = np.lib.format.open_memmap(counts_file, mode='w+', dtype=counts_dtype, shape=(len(BASE_ORDER), seq_len))
+        running = np.zeros(len(BASE_ORDER), dtype=np.int64) if prefix is None else prefix.astype(np.int64)
+        row = 0
+        for chunk in chunks:
+            # pieces larger than chunk_size are split, so the one-hot counts stay small
+            for start in range(0, len(chunk), chunk_size):
+                counts = counts_bases(encodes_seq(chunk[start:start + chunk_size]))
+                counts += running
+                exported[:, row:row + len(counts)] = counts.T
+                running = counts[-1].copy()
+                row += len(counts)
+        exported.flush()
+        del exported
+        out_files.append(counts_file)
+        description.update({'counts': os.path.basename(counts_file), 'counts_rows': list(BASE_ORDER), 'counts_dtype': counts_dtype})
+    # the description lets other tools find the layout without reading the code
+    with open(out_name + '_zcurve.json', 'w') as description_file:
+        json.dump(description, description_file, indent=2)
+    out_files.append(out_name + '_zcurve.json')
+    return(out_files)
+
+
+'''DECIMATES_COORD
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns, either in memory or as a disk-backed memmap
+
+    max_points: int
+        target number of points; if None or 0, or if coord is already shorter, nothing is removed
+
+    method: string
+        one of DECIMATION_METHODS:
+        'stride': points at a fixed distance from each other
+        'minmax': first, last, minimum and maximum of each axis in each bucket of the sequence
+        'lttb': Largest-Triangle-Three-Buckets in 3D, which keeps the points that change the shape of the curve the most
+
+    Returns
+    -------
+    coord: numpy.array
+        decimated coordinates, at most max_points rows
+
+    step: numpy.array
+        position of each kept point in the sequence, starting from 1, used for the colour scale of the plots
+
+'''
+
+def decimates_coord(coord, max_points, method='lttb'):
+    seq_len = len(coord)
+    # nothing to remove
+    if not max_points or seq_len <= max_points:
+        return(np.asarray(coord), np.arange(1, seq_len + 1))
+    if method == 'stride':
+        index = decimates_stride(seq_len, max_points)
+    elif method == 'minmax':
+        index = decimates_minmax(coord, max_points)
+    elif method == 'lttb':
+        index = decimates_lttb(coord, max_points)
+    else:
+        raise ValueError('Unknown decimation method {}, please choose one of {}' .format(method, DECIMATION_METHODS))
+    return(np.asarray(coord[index]), index + 1)
+
+
+'''DECIMATES_STRIDE
+
+    Parameters
+    ----------
+    seq_len: int
+        number of points
+
+    max_points: int
+        target number of points
+
+    Returns
+    -------
+    index: numpy.array
+        indices of the kept points, including the first and the last one
+
+'''
+
+def decimates_stride(seq_len, max_points):
+    return(np.unique(np.linspace(0, seq_len - 1, max_points).round().astype(np.int64)))
+
+
+'''DECIMATES_MINMAX
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns
+
+    max_points: int
+        target number of points
+
+    Returns
+    -------
+    index: numpy.array
+        indices of the kept points, sorted
+
+'''
+
+def decimates_minmax(coord, max_points):
+    seq_len = len(coord)
+    # each bucket keeps at most 6 points: minimum and maximum of the 3 axes; with less than 8 points there is no
+    # room for a whole bucket besides the first and the last point, so the points are taken at a fixed distance
+    buckets = (max_points - 2) // 6
+    if buckets < 1:
+        return(decimates_stride(seq_len, max_points))
+    bounds = np.linspace(0, seq_len, buckets + 1).astype(np.int64)
+    index = [np.array([0, seq_len - 1])]
+    # one bucket at a time, so a disk-backed array is read one slice at a time
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        block = np.asarray(coord[start:stop])
+        index.append(start + block.argmin(axis=0))
+        index.append(start + block.argmax(axis=0))
+    return(np.unique(np.concatenate(index)))
+
+
+'''DECIMATES_LTTB
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns
+
+    max_points: int
+        target number of points; with less than 3, the points are taken at a fixed distance instead
+
+    chunk_size: int
+        number of points of the buckets calculated at once, so a disk-backed array is read one block at a time
+
+    Returns
+    -------
+    index: numpy.array
+        indices of the kept points, including the first and the last one
+
+'''
+
+def decimates_lttb(coord, max_points, chunk_size=STORE_CHUNK_SIZE):
+    seq_len = len(coord)
+    # the first and the last points are always kept, so there is no bucket left below 3 points
+    if max_points < 3:
+        return(decimates_stride(seq_len, max_points))
+    # the other points are split in max_points - 2 buckets
+    buckets = max_points - 2
+    bounds = np.linspace(1, seq_len - 1, buckets + 1).astype(np.int64)
+    # average of each bucket, calculated once for all buckets; the last point is appended, since it
+    # is used as the average of the bucket following the last one
+    sums = np.add.reduceat(np.asarray(coord[1:seq_len - 1], dtype=np.float64), bounds[:-1] - 1, axis=0)
+    means = np.vstack([sums / np.diff(bounds)[:, None], np.asarray(coord[seq_len - 1], dtype=np.float64)])
+    index = np.empty(buckets + 2, dtype=np.int64)
+    index[0] = 0
+    index[-1] = seq_len - 1
+    previous = np.asarray(coord[0], dtype=np.float64)
+    # wide buckets: one bucket at a time, so a disk-backed array is read one slice at a time
+    if (seq_len - 2) / buckets > LTTB_LOOP_WIDTH:
+        for bucket in range(buckets):
+            start, stop = bounds[bucket], bounds[bucket + 1]
+            block = np.asarray(coord[start:stop], dtype=np.float64)
+            best = int(triangles_area(block, previous, means[bucket + 1]).argmax())
+            index[bucket + 1] = start + best
+            previous = block[best]
+        return(index)
+    first = 0
+    while first < buckets:
+        # the buckets of this block, at least one
+        last = max(first + 1, min(buckets, int(np.searchsorted(bounds, bounds[first] + chunk_size, 'right')) - 1))
+        start = bounds[first]
+        block = np.asarray(coord[start:bounds[last]], dtype=np.float64)
+        # the buckets are padded to the same width with their last point, which cannot change their maximum
+        offsets = bounds[first:last] - start
+        sizes = np.diff(bounds[first:last + 1])
+        points = block[offsets[:, None] + np.minimum(np.arange(sizes.max()), sizes[:, None] - 1)]
+        # each bucket keeps the point which makes the largest triangle with the point kept in the bucket before and the
+        # average of the bucket after. The point kept before is first guessed as the average of that bucket, and then
+        # replaced by the points kept, until they do not change: only the buckets after a change are calculated again,
+        # and each pass fixes at least one more bucket, so the points are the same as one bucket at a time
+        anchors = np.vstack([previous, means[first:last - 1]])
+        targets = means[first + 1:last + 1]
+        best = np.zeros(last - first, dtype=np.int64)
+        todo = np.arange(last - first)
+        guessed = True
+        while len(todo):
+            choice = triangles_area(points[todo], anchors[todo, None, :], targets[todo, None, :]).argmax(axis=1)
+            # after the first pass, the points before all buckets were only guessed
+            moved = todo if guessed else todo[choice != best[todo]]
+            best[todo] = choice
+            guessed = False
+            # the buckets after those whose point changed are calculated again
+            moved = moved[moved < len(best) - 1]
+            anchors[moved + 1] = points[moved, best[moved]]
+            todo = moved + 1
+        index[first + 1:last + 1] = start + offsets + best
+        previous = points[len(best) - 1, best[-1]]
+        first = last
+    return(index)
+
+
+'''TRIANGLES_AREA
+
+    Parameters
+    ----------
+    points: numpy.array
+        candidate points, with the X, Y and Z coordinates in the last axis
+
+    previous: numpy.array
+        point kept in the bucket before, broadcast against points
+
+    following: numpy.array
+        average of the bucket after, broadcast against points
+
+    Returns
+    -------
+    area: numpy.array
+        area of the triangle of each candidate with previous and following, squared and doubled
+
+'''
+
+def triangles_area(points, previous, following):
+    # the area of the triangle is half the norm of the cross product: the norm is compared squared and
+    # without the factor 1/2, since they do not change the maximum
+    u = points - previous
+    v = following - previous
+    return((u[..., 1] * v[..., 2] - u[..., 2] * v[..., 1]) ** 2
+           + (u[..., 2] * v[..., 0] - u[..., 0] * v[..., 2]) ** 2
+           + (u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]) ** 2)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/decompress.py
+
+- General description:
+This module reads compressed FASTA files (e.g. genome.fna.gz) directly as a stream, without decompressing them to a
+temporary file first. Files compressed with bgzip (BGZF, as used by samtools and htslib) are made of independent blocks
+of at most 64 kB, which are decompressed in parallel by a pool of threads, while the blocks are still given to the
+reader in the order of the file.
+
+- Procedure:
+1. the first bytes of the input are checked without consuming them: gzip files start with 1f 8b, and BGZF files have
+a BC field in the header of each block, which gives the size of the block
+2. BGZF files: the compressed blocks are read one after the other (this is only I/O), grouped in batches, and each batch
+is decompressed by one thread; zlib releases the GIL, so the threads decompress at the same time. At most a few batches
+per thread are waiting, so the memory used stays the same whatever the size of the file
+3. other gzip files (including files made of several gzip members): the stream is decompressed in one thread, in chunks
+4. the decompressed data is read through DecompressedFile, which has the same read, readline, seek and tell methods as
+a file opened in binary mode, so iter_seq_chunks and scans_genome (core.py) read it as they read a FASTA file;
+going back (e.g. to read the file twice with --out-of-core) decompresses the file again from its start; the header
+lines are counted while the data is read the first time, so the user is told when several records are read as one sequence
+
+- List of user-defined functions:
+1. peeks_header: returns the first bytes of the input, without consuming them
+2. is_bgzf: checks if a gzip header is the header of a BGZF block
+3. opens_genome: returns the input as it is if it is not compressed, or a DecompressedFile
+4. iter_gzip_blocks: decompresses a gzip stream in one thread, one chunk at a time
+5. iter_bgzf_blocks: decompresses a BGZF stream in parallel threads, and yields the blocks in order
+6. reads_bgzf_block: reads one compressed BGZF block
+7. inflates_blocks: worker function, decompresses a batch of BGZF blocks and checks their CRC32
+8. DecompressedFile: file-like object which reads the decompressed data
+
+- List of imported modules:
+1. zlib: to decompress the data, without holding the GIL
+2. collections, concurrent.futures: to keep the batches in order, and to run them in a pool of threads
+3. defaults: for the default number of threads, found in the same folder
+4. core: for the InvalidInput error and the size of the chunks, found in the same folder
+
+- Possible errors addressed in the module:
+1. InvalidInput: if the compressed file is truncated or corrupted, or if it is larger than the maximum size
+once decompressed
+
+"""
+#%% IMPORT MODULES
+
+import zlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import InvalidInput, CHUNK_SIZE
+
+# first two bytes of every gzip member
+GZIP_MAGIC = b'\x1f\x8b'
+
+# default number of threads decompressing the BGZF blocks, shared with the command line options
+from .defaults import DECOMPRESS_THREADS
+
+# number of BGZF blocks decompressed by each task: up to 1 MB of sequence
+BGZF_BATCH = 16
+
+# number of batches waiting for each thread
+BGZF_QUEUE = 4
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''PEEKS_HEADER
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode
+
+    size: int
+        number of bytes to return
+
+    Returns
+    -------
+    header: bytes
+        first bytes of the input (fewer if the input is shorter), which can still be read afterwards
+
+'''
+
+def peeks_header(genome, size):
+    # buffered files (e.g. files opened by argparse, or the standard input) can look ahead without reading
+    if hasattr(genome, 'peek'):
+        return(genome.peek(size)[:size])
+    # other seekable streams (e.g. uploads) are read and rewound
+    if genome.seekable():
+        position = genome.tell()
+        header = genome.read(size)
+        genome.seek(position)
+        return(header)
+    return(b'')
+
+
+'''IS_BGZF
+
+    Parameters
+    ----------
+    header: bytes
+        first bytes of a gzip member, at least 18
+
+    Returns
+    -------
+    bgzf: bool
+        True if the member has the extra field BC of BGZF blocks
+
+'''
+
+def is_bgzf(header):
+    # deflate method, FEXTRA flag set, and BC as the first subfield of the extra field, as written by bgzip
+    return(len(header) >= 18 and header[:4] == GZIP_MAGIC + b'\x08\x04' and header[12:14] == b'BC')
+
+
+'''OPENS_GENOME
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode
+
+    threads: int
+        number of threads decompressing the BGZF blocks
+
+    max_size: int
+        maximum size of the decompressed data in bytes, or None for no limit
+
+    name: string
+        name of the file in the error messages; by default, the name of genome
+
+    Returns
+    -------
+    genome: file
+        the input itself if it is not compressed, otherwise a DecompressedFile which reads the decompressed data
+
+'''
+
+def opens_genome(genome, threads=DECOMPRESS_THREADS, max_size=None, name=None):
+    header = peeks_header(genome, 18)
+    if not header.startswith(GZIP_MAGIC):
+        return(genome)
+    return(DecompressedFile(genome, is_bgzf(header), threads, max_size, name))
+
+
+'''ITER_GZIP_BLOCKS
+
+    Parameters
+    ----------
+    genome: file
+        compressed input, opened in binary mode
+
+    Yields
+    -------
+    block: bytes
+        decompressed data, at most CHUNK_SIZE bytes at a time
+
+'''
+
+def iter_gzip_blocks(genome):
+    # wbits=31 reads the gzip header and trailer
+    decompressor = zlib.decompressobj(31)
+    # True once some data of the current member was given to the decompressor
+    started = False
+    for data in iter(lambda: genome.read(CHUNK_SIZE), b''):
+        # True if the decompressor may still hold output, even without more input
+        more = False
+        while data or more:
+            started = True
+            # the output is limited, so a small compressed chunk cannot fill the memory
+            try:
+                block = decompressor.decompress(data, CHUNK_SIZE)
+            except zlib.error:
+                raise InvalidInput('The compressed file {} is corrupted. Please check the file' .format(getattr(genome, 'name', 'input')))
+            more = len(block) == CHUNK_SIZE
+            if block:
+                yield block
+            if decompressor.eof:
+                # the file can contain several members, one after the other; zeros after the last one are ignored
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+                started = False
+                more = False
+                if not data.strip(b'\x00'):
+                    data = b''
+            else:
+                data = decompressor.unconsumed_tail
+    # the end of the file was reached in the middle of a member
+    if started:
+        raise InvalidInput('The compressed file {} is truncated. Please check the file' .format(getattr(genome, 'name', 'input')))
+
+
+'''ITER_BGZF_BLOCKS
+
+    Parameters
+    ----------
+    genome: file
+        BGZF input, opened in binary mode
+
+    threads: int
+        number of threads decompressing the blocks
+
+    Yields
+    -------
+    block: bytes
+        decompressed data of a batch of BGZF_BATCH blocks, in the order of the file
+
+'''
+
+def iter_bgzf_blocks(genome, threads):
+    with ThreadPoolExecutor(threads) as pool:
+        pending = collections.deque()
+        batch = []
+        for block in iter(lambda: reads_bgzf_block(genome), None):
+            batch.append(block)
+            if len(batch) == BGZF_BATCH:
+                pending.append(pool.submit(inflates_blocks, batch))
+                batch = []
+            # the oldest batch is given to the reader first, so the order of the file is kept
+            if len(pending) >= BGZF_QUEUE * threads:
+                yield pending.popleft().result()
+        if batch:
+            pending.append(pool.submit(inflates_blocks, batch))
+        while pending:
+            yield pending.popleft().result()
+
+
+'''READS_BGZF_BLOCK
+
+    Parameters
+    ----------
+    genome: file
+        BGZF input, opened in binary mode
+
+    Returns
+    -------
+    block: tuple
+        compressed data, CRC32 and size of the decompressed data of the next block, or None at the end of the file
+
+'''
+
+def reads_bgzf_block(genome):
+    header = genome.read(12)
+    if not header:
+        return(None)
+    # the extra field contains the BC subfield, with the size of the whole block minus 1
+    if len(header) < 12 or header[:4] != GZIP_MAGIC + b'\x08\x04':
+        raise InvalidInput('The compressed file {} is not a valid BGZF file. Please check the file' .format(getattr(genome, 'name', 'input')))
+    extra = genome.read(int.from_bytes(header[10:12], 'little'))
+    block_size = None
+    position = 0
+    while position + 4 <= len(extra):
+        field_size = int.from_bytes(extra[position + 2:position + 4], 'little')
+        if extra[position:position + 2] == b'BC':
+            block_size = int.from_bytes(extra[position + 4:position + 6], 'little') + 1
+        position += 4 + field_size
+    if block_size is None:
+        raise InvalidInput('The compressed file {} is not a valid BGZF file. Please check the file' .format(getattr(genome, 'name', 'input')))
+    rest = genome.read(block_size - 12 - len(extra))
+    if len(rest) != block_size - 12 - len(extra) or len(rest) < 8:
+        raise InvalidInput('The compressed file {} is truncated. Please check the file' .format(getattr(genome, 'name', 'input')))
+    # the last 8 bytes are the CRC32 and the size of the decompressed data
+    return((rest[:-8], int.from_bytes(rest[-8:-4], 'little'), int.from_bytes(rest[-4:], 'little')))
+
+
+'''INFLATES_BLOCKS
+
+    Parameters
+    ----------
+    blocks: list
+        compressed blocks, as returned by reads_bgzf_block
+
+    Returns
+    -------
+    data: bytes
+        decompressed data of all the blocks
+
+'''
+
+def inflates_blocks(blocks):
+    data = []
+    for compressed, crc, size in blocks:
+        # raw deflate data (wbits=-15), since the header was already read
+        try:
+            block = zlib.decompress(compressed, -15)
+        except zlib.error:
+            block = None
+        if block is None or len(block) != size or zlib.crc32(block) != crc:
+            raise InvalidInput('The compressed file contains a corrupted block. Please check the file')
+        data.append(block)
+    return(b''.join(data))
+
+
+'Reads the decompressed data of a gzip or BGZF input, as if it was a file opened in binary mode'
+class DecompressedFile:
+
+    def __init__(self, genome, bgzf, threads=DECOMPRESS_THREADS, max_size=None, name=None):
+        self.genome = genome
+        # same name as the compressed file, used for the title of the plots and in the error messages; streams
+        # without a name (e.g. uploads) are called 'input', as in iter_seq_chunks
+        self.name = name or getattr(genome, 'name', None) or 'input'
+        self.bgzf = bgzf
+        self.threads = threads
+        self.max_size = max_size
+        # position of the compressed data in the input, to decompress it again from the start
+        self.start = genome.tell() if genome.seekable() else None
+        # number of header lines (records) in the data read so far, counted only the first time the data is read:
+        # compressed files cannot be indexed, so all their records are read as one sequence, and the user is told so
+        self.headers = 0
+        self.counted = 0
+        self.last_counted = b''
+        self.restarts()
+
+    def restarts(self):
+        if self.start is not None:
+            self.genome.seek(self.start)
+        self.blocks = iter_bgzf_blocks(self.genome, self.threads) if self.bgzf else iter_gzip_blocks(self.genome)
+        self.buffer = bytearray()
+        # number of bytes decompressed and number of bytes already read
+        self.size = 0
+        self.pos = 0
+
+    def fills(self, size):
+        # decompresses more blocks until the buffer holds size bytes (or all the data, if size is negative)
+        while size < 0 or len(self.buffer) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.size += len(block)
+            if self.max_size is not None and self.size > self.max_size:
+                raise InvalidInput('The file {} is larger than {} bytes once decompressed' .format(self.name, self.max_size))
+            self.buffer += block
+
+    def read(self, size=-1):
+        size = -1 if size is None else size
+        self.fills(size)
+        stop = len(self.buffer) if size < 0 else min(size, len(self.buffer))
+        data = bytes(self.buffer[:stop])
+        del self.buffer[:stop]
+        self.pos += len(data)
+        # counts the headers of the data read for the first time: a header is a > at the start of a line
+        if self.pos > self.counted:
+            segment = data[len(data) - (self.pos - self.counted):]
+            self.headers += segment.count(b'\n>') + (segment[:1] == b'>' and self.last_counted in (b'', b'\n'))
+            self.last_counted = segment[-1:]
+            self.counted = self.pos
+        return(data)
+
+    def readline(self):
+        # decompresses more blocks until a newline is found, or until the end of the data
+        searched = 0
+        newline = self.buffer.find(b'\n')
+        while newline == -1:
+            searched = len(self.buffer)
+            self.fills(searched + CHUNK_SIZE)
+            if len(self.buffer) == searched:
+                return(self.read(searched))
+            newline = self.buffer.find(b'\n', searched)
+        return(self.read(newline + 1))
+
+    def seek(self, offset, whence=0):
+        if whence != 0 or offset < 0:
+            raise OSError('Compressed files can only be read again from an absolute position')
+        # going back decompresses the file again from its start
+        if offset < self.pos:
+            if self.start is None:
+                raise OSError('The compressed input {} cannot be read twice' .format(self.name))
+            self.blocks.close()
+            self.restarts()
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, CHUNK_SIZE)):
+                break
+        return(self.pos)
+
+    def tell(self):
+        return(self.pos)
+
+    def seekable(self):
+        return(self.start is not None)
+
+    def close(self):
+        self.blocks.close()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/defaults.py
+
+- General description:
+This module contains the choices and default values of the options shared by plotZcurve.py, the web interface and the
+modules of the zcurve package. It imports only the standard library, so the command line options can be set up (and
+plotZcurve.py -h printed) without loading numpy, R or matplotlib.
+
+- List of imported modules:
+1. os: to choose the default number of threads
+
+"""
+#%% IMPORT MODULES
+
+import os
+
+#%% CONSTANTS
+
+# formats of the sliding-window profile
+WINDOW_FORMATS = ['tsv', 'npz']
+
+# decimation methods available for decimates_coord
+DECIMATION_METHODS = ['stride', 'minmax', 'lttb']
+
+# default number of threads decompressing the BGZF blocks
+DECOMPRESS_THREADS = min(4, os.cpu_count() or 1)
+
+# backends which can draw the plots
+RENDER_BACKENDS = ['r', 'matplotlib']
+
+# formats of the metrics written with --profile
+METRICS_FORMATS = ['jsonl', 'prometheus']
+
+# types of the coordinates written with --export
+EXPORT_DTYPES = ['float32', 'float64']
@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/index.py
+
+- General description:
+This module indexes multi-record FASTA files (e.g. assemblies with one record per contig or chromosome), so that
+each record can be read on its own, without scanning the whole file. The index has the same format as the .fai
+files of samtools faidx: one line per record with its name, length, offset of its first base, bases per line and
+bytes per line (newline included), so an existing .fai file is reused as it is.
+
+- Procedure:
+1. the file is memory-mapped, and the headers are found with mmap.find, which runs in C
+2. for each record, the positions of the newlines are checked with numpy against the regular line width of
+the first line, in large slices; the length of the record is calculated from the number of lines
+3. the index is written next to the genome (<genome>.fai) and reused as long as it is newer than the genome
+4. a record is then opened as a file-like object over its own bytes of the memory map (header included), so
+every function which reads a FASTA file (e.g. iter_seq_chunks in core.py) can read one record on its own
+5. for a region of a record (--region chr:start-end), the byte offset of any base is calculated from the line widths of
+the index; the bases before the region are counted with a histogram of the raw bytes of the memory map (newlines
+included, which are then ignored), and only the bases of the region are read and transformed, starting from those
+counts and divided by the length of the whole record -> the coordinates are exactly those of the whole curve
+6. the first time a region of a record is read, the cumulative counts of each base every CHECKPOINT_BASES bases of the
+record are saved next to the genome (<genome>.counts.npz); the following regions of the same record only count the
+bases between the last checkpoint and their start
+
+- List of user-defined functions:
+1. builds_index: scans a FASTA file and returns the index of its records
+2. indexes_record: calculates the length and the line widths of one record
+3. writes_index, reads_index: write and read a .fai file
+4. loads_index: reads the .fai file next to the genome if it is up to date, otherwise builds it and tries to save it
+5. opens_records: memory-maps a FASTA file and returns one RecordFile for each selected record
+6. RecordFile: file-like object which reads only the bytes of one record
+7. parses_region: reads a region given as name:start-end
+8. locates_base: calculates the offset in the file of a base of a record
+9. counts_prefix: counts each base before a position of a record, without reading the sequence
+10. reads_region: reads the sequence of a region of a record
+11. calculates_region: calculates the coordinates of a region, with the same values as in the whole record
+12. counts_bytes: counts each base in a range of bytes of the file, ignoring the newlines
+13. builds_checkpoints: calculates the cumulative counts of each base every CHECKPOINT_BASES bases of a record
+14. loads_checkpoints: reads the checkpoints of a record from <genome>.counts.npz, or builds and saves them
+
+- List of imported modules:
+1. os, mmap: to check the modification times and to memory-map the files
+2. numpy: to check the positions of the newlines of each record at once
+3. core: for the errors and the Z-curve calculations, found in the same folder
+
+- Possible errors addressed in the module:
+1. InvalidInput: if the file is empty or does not start with >, if the lines of a record do not all have the same length
+(except the last one), if a selected record is not in the file, or if a region is not within its record
+2. InvalidNucleotide: if the region, or the bases before it, contain non-nucleotide characters
+
+"""
+#%% IMPORT MODULES
+
+import os
+import mmap
+import numpy as np
+
+from .core import InvalidInput, InvalidNucleotide, BASE_ORDER, SEQ_TABLE, WHITESPACE
+from .core import encodes_seq, counts_bases, transforms_counts
+
+# number of bytes of a record checked at once for the newlines: 64 MB
+INDEX_SLICE = 1 << 26
+
+# number of bytes counted at once before a region: 4 MB, since numpy.bincount makes an int64 copy of each slice
+COUNT_SLICE = 1 << 22
+
+# distance between two checkpoints of the cumulative counts: 1 Mb, so at most 1 Mb is counted before a region
+CHECKPOINT_BASES = 1 << 20
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''BUILDS_INDEX
+
+    Parameters
+    ----------
+    genome_path: string
+        path to the FASTA file
+
+    Returns
+    -------
+    index: list
+        one tuple for each record: name, length, offset of the first base, bases per line, bytes per line
+
+'''
+
+def builds_index(genome_path):
+    index = []
+    # an empty file cannot be memory-mapped, and is not a fasta file either
+    if os.path.getsize(genome_path) == 0:
+        raise InvalidInput('Your input file {} is empty. Please insert a fasta file' .format(genome_path))
+    with open(genome_path, 'rb') as genome, mmap.mmap(genome.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if mm[:1] != b'>':
+            raise InvalidInput('Your input file {} is not valid. Please insert a fasta file' .format(genome_path))
+        header = 0
+        while header != -1:
+            # the name of the record is the first word of its header, as in samtools faidx
+            header_end = mm.find(b'\n', header)
+            if header_end == -1:
+                header_end = len(mm)
+            name = mm[header + 1:header_end].split()[0].decode() if mm[header + 1:header_end].split() else ''
+            # the sequence goes on until the next header, or until the end of the file
+            next_header = mm.find(b'\n>', header_end)
+            end = len(mm) if next_header == -1 else next_header + 1
+            index.append(indexes_record(mm, name, min(header_end + 1, len(mm)), end))
+            header = -1 if next_header == -1 else next_header + 1
+    return(index)
+
+
+'''INDEXES_RECORD
+
+    Parameters
+    ----------
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    name: string
+        name of the record
+
+    start: int
+        offset of the first byte after the header line
+
+    end: int
+        offset of the first byte of the next header, or size of the file
+
+    Returns
+    -------
+    entry: tuple
+        name, length, offset of the first base, bases per line, bytes per line
+
+'''
+
+def indexes_record(mm, name, start, end):
+    # the newlines and empty lines at the end of the record are not part of the sequence
+    while end > start and mm[end - 1] in (10, 13):
+        end -= 1
+    if end == start:
+        return((name, 0, start, 0, 0))
+    # the width of the first line is the width of all lines, except the last one
+    first_newline = mm.find(b'\n', start, end)
+    if first_newline == -1:
+        return((name, end - start, start, end - start, end - start + 1))
+    line_width = first_newline - start + 1
+    line_bases = line_width - 1 - (mm[first_newline - 1] == 13)
+    # checks that each newline is exactly one line width after the previous one, one slice at a time
+    seq = np.frombuffer(mm, dtype=np.uint8, count=end - start, offset=start)
+    n_lines = 0
+    for slice_start in range(0, len(seq), INDEX_SLICE):
+        newlines = np.flatnonzero(seq[slice_start:slice_start + INDEX_SLICE] == 10) + slice_start
+        expected = (np.arange(len(newlines)) + n_lines + 1) * line_width - 1
+        if not np.array_equal(newlines, expected):
+            del seq
+            raise InvalidInput('The record {} has lines of different lengths, so it cannot be indexed. Please reformat the fasta file (e.g. with samtools faidx or seqkit seq)' .format(name))
+        n_lines += len(newlines)
+    del seq
+    # the last line, after the last newline, can be shorter
+    last_line = (end - start) - n_lines * line_width
+    if last_line > line_bases:
+        raise InvalidInput('The record {} has lines of different lengths, so it cannot be indexed. Please reformat the fasta file (e.g. with samtools faidx or seqkit seq)' .format(name))
+    return((name, n_lines * line_bases + last_line, start, line_bases, line_width))
+
+
+'''WRITES_INDEX
+
+    Parameters
+    ----------
+    index: list
+        index of the records, as returned by builds_index
+
+    fai_path: string
+        path of the .fai file
+
+'''
+
+def writes_index(index, fai_path):
+    with open(fai_path, 'w') as fai:
+        for entry in index:
+            fai.write('\t'.join(str(value) for value in entry) + '\n')
+
+
+'''READS_INDEX
+
+    Parameters
+    ----------
+    fai_path: string
+        path of the .fai file
+
+    Returns
+    -------
+    index: list
+        index of the records, as returned by builds_index
+
+'''
+
+def reads_index(fai_path):
+    index = []
+    with open(fai_path, 'r') as fai:
+        for line in fai:
+            fields = line.rstrip('\n').split('\t')
+            # the .fai files of samtools for FASTQ have 6 columns; only the first 5 are used
+            index.append((fields[0],) + tuple(int(value) for value in fields[1:5]))
+    return(index)
+
+
+'''LOADS_INDEX
+
+    Parameters
+    ----------
+    genome_path: string
+        path to the FASTA file
+
+    Returns
+    -------
+    index: list
+        index of the records, as returned by builds_index
+
+'''
+
+def loads_index(genome_path):
+    fai_path = genome_path + '.fai'
+    # the index is reused only if it was written after the last change of the genome
+    if os.path.isfile(fai_path) and os.path.getmtime(fai_path) >= os.path.getmtime(genome_path):
+        return(reads_index(fai_path))
+    index = builds_index(genome_path)
+    # if the folder is read-only, the index is only kept in memory
+    try:
+        writes_index(index, fai_path)
+    except OSError:
+        pass
+    return(index)
+
+
+'''OPENS_RECORDS
+
+    Parameters
+    ----------
+    genome_path: string
+        path to the FASTA file
+
+    index: list
+        index of the records, as returned by loads_index
+
+    records: list
+        names of the records to open, or None to open all of them
+
+    Returns
+    -------
+    mm: mmap.mmap
+        memory map of the file, to be closed once all records are read
+
+    record_files: list
+        one RecordFile for each selected record, in the order of the file
+
+'''
+
+def opens_records(genome_path, index, records=None):
+    names = [entry[0] for entry in index]
+    # all selected records must be in the file
+    missing = [name for name in (records or []) if name not in names]
+    if missing:
+        raise InvalidInput('The records {} are not in the file {}' .format(', '.join(missing), genome_path))
+    # the file may have been emptied since it was indexed
+    if os.path.getsize(genome_path) == 0:
+        raise InvalidInput('Your input file {} is empty. Please insert a fasta file' .format(genome_path))
+    with open(genome_path, 'rb') as genome:
+        mm = mmap.mmap(genome.fileno(), 0, access=mmap.ACCESS_READ)
+    # start of the header of each record: the header is the line just before its first base
+    starts = [mm.rfind(b'\n', 0, max(entry[2] - 1, 0)) + 1 for entry in index] + [len(mm)]
+    record_files = [RecordFile(mm, genome_path, name, starts[number], starts[number + 1])
+                    for number, name in enumerate(names) if records is None or name in records]
+    return(mm, record_files)
+
+
+'Reads one record of a memory-mapped FASTA file, header included, as if it was a file on its own'
+class RecordFile:
+
+    def __init__(self, mm, genome_path, record, start, end):
+        self.mm = mm
+        # path of the whole file, used for the modification time and in the error messages
+        self.name = genome_path
+        self.record = record
+        self.start = start
+        self.end = end
+        self.pos = start
+
+    def read(self, size=-1):
+        stop = self.end if size is None or size < 0 else min(self.pos + size, self.end)
+        data = self.mm[self.pos:stop]
+        self.pos = max(self.pos, stop)
+        return(data)
+
+    def readline(self):
+        newline = self.mm.find(b'\n', self.pos, self.end)
+        return(self.read(self.end - self.pos if newline == -1 else newline + 1 - self.pos))
+
+    def seek(self, offset, whence=0):
+        base = {0: self.start, 1: self.pos, 2: self.end}[whence]
+        self.pos = min(max(base + offset, self.start), self.end)
+        return(self.pos - self.start)
+
+    def tell(self):
+        return(self.pos - self.start)
+
+    def seekable(self):
+        return(True)
+
+
+'''PARSES_REGION
+
+    Parameters
+    ----------
+    region: string
+        region as name:start-end, with 1-based and inclusive positions (as in samtools faidx); the thousands
+        can be separated by commas, and a name alone means the whole record
+
+    Returns
+    -------
+    name: string
+        name of the record
+
+    start, end: int
+        0-based limits of the region, end excluded; end is None if the region goes to the end of the record
+
+'''
+
+def parses_region(region):
+    name, colon, limits = region.rpartition(':')
+    # without a colon (or without limits), the region is the whole record
+    if not colon or not limits:
+        return((name or limits, 0, None))
+    try:
+        start, dash, end = limits.replace(',', '').partition('-')
+        start = int(start)
+        end = int(end) if end else None
+    except ValueError:
+        raise InvalidInput('The region {} is not valid. Please write it as name:start-end, e.g. chr1:10001-20000' .format(region))
+    if start < 1 or (end is not None and end < start):
+        raise InvalidInput('The region {} is not valid: the start must be at least 1, and the end cannot be before the start' .format(region))
+    return((name, start - 1, end))
+
+
+'''LOCATES_BASE
+
+    Parameters
+    ----------
+    entry: tuple
+        entry of the record in the index
+
+    position: int
+        0-based position of the base in the record; the length of the record gives the end of its sequence
+
+    Returns
+    -------
+    offset: int
+        offset of the base in the file
+
+'''
+
+def locates_base(entry, position):
+    name, length, offset, line_bases, line_width = entry
+    # each full line takes line_width bytes, newline included
+    return(offset + position // line_bases * line_width + position % line_bases if line_bases else offset)
+
+
+'''COUNTS_PREFIX
+
+    Parameters
+    ----------
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    entry: tuple
+        entry of the record in the index
+
+    position: int
+        number of bases to count, from the start of the record
+
+    checkpoints: numpy.array
+        cumulative counts of the record every CHECKPOINT_BASES bases, as returned by builds_checkpoints, or None to count
+        all bases from the start of the record
+
+    Returns
+    -------
+    totals: numpy.array
+        int64 array with the count of each base before position, in the order given by BASE_ORDER
+
+'''
+
+def counts_prefix(mm, entry, position, checkpoints=None):
+    # starts from the last checkpoint before the position, if there is one
+    checkpoint = 0 if checkpoints is None else min(position // CHECKPOINT_BASES, len(checkpoints) - 1)
+    totals = np.zeros(len(BASE_ORDER), dtype=np.int64) if checkpoints is None else checkpoints[checkpoint].copy()
+    totals += counts_bytes(mm, entry, locates_base(entry, checkpoint * CHECKPOINT_BASES), locates_base(entry, position), position)
+    return(totals)
+
+
+'''READS_REGION
+
+    Parameters
+    ----------
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    entry: tuple
+        entry of the record in the index
+
+    start, end: int
+        0-based limits of the region, end excluded
+
+    Returns
+    -------
+    seq: bytes
+        validated, lower case sequence of the region
+
+'''
+
+def reads_region(mm, entry, start, end):
+    raw = mm[locates_base(entry, start):locates_base(entry, end)]
+    # lowers the nucleotides and removes the newlines; invalid characters become 0, as in iter_seq_chunks
+    seq = raw.translate(SEQ_TABLE, WHITESPACE)
+    invalid = seq.find(0)
+    if invalid != -1:
+        bad = raw.translate(None, WHITESPACE)[invalid]
+        raise InvalidNucleotide('The record {} contains the invalid character {!r} at position {}. Please insert a valid input fasta file' .format(entry[0], chr(bad), start + invalid + 1))
+    return(seq)
+
+
+'''CALCULATES_REGION
+
+    Parameters
+    ----------
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    entry: tuple
+        entry of the record in the index
+
+    start, end: int
+        0-based limits of the region, end excluded
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    checkpoints: numpy.array
+        checkpoints of the record, as returned by loads_checkpoints, or None
+
+    Returns
+    -------
+    coord: numpy.array
+        float64 array of shape (end - start, 3), equal to the rows start to end of the coordinates of the whole record
+
+    totals: numpy.array
+        int64 array with the total count of each base in the region
+
+    seq: bytes
+        sequence of the region
+
+'''
+
+def calculates_region(mm, entry, start, end, tr_matrix, checkpoints=None):
+    # running counts at the start of the region, as if the whole record was read
+    prefix = counts_prefix(mm, entry, start, checkpoints)
+    seq = reads_region(mm, entry, start, end)
+    counts = counts_bases(encodes_seq(seq))
+    counts += prefix
+    # the frequencies are divided by the length of the whole record, as in calculates_coord
+    coord = transforms_counts(counts, entry[1], tr_matrix)
+    totals = counts[-1] - prefix
+    return(coord, totals, seq)
+
+
+'''COUNTS_BYTES
+
+    Parameters
+    ----------
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    entry: tuple
+        entry of the record in the index, used in the error messages
+
+    start, stop: int
+        offsets of the first byte and of the byte after the last one
+
+    position: int
+        position of the base at stop, used in the error messages
+
+    Returns
+    -------
+    totals: numpy.array
+        int64 array with the count of each base between start and stop, in the order given by BASE_ORDER
+
+'''
+
+def counts_bytes(mm, entry, start, stop, position):
+    # histogram of all the bytes, one slice at a time; the newlines are counted too, and then ignored,
+    # so the sequence does not have to be copied without them
+    histogram = np.zeros(256, dtype=np.int64)
+    for slice_start in range(start, stop, COUNT_SLICE):
+        raw = np.frombuffer(mm, dtype=np.uint8, count=min(COUNT_SLICE, stop - slice_start), offset=slice_start)
+        histogram += np.bincount(raw, minlength=256)
+        del raw
+    # all other bytes are invalid characters, as in the rest of the sequence
+    valid = np.frombuffer(SEQ_TABLE, dtype=np.uint8) != 0
+    valid[list(WHITESPACE)] = True
+    if histogram[~valid].any():
+        invalid = int(np.flatnonzero(histogram * ~valid)[0])
+        raise InvalidNucleotide('The record {} contains the invalid character {!r} before position {}. Please insert a valid input fasta file' .format(entry[0], chr(invalid), position + 1))
+    totals = np.array([histogram[ord(base)] + histogram[ord(base.upper())] for base in BASE_ORDER], dtype=np.int64)
+    return(totals)
+
+
+'''BUILDS_CHECKPOINTS
+
+    Parameters
+    ----------
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    entry: tuple
+        entry of the record in the index
+
+    Returns
+    -------
+    checkpoints: numpy.array
+        int64 array of shape (number of checkpoints, 4): row k is the count of each base before position k * CHECKPOINT_BASES
+
+'''
+
+def builds_checkpoints(mm, entry):
+    n_checkpoints = entry[1] // CHECKPOINT_BASES + 1
+    checkpoints = np.zeros((n_checkpoints, len(BASE_ORDER)), dtype=np.int64)
+    # counts each block between two checkpoints, then adds them up
+    for checkpoint in range(1, n_checkpoints):
+        checkpoints[checkpoint] = counts_bytes(mm, entry, locates_base(entry, (checkpoint - 1) * CHECKPOINT_BASES),
+                                               locates_base(entry, checkpoint * CHECKPOINT_BASES), checkpoint * CHECKPOINT_BASES)
+    np.cumsum(checkpoints, axis=0, out=checkpoints)
+    return(checkpoints)
+
+
+'''LOADS_CHECKPOINTS
+
+    Parameters
+    ----------
+    genome_path: string
+        path to the FASTA file
+
+    mm: mmap.mmap
+        memory map of the FASTA file
+
+    index: list
+        index of the records, as returned by loads_index
+
+    number: int
+        position of the record in the index
+
+    Returns
+    -------
+    checkpoints: numpy.array
+        checkpoints of the record, as returned by builds_checkpoints
+
+'''
+
+def loads_checkpoints(genome_path, mm, index, number):
+    counts_path = genome_path + '.counts.npz'
+    saved = {}
+    # the checkpoints are reused only if they were written after the last change of the genome, with the same distance
+    if os.path.isfile(counts_path) and os.path.getmtime(counts_path) >= os.path.getmtime(genome_path):
+        with np.load(counts_path) as counts_file:
+            saved = dict(counts_file)
+        if saved.get('step') != CHECKPOINT_BASES:
+            saved = {}
+    # the records are saved by their position in the index, since their names may not be valid keys
+    key = 'record_{}' .format(number)
+    if key not in saved:
+        saved[key] = builds_checkpoints(mm, index[number])
+        saved['step'] = np.array(CHECKPOINT_BASES)
+        # if the folder is read-only, the checkpoints are only kept in memory
+        try:
+            np.savez(counts_path, **saved)
+        except OSError:
+            pass
+    return(saved[key])
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/metrics.py
+
+- General description:
+This module records how long each stage of the pipeline takes (reading the FASTA file, calculating the coordinates,
+converting them for R, drawing the plots...), for each genome, with --profile in plotZcurve.py or app.config['PROFILE']
+in the web interface. For each stage, it records the wall time, the CPU time of the process, the peak memory (RSS, and
+optionally the peak of the memory allocated by python and numpy, with tracemalloc) and the number of bases (or points)
+processed. The hot stages can also be run under cProfile.
+
+- Procedure:
+1. enables_metrics is run once in each process (the main one, the render process and the --batch workers, or the
+flask process and its render workers): when the metrics are not enabled, measures_stage does nothing
+2. each stage is run inside measures_stage, which writes one JSON line per stage to the metrics file; each line is
+appended with a single write, so the processes of the same run can write to the same file
+3. with the prometheus format, the JSON lines are written to a file next to the metrics file (<file>.jsonl), and
+finishes_metrics converts them to the Prometheus text format at the end of the run (or of each job, in the web interface)
+
+- List of user-defined functions:
+1. enables_metrics: sets up the metrics of this process
+2. initializes_process: sets up the metrics of a worker process, then runs its own initializer
+3. measures_stage: measures one stage of one genome, and writes its record
+4. reads_peak_rss: reads the peak RSS of the process
+5. writes_record: appends one record to the metrics file
+6. finishes_metrics: writes the Prometheus text file from the JSON lines
+7. formats_labels: formats the labels of a Prometheus sample
+
+- List of imported modules:
+1. os, sys, json, time, contextlib, re: to measure the stages and write the records
+2. resource: to read the peak RSS (not available on Windows, where it is not reported)
+3. tracemalloc and cProfile: to measure the memory allocated by python and numpy, and to profile the hot stages, only
+when asked to
+
+- Possible errors addressed in the module:
+1. ValueError: if the format of the metrics is not one of METRICS_FORMATS
+
+- List of known/possible bugs:
+1. the CPU time is the one of the whole process, so in the web interface it includes the other threads; the processes
+forked by R to save the formats (--format-jobs) are not included
+2. tracemalloc measures the memory allocated since the start of the stage by all the threads of the process
+
+"""
+#%% IMPORT MODULES
+
+import os
+import sys
+import json
+import time
+import contextlib
+import re
+# the peak RSS is read from the operating system, which is not possible on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# formats of the metrics
+from .defaults import METRICS_FORMATS
+
+#%% CONSTANTS
+
+# stages run under cProfile when a cProfile folder is given: the stages which read or calculate whole genomes, and the plots
+HOT_STAGES = ['read', 'coord', 'coord_store', 'region', 'export', 'decimate', 'windows', 'convert', 'plot_zcurve', 'plot_ws', 'plot_windows']
+
+# value of each record, with the name and description of its Prometheus metric
+PROMETHEUS_METRICS = [('wall_s', 'zcurve_stage_wall_seconds', 'Wall time of the last run of the stage'),
+                      ('cpu_s', 'zcurve_stage_cpu_seconds', 'CPU time of the process during the last run of the stage'),
+                      ('bases', 'zcurve_stage_bases', 'Bases (or points, for the plots) processed by the last run of the stage'),
+                      ('peak_rss_mb', 'zcurve_stage_peak_rss_megabytes', 'Peak RSS of the process at the end of the last run of the stage'),
+                      ('traced_peak_mb', 'zcurve_stage_traced_peak_megabytes', 'Peak memory allocated by the last run of the stage (tracemalloc)')]
+
+# metrics of this process; None as path when they are not enabled
+metrics_state = {'path': None, 'format': 'jsonl', 'cprofile_dir': None, 'tracemalloc': False}
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''ENABLES_METRICS
+
+    Parameters
+    ----------
+    profile: dict
+        path of the metrics file, format (one of METRICS_FORMATS), folder of the cProfile files (or None) and
+        tracemalloc (True to measure the memory allocated by each stage), or None to disable the metrics
+
+    new_file: bool
+        if True, the records of a previous run are removed
+
+'''
+
+def enables_metrics(profile, new_file=False):
+    # without the option, the metrics are disabled
+    if not profile or not profile.get('path'):
+        metrics_state['path'] = None
+        return
+    if profile.get('format', 'jsonl') not in METRICS_FORMATS:
+        raise ValueError('Unknown metrics format {}, please choose one of {}' .format(profile['format'], METRICS_FORMATS))
+    metrics_state.update({'format': profile.get('format', 'jsonl'), 'cprofile_dir': profile.get('cprofile_dir'),
+                          'tracemalloc': profile.get('tracemalloc', False)})
+    # with the prometheus format, the records are first written as JSON lines next to the metrics file
+    metrics_state['path'] = profile['path'] + '.jsonl' if metrics_state['format'] == 'prometheus' else profile['path']
+    if new_file:
+        open(metrics_state['path'], 'w').close()
+    if metrics_state['cprofile_dir']:
+        os.makedirs(metrics_state['cprofile_dir'], exist_ok=True)
+    # tracemalloc slows the allocations down, so it is started only when asked to
+    if metrics_state['tracemalloc']:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+'''INITIALIZES_PROCESS
+
+    Parameters
+    ----------
+    profile: dict
+        as in enables_metrics, or None
+
+    initializer: function
+        initializer of the worker process (e.g. render.initializes_renderer), or None
+
+    initargs: tuple
+        arguments of the initializer
+
+'''
+
+def initializes_process(profile, initializer=None, initargs=()):
+    enables_metrics(profile)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+'''MEASURES_STAGE
+
+    Parameters
+    ----------
+    stage: string
+        name of the stage (e.g. read, coord, decimate, convert, plot_zcurve)
+
+    genome: string
+        name of the genome (or record, or region)
+
+    Returns
+    -------
+    record: dict
+        yielded to the stage, which can set the number of bases it processed (record['bases']); it is written to the
+        metrics file once the stage is done, only if it did not raise an error
+
+'''
+
+@contextlib.contextmanager
+def measures_stage(stage, genome):
+    record = {'genome': genome, 'stage': stage, 'bases': None}
+    # nothing is measured when the metrics are not enabled
+    if metrics_state['path'] is None:
+        yield record
+        return
+    profiler = None
+    if metrics_state['cprofile_dir'] and stage in HOT_STAGES:
+        import cProfile
+        profiler = cProfile.Profile()
+    if metrics_state['tracemalloc']:
+        import tracemalloc
+        tracemalloc.reset_peak()
+        # memory already allocated before the stage
+        traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = reads_peak_rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    # the profiler is stopped even if the stage fails; the record is then not written
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    record['wall_s'] = time.perf_counter() - wall_start
+    record['cpu_s'] = time.process_time() - cpu_start
+    record['peak_rss_mb'] = reads_peak_rss()
+    # how much the stage raised the peak RSS of the process
+    record['rss_growth_mb'] = None if rss_before is None else record['peak_rss_mb'] - rss_before
+    # peak of the memory allocated by the stage, on top of what was allocated before it
+    record['traced_peak_mb'] = (tracemalloc.get_traced_memory()[1] - traced_before) / 2**20 if metrics_state['tracemalloc'] else None
+    record['pid'] = os.getpid()
+    record['time'] = time.time()
+    if profiler is not None:
+        # one file for each stage of each genome, named so that the files of two processes never collide
+        profile_name = re.sub(r'[^\w.-]', '_', '{}_{}_{}.prof' .format(genome, stage, os.getpid()))
+        profiler.dump_stats(os.path.join(metrics_state['cprofile_dir'], profile_name))
+    writes_record(record)
+
+
+'''READS_PEAK_RSS
+
+    Returns
+    -------
+    peak: float
+        peak memory (RSS) of this process so far, in MB, or None on Windows
+
+'''
+
+def reads_peak_rss():
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kB on Linux
+    return(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10)
+
+
+'''WRITES_RECORD
+
+    Parameters
+    ----------
+    record: dict
+        measures of one stage of one genome
+
+'''
+
+def writes_record(record):
+    line = (json.dumps(record) + '\n').encode()
+    # one write in append mode, so the lines of two processes are never mixed
+    fd = os.open(metrics_state['path'], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+'''FINISHES_METRICS
+
+    Parameters
+    ----------
+    profile: dict
+        as in enables_metrics, or None
+
+    keep_records: bool
+        with the prometheus format, if False the JSON lines are removed once converted (at the end of a run of
+        plotZcurve.py); the web interface keeps them, so that the totals include all the jobs
+
+'''
+
+def finishes_metrics(profile, keep_records=False):
+    if not profile or not profile.get('path') or profile.get('format', 'jsonl') != 'prometheus':
+        return
+    records_path = profile['path'] + '.jsonl'
+    # last value of each stage of each genome, and totals of each stage
+    last = {}
+    totals = {}
+    if os.path.exists(records_path):
+        with open(records_path) as records:
+            for line in records:
+                record = json.loads(line)
+                last[(record['genome'], record['stage'])] = record
+                runs, wall = totals.get(record['stage'], (0, 0.0))
+                totals[record['stage']] = (runs + 1, wall + record['wall_s'])
+    lines = []
+    for key, name, description in PROMETHEUS_METRICS:
+        samples = [(labels, record[key]) for labels, record in last.items() if record.get(key) is not None]
+        # the metrics without any value (e.g. tracemalloc, when it is not used) are left out
+        if not samples:
+            continue
+        lines += ['# HELP {} {}' .format(name, description), '# TYPE {} gauge' .format(name)]
+        lines += ['{}{} {}' .format(name, formats_labels(genome=genome, stage=stage), value) for (genome, stage), value in samples]
+    lines += ['# HELP zcurve_stage_runs_total Number of runs of each stage', '# TYPE zcurve_stage_runs_total counter']
+    lines += ['zcurve_stage_runs_total{} {}' .format(formats_labels(stage=stage), runs) for stage, (runs, wall) in totals.items()]
+    lines += ['# HELP zcurve_stage_wall_seconds_total Total wall time of each stage', '# TYPE zcurve_stage_wall_seconds_total counter']
+    lines += ['zcurve_stage_wall_seconds_total{} {}' .format(formats_labels(stage=stage), wall) for stage, (runs, wall) in totals.items()]
+    # the file is replaced at once, so a scraper never reads half of it
+    tmp_path = profile['path'] + '.tmp'
+    with open(tmp_path, 'w') as prometheus:
+        prometheus.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, profile['path'])
+    if not keep_records and os.path.exists(records_path):
+        os.remove(records_path)
+
+
+'''FORMATS_LABELS
+
+    Parameters
+    ----------
+    labels: keyword arguments
+        name and value of each label
+
+    Returns
+    -------
+    text: string
+        labels as {name="value",...}, with the backslashes, quotes and newlines of the values escaped
+
+'''
+
+def formats_labels(**labels):
+    escaped = ['{}="{}"' .format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for name, value in labels.items()]
+    return('{' + ','.join(escaped) + '}')
@@ -0,0 +1,787 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/pipeline.py
+
+- General description:
+This module contains the stages of plotZcurve.py which process one genome file: reading it (each record, or each
+region, of it), calculating its GC content and coordinates (or reading them from the cache), preparing the plots and
+sending them to the backend which draws them (render.py). plotZcurve.py only parses the command line and calls these
+functions, so they can also be imported and used on their own, e.g. from python:
+
+    from zcurve import pipeline, render
+    from zcurve.core import TR_MATRIX
+    render.initializes_renderer('scripts', 'matplotlib')
+    with open('zika_genome.fna', 'rb') as genome:
+        for file_name, totals in pipeline.processes_file(genome, TR_MATRIX, pipeline.renders_plot_with('png'), out_path='.'):
+            pipeline.writes_gc(file_name, totals, None)
+
+The plotting backend is never imported by this module: R (rpy2) or matplotlib are loaded only by render.initializes_renderer,
+and not at all with --no-plot.
+
+- Procedure:
+see plotZcurve.py
+
+- List of user-defined functions:
+1. checks_input: checks if the genome is in FASTA format
+2. reads_genome: creates one string from the genome sequence (read in chunks, see core.py) and extract the filename, used later
+3. processes_genome: reads one genome, calculates its GC content and coordinates, and generates the plot(s)
+4. prepares_plot: exports and decimates the coordinates and writes the sliding-window profile of one genome, before its plot(s)
+5. renders_plot: generates the plot(s) of one genome with the backend of this process
+6. submits_plot: sends the plot(s) of one genome to the render process of the rendering pipeline
+7. processes_regions: calculates and plots the coordinates of the regions given with --region
+8. hashes_genome: calculates the cache key of a genome file, from its metadata (or its content, with --cache-hash)
+9. stores_cache: saves the coordinates and the GC content of a genome in the cache
+10. processes_file: finds the records of a genome file, and processes each of them with processes_genome
+11. names_record: creates the output name of a record, from the filename and the name of the record
+12. writes_gc: writes the GC content (and with --composition the base composition and skews) of one genome to the output file or to the terminal
+13. processes_batch: processes one genome in a worker process when --batch is used
+14. skips_plot: used instead of renders_plot with --no-plot, draws nothing
+15. renders_plot_with: returns renders_plot with its options set, to be given to processes_file
+
+- List of imported modules:
+1. os, time, hashlib, shutil, mmap, functools: to find the files, hash them for the cache and map them in memory
+2. numpy: to handle the coordinates
+3. core, cache, index, decompress and render: the other modules of the zcurve package, found in the same folder
+4. metrics: to measure each stage with --profile
+
+- Possible errors addressed in the module:
+1. InvalidInput: if the input file does not start either with > (fasta format)
+2. InvalidNucleotide: if there are non-nucleotides characters in the sequence; the first invalid character
+and its position are reported
+
+"""
+#%% IMPORT MODULES
+
+import os
+import time
+import hashlib
+import shutil
+import mmap
+import functools
+import numpy as np
+
+# vectorized Z-curve calculations
+from .core import calculates_coord_parallel, reads_seq, writes_coord_store, GC_counts, counts_composition
+from .core import decimates_coord, opens_coord_store, CHUNK_SIZE
+from .core import iter_seq_chunks, calculates_windows, writes_windows, writes_export
+from .core import InvalidInput
+# cache of the coordinates
+from . import cache
+# index of the records of multi-record FASTA files
+from .index import loads_index, opens_records, parses_region, calculates_region, loads_checkpoints, counts_prefix
+# backends which draw the plots (R or matplotlib), loaded only when they are set up
+from . import render
+# decompression of the files compressed with gzip or bgzip
+from .decompress import opens_genome, DECOMPRESS_THREADS
+# time, CPU and memory of each stage, with --profile
+from .metrics import measures_stage
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''CHECKS_INPUT
+
+    Parameters
+    ----------
+    genome : file
+        input genome file
+
+'''
+
+def checks_input(genome):
+    # assign the first line of the file to a variable
+    first_line = genome.readline()
+    # checks if file is valid FASTA file or not
+    if not first_line.startswith(b'>'):
+        raise InvalidInput('Your input file {} is not valid. Please insert a fasta file' .format(genome))
+
+
+'''READS_GENOME
+
+    Parameters
+    ----------
+    genome: file
+        input genome file, opened in binary mode, after the first line has been checked
+
+    Returns
+    -------
+    seq: string
+        genome sequence in one string
+
+    plot_main: string
+        filename without extensions, to be used as title of the plot(s)
+
+'''
+
+def reads_genome(genome):
+    # extracts the filename to be used as title of the plot: splits by /, and retrieves the last element
+    # which is going to be the name, and keeps only the name and not the file format eg '.fna'; 
+    # will also be sued for the output
+    plot_main=genome.name.split('/')[-1].split('.')[0]
+
+    # reads the rest of the file in large chunks, which are validated and lowered as bytes; if there is
+    # a non-nucleotide character, it raises InvalidNucleotide with its position and exits the script
+    # -> the first line was already read by checks_input, so the file is read from line 2
+    seq = reads_seq(genome, start_line=2)
+    # returns the genome sequence and the string to be used in the title       
+    return(seq, plot_main)
+
+
+''' PROCESSES_GENOME
+
+    Parameters
+    ----------
+    genome_input : file
+        input genome file, opened in binary mode
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    renders: function
+        draws the plots of one genome, from the dictionary returned by prepares_plot: renders_plot with the backend
+        of this process, or submits_plot to send them to the render process of the rendering pipeline
+
+    out_path: string
+        path to the output directory
+
+    store_dir: string
+        directory of the disk-backed arrays (--out-of-core), or None to keep the sequence in memory
+
+    workers: int
+        number of processes used to calculate the coordinates
+
+    max_points: int
+        maximum number of points sent to R, 0 to send all of them
+
+    decimation: string
+        decimation method, one of DECIMATION_METHODS
+
+    use_cache: bool
+        if True, the coordinates and the GC content are read from the cache, or saved in it after they are calculated
+
+    cache_dir: string
+        folder of the cache, or None to use a .zcurve_cache folder next to the genome
+
+    cache_max_bytes: int
+        maximum size of the cache, in bytes; when it is larger, the least recently used genomes are removed, and a
+        genome larger than the whole cache is not saved. None for no limit
+
+    cache_hash: bool
+        if True, the cache key is the SHA-256 hash of the content of the file; otherwise (faster), its path, size,
+        modification time and inode
+
+    window: int
+        size of the sliding windows, or None to skip the sliding-window profile
+
+    window_step: int
+        distance between the starts of two windows, or None to use the window size
+
+    window_format: string
+        format of the sliding-window profile, one of WINDOW_FORMATS
+
+    file_name: string
+        name used for the title and the output files, or None to use the filename without extensions
+
+    export: dict
+        type of the exported coordinates (dtype, one of EXPORT_DTYPES) and counts (True to export the cumulative counts
+        of each base too), or None to skip the export
+
+    Returns
+    -------
+    file_name: string
+        filename without extensions, used as title of the plot(s)
+
+    totals: numpy.array
+        total count of each base, in the order given by BASE_ORDER (core.py), used for the GC content
+
+'''
+
+def processes_genome(genome_input, tr_matrix, renders, out_path, store_dir, workers, max_points, decimation,
+                     use_cache=True, cache_dir=None, window=None, window_step=None, window_format='tsv', file_name=None, export=None,
+                     cache_max_bytes=None, cache_hash=False):
+    # the whole sequence is kept only in the default mode, not with --out-of-core or when the cache is used
+    seq=None
+    # extracts the genome filename, as in reads_genome, unless a name is given (e.g. for a record)
+    if file_name is None:
+        file_name=genome_input.name.split('/')[-1].split('.')[0]
+    # key of the genome in the cache, or None if the cache is not used
+    key=hashes_genome(genome_input, cache_hash) if use_cache else None
+    if key:
+        # by default, the cache is a folder next to the genome
+        if cache_dir is None:
+            cache_dir=os.path.join(os.path.dirname(os.path.abspath(genome_input.name)), '.zcurve_cache')
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        # if the folder cannot be created (e.g. read-only), the genome is processed without cache
+        except OSError as error:
+            print('The cache cannot be used for {} ({}); the coordinates will be calculated' .format(file_name, error))
+            key=None
+    # metadata of the cached result, if the same file was already processed
+    meta=cache.loads_entry(cache_dir, key) if key else None
+    # if the file is in the cache, the coordinates are memory-mapped from it, and nothing is calculated
+    if meta is not None:
+        with measures_stage('cache_load', file_name) as record:
+            coord=opens_coord_store(os.path.join(cache.entry_path(cache_dir, key), 'coord.npy'))
+            totals=np.array(meta['totals'], dtype=np.int64)
+            record['bases']=len(coord)
+        # number of records of a compressed file, found when it was read
+        headers=meta.get('headers')
+        # message for the user
+        print('Using the cached coordinates for {}' .format(file_name))
+    # if the --out-of-core flag is used, the sequence is never stored as a whole
+    elif store_dir:
+        # checks if the input is in FASTA format
+        checks_input(genome_input)
+        # path of the disk-backed array which will contain the coordinates
+        store_path=f'{store_dir}/{file_name}_coord.npy'
+        # an old array is removed rather than overwritten, since it can be linked from the cache (see stores_cache)
+        if os.path.exists(store_path):
+            os.remove(store_path)
+        # streams the genome and writes the coordinates to disk, chunk by chunk; the total count of each base is returned too
+        with measures_stage('coord_store', file_name) as record:
+            coord, totals=writes_coord_store(genome_input, tr_matrix, store_path, start_line=2, workers=workers)
+            record['bases']=len(coord)
+    # otherwise the whole sequence is read in memory
+    else:
+        # checks if the input is in FASTA format
+        checks_input(genome_input)
+        # extracts the sequence and the genome filename and saves them in a list
+        with measures_stage('read', file_name) as record:
+            params=reads_genome(genome_input)
+            record['bases']=len(params[0])
+        # assigns the first element of the list (the whole genome sequence) to seq; the filename was already extracted
+        seq=params[0]
+        # calculates the X, Y and Z coordinates for all positions of the sequence at once, split
+        # across the worker processes if --workers is used; the total count of each base is taken from the
+        # cumulative counts, so the GC content does not need another pass over the sequence
+        with measures_stage('coord', file_name) as record:
+            coord, totals = calculates_coord_parallel(seq, tr_matrix, workers)
+            record['bases']=len(seq)
+    # compressed files count their records while they are read (see DecompressedFile), the other inputs do not
+    if meta is None:
+        headers=getattr(genome_input, 'headers', None)
+    # compressed files cannot be indexed, so a file with several records gives one curve, unlike the same file uncompressed
+    if headers and headers > 1:
+        print('{} has {} records; all its records are read as one sequence, since compressed files cannot be indexed (decompress it to plot each record on its own)'
+              .format(file_name, headers))
+    # the new coordinates and base counts are saved in the cache, for the next runs
+    if key and meta is None:
+        with measures_stage('cache_store', file_name) as record:
+            stores_cache(cache_dir, key, coord, totals, store_path if store_dir else None, cache_max_bytes, headers)
+            record['bases']=len(coord)
+    # exports and decimates the coordinates and writes the sliding-window profile, then the plots are drawn
+    renders(prepares_plot(coord, seq, genome_input, file_name, out_path, max_points, decimation, window, window_step, window_format,
+                          export=export))
+    # returns the filename and the base counts, from which the GC content is written by the main loop
+    return(file_name, totals)
+
+
+''' PREPARES_PLOT
+
+    Parameters
+    ----------
+    coord : numpy.array
+        X, Y and Z coordinates of all positions of the sequence, in memory or disk-backed
+
+    seq: string or bytes
+        whole sequence, or None if it is not in memory (the file is then read again for the sliding windows)
+
+    genome_input : file
+        input genome file, opened in binary mode
+
+    file_name: string
+        name used for the title and the output files
+
+    out_path, max_points, decimation, window, window_step, window_format, export:
+        as in processes_genome
+
+    offset: int
+        number of bases of the record before the first position of coord, for the positions of a region
+
+    prefix: numpy.array
+        count of each base of the record before the first position of coord (for a region), or None
+
+    Returns
+    -------
+    plot: dict
+        everything R needs to draw the plots of the genome: title, output name without extension, decimated coordinates,
+        their positions in the sequence, and sliding-window profile (or None)
+
+'''
+
+def prepares_plot(coord, seq, genome_input, file_name, out_path, max_points, decimation, window=None, window_step=None,
+                  window_format='tsv', offset=0, export=None, prefix=None):
+    # number of bases of the genome, one point each
+    n_bases=len(coord)
+    # the sequence is used directly if it is in memory; otherwise, the file is read again in chunks
+    def reads_chunks():
+        if seq is None:
+            genome_input.seek(0)
+            checks_input(genome_input)
+            return(iter_seq_chunks(genome_input, start_line=2))
+        return([seq])
+    # if the --export flag is used, all the coordinates are written before they are decimated
+    if export:
+        with measures_stage('export', file_name) as record:
+            export_files=writes_export(coord, f'{out_path}/{file_name}', export['dtype'], reads_chunks() if export['counts'] else None,
+                                       prefix, first_position=offset + 1)
+            record['bases']=n_bases
+        # message for the user
+        print('Coordinates of {} exported to {}' .format(file_name, ', '.join(export_files)))
+    # keeps at most max_points points, since R does not need millions of points to draw a plot
+    with measures_stage('decimate', file_name) as record:
+        coord, step=decimates_coord(coord, max_points, decimation)
+        record['bases']=n_bases
+    # the positions of a region start from its first base in the record
+    step=step + offset
+    # combines the output plot name, used for all plots of the genome
+    plot={'title': file_name, 'out_name': f'{out_path}/{file_name}', 'coord': coord, 'step': step, 'windows': None}
+    # if the --window flag is used
+    if window:
+        # calculates the GC content and the GC skew in each window
+        with measures_stage('windows', file_name) as record:
+            windows=calculates_windows(reads_chunks(), window, window_step or window)
+            record['bases']=n_bases
+        # the windows of a region are numbered from its first base in the record
+        windows['start']+=offset
+        windows['end']+=offset
+        # the profile is written now; only its plot is left to R
+        windows_file=writes_windows(windows, plot['out_name'] + '_windows', window_format)
+        # message for the user
+        print('Sliding-window profile for {} written to {}' .format(file_name, windows_file))
+        plot['windows']=windows
+    return(plot)
+
+
+''' RENDERS_PLOT
+
+    Parameters
+    ----------
+    plot : dict
+        plot of one genome, as returned by prepares_plot
+
+    out_format: list
+        list of all formats in which to save the plots
+
+    plot_ws: bool
+        if True, the W/S plot(s) are generated too
+
+    window_plot: bool
+        if True, the sliding-window profile is plotted too
+
+    format_jobs: int
+        number of formats of each plot saved at the same time, 1 for one after the other, 0 for one per format
+
+'''
+
+def renders_plot(plot, out_format, plot_ws, window_plot, format_jobs=1):
+    file_name=plot['title']
+    # message for the user
+    print('Plotting the Z-curve{} for {}...' .format(' and the W/S plot' if plot_ws else '', file_name))
+    # draws the plot(s) with the backend of this process (R or matplotlib), set up by render.initializes_renderer;
+    # each plot is drawn once, and all formats are saved at the same time; the time of each format is printed
+    render.draws_plots(plot['coord'], plot['step'], plot['out_name'], plot['out_name'] + '_WS' if plot_ws else None, out_format, file_name,
+                              plot['windows'] if window_plot else None, plot['out_name'] + '_windows', format_jobs)
+
+
+''' SUBMITS_PLOT
+
+    Parameters
+    ----------
+    plot : dict
+        plot of one genome, as returned by prepares_plot
+
+    render_pool: concurrent.futures.ProcessPoolExecutor
+        process which draws the plots with its own backend (render.py)
+
+    pending: collections.deque
+        plots sent to render_pool and not finished yet, oldest first
+
+    depth: int
+        maximum number of plots waiting in render_pool; when there are more, waits for the oldest one
+
+    out_format, plot_ws, window_plot, format_jobs:
+        as in renders_plot
+
+'''
+
+def submits_plot(plot, render_pool, pending, depth, out_format, plot_ws, window_plot, format_jobs=1):
+    file_name=plot['title']
+    # message for the user
+    print('Plotting the Z-curve{} for {}...' .format(' and the W/S plot' if plot_ws else '', file_name))
+    # the arrays are sent as bytes, as in the web interface
+    pending.append(render_pool.submit(render.renders_plots,
+                                      np.ascontiguousarray(plot['coord'], dtype=np.float64).tobytes(),
+                                      np.ascontiguousarray(plot['step'], dtype=np.int64).tobytes(),
+                                      plot['out_name'], plot['out_name'] + '_WS' if plot_ws else None, out_format, file_name,
+                                      plot['windows'] if window_plot else None, plot['out_name'] + '_windows', format_jobs))
+    # the next genome is calculated while R draws this one, but at most depth plots can wait, which caps the memory
+    # used; any error of R is raised here
+    while len(pending) > depth:
+        pending.popleft().result()
+
+
+''' PROCESSES_REGIONS
+
+    Parameters
+    ----------
+    genome_input : file
+        input genome file, opened in binary mode
+
+    regions: list
+        regions as name:start-end, with 1-based and inclusive positions
+
+    tr_matrix, renders, out_path, max_points, decimation, window, window_step, window_format, export:
+        as in processes_genome
+
+    store_dir, workers, use_cache, cache_dir, cache_max_bytes, cache_hash:
+        not used, since only the bases of the regions are read, and their coordinates are calculated in memory
+
+    Returns
+    -------
+    results: list
+        name (<filename>_<record>_<start>-<end>) and total count of each base, for each region
+
+'''
+
+def processes_regions(genome_input, regions, tr_matrix, renders, out_path, max_points, decimation, store_dir=None, workers=1,
+                      use_cache=True, cache_dir=None, window=None, window_step=None, window_format='tsv', export=None,
+                      cache_max_bytes=None, cache_hash=False):
+    # the regions are found with the index, so the file must be seekable
+    if not genome_input.seekable():
+        raise InvalidInput('--region cannot be used with the standard input')
+    file_name=genome_input.name.split('/')[-1].split('.')[0]
+    index=loads_index(genome_input.name)
+    numbers={entry[0]: number for number, entry in enumerate(index)}
+    results=[]
+    with open(genome_input.name, 'rb') as genome, mmap.mmap(genome.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for region in regions:
+            name, start, end=parses_region(region)
+            if name not in numbers:
+                raise InvalidInput('The record {} of the region {} is not in the file {}' .format(name, region, genome_input.name))
+            entry=index[numbers[name]]
+            # as in samtools faidx, a region which goes past the end of the record stops at its end
+            end=entry[1] if end is None else min(end, entry[1])
+            if start >= end:
+                raise InvalidInput('The region {} starts after the end of the record {} ({} bases)' .format(region, name, entry[1]))
+            # cumulative counts of the record every Mb, saved next to the genome the first time
+            checkpoints=loads_checkpoints(genome_input.name, mm, index, numbers[name])
+            region_name=names_record(file_name, '{}_{}-{}' .format(name, start + 1, end))
+            # the coordinates are those of the whole record, but only the bases of the region are read
+            with measures_stage('region', region_name) as record:
+                coord, totals, seq=calculates_region(mm, entry, start, end, tr_matrix, checkpoints)
+                record['bases']=end - start
+            # the exported counts of a region continue those of the record before it
+            prefix=counts_prefix(mm, entry, start, checkpoints) if export and export['counts'] else None
+            renders(prepares_plot(coord, seq, genome_input, region_name, out_path, max_points, decimation, window, window_step,
+                                  window_format, offset=start, export=export, prefix=prefix))
+            results.append((region_name, totals))
+    return(results)
+
+
+''' HASHES_GENOME
+
+    Parameters
+    ----------
+    genome_input : file
+        input genome file, opened in binary mode
+
+    content_hash: bool
+        if True, the key is calculated from the content of the genome, read once more; otherwise, from the path, size,
+        modification time and inode of the file, without reading it
+
+    Returns
+    -------
+    key: string
+        key of the genome in the cache, or None if the file cannot be read twice (e.g. standard input)
+
+'''
+
+def hashes_genome(genome_input, content_hash=False):
+    # streams which cannot be rewound (e.g. standard input) are not cached, since they can be read only once
+    if not genome_input.seekable():
+        return(None)
+    try:
+        # a record of a multi-record file (index.RecordFile) has the path and the modification time of the whole file
+        stat = os.stat(genome_input.name)
+        if content_hash:
+            sha = hashlib.sha256()
+            # reads the file in large chunks, then goes back to its start, so it can be read again
+            for block in iter(lambda: genome_input.read(CHUNK_SIZE), b''):
+                sha.update(block)
+            genome_input.seek(0)
+            # the same content has the same key, wherever the file is
+            return(cache.hashes_entry(sha.digest(), {'version': 3}))
+    # files without a modification time are not cached either
+    except (OSError, ValueError):
+        return(None)
+    # otherwise, the file is identified by its metadata, which changes when it is edited, and each record by its place
+    # in the file; the version marks the format of the cached files, so it can be changed later
+    return(cache.hashes_entry(b'', {'path': os.path.realpath(genome_input.name), 'size': stat.st_size,
+                                    'mtime_ns': stat.st_mtime_ns, 'inode': stat.st_ino, 'device': stat.st_dev,
+                                    'record': [getattr(genome_input, 'start', None), getattr(genome_input, 'end', None)],
+                                    'version': 3}))
+
+
+''' STORES_CACHE
+
+    Parameters
+    ----------
+    cache_dir : string
+        folder of the cache
+
+    key: string
+        key of the genome, as returned by hashes_genome
+
+    coord: numpy.array
+        X, Y and Z coordinates of all positions of the sequence
+
+    totals: numpy.array
+        total count of each base
+
+    store_path: string
+        disk-backed array containing coord (--out-of-core), or None if coord is in memory
+
+    max_bytes: int
+        maximum size of the cache, in bytes, or None for no limit
+
+    headers: int
+        number of records of a compressed file, or None for the other inputs
+
+'''
+
+def stores_cache(cache_dir, key, coord, totals, store_path, max_bytes=None, headers=None):
+    # a genome whose coordinates do not fit in the cache is not saved, since it would remove all the others
+    if max_bytes is not None and coord.nbytes > max_bytes:
+        print('The coordinates of {:,} bases do not fit in the cache ({:,} bytes at most), and are not saved' .format(len(coord), max_bytes))
+        return
+    # the files are written in a temporary folder, which becomes the cached result once complete
+    tmp_path = cache.creates_tmp_entry(cache_dir)
+    coord_path = os.path.join(tmp_path, 'coord.npy')
+    # the disk-backed array is linked, so it is stored only once on disk; it is copied (without loading it in memory)
+    # only if the cache is on another file system
+    if store_path:
+        try:
+            os.link(store_path, coord_path)
+        except OSError:
+            shutil.copyfile(store_path, coord_path)
+    # otherwise, the coordinates are saved as .npy, so they can be memory-mapped when they are read back
+    else:
+        np.save(coord_path, coord)
+    cache.commits_entry(cache_dir, key, tmp_path, {'totals': totals.tolist(), 'headers': headers}, None)
+    # the least recently used genomes are removed, until the cache is below its maximum size
+    if max_bytes is not None:
+        cache.evicts_entries(cache_dir, max_bytes)
+
+
+''' PROCESSES_FILE
+
+    Parameters
+    ----------
+    genome_input : file
+        input genome file, opened in binary mode
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    renders: function
+        draws the plots of one genome, as in processes_genome
+
+    records: list
+        names of the records to be processed, or None to process all of them
+
+    regions: list
+        regions as name:start-end, or None to process the whole records
+
+    decompress_threads: int
+        number of threads decompressing the bgzip files
+
+    options:
+        the other parameters of processes_genome
+
+    Returns
+    -------
+    results: list
+        filename (or <filename>_<record>) and total count of each base, for each processed record
+
+'''
+
+def processes_file(genome_input, tr_matrix, renders, records=None, regions=None, decompress_threads=DECOMPRESS_THREADS, **options):
+    # compressed files are decompressed while they are read, without a temporary file
+    genome_stream=opens_genome(genome_input, decompress_threads)
+    # with --region, only the bases of the regions are read
+    if regions:
+        if genome_stream is not genome_input:
+            raise InvalidInput('--region cannot be used with compressed files, which cannot be indexed')
+        return(processes_regions(genome_input, regions, tr_matrix, renders, **options))
+    # the standard input and the compressed files cannot be indexed, so all their records are read as one sequence
+    if genome_stream is not genome_input or not genome_input.seekable():
+        if records:
+            raise InvalidInput('--records cannot be used with the standard input or with compressed files')
+        return([processes_genome(genome_stream, tr_matrix, renders, **options)])
+    # finds the records of the file; the index is saved next to the file, so it is built only once
+    try:
+        index=loads_index(genome_input.name)
+    # files which cannot be indexed (e.g. lines of different lengths) are still read as one sequence, as before
+    except InvalidInput as error:
+        if records:
+            raise
+        print('{}; all its records are read as one sequence' .format(error))
+        index=[None]
+    # a file with only one record is processed as a whole, with the filename as title
+    if len(index) == 1 and not records:
+        return([processes_genome(genome_input, tr_matrix, renders, **options)])
+    file_name=genome_input.name.split('/')[-1].split('.')[0]
+    # each record is read from the memory-mapped file, starting from its own header
+    mm, record_files=opens_records(genome_input.name, index, records)
+    results=[]
+    try:
+        for record_file, entry in zip(record_files, [entry for entry in index if records is None or entry[0] in records]):
+            # the records without sequence cannot be plotted
+            if entry[1] == 0:
+                print('The record {} of {} has no sequence, and is skipped' .format(entry[0], file_name))
+                continue
+            results.append(processes_genome(record_file, tr_matrix, renders, file_name=names_record(file_name, entry[0]), **options))
+    finally:
+        mm.close()
+    return(results)
+
+
+''' NAMES_RECORD
+
+    Parameters
+    ----------
+    file_name : string
+        filename without extensions
+
+    record: string
+        name of the record
+
+    Returns
+    -------
+    record_name: string
+        <filename>_<record>, where the characters of the record which cannot be used in a filename are replaced by _
+
+'''
+
+def names_record(file_name, record):
+    safe_record=''.join(char if char.isalnum() or char in '._-' else '_' for char in record)
+    return('{}_{}' .format(file_name, safe_record))
+
+
+''' WRITES_GC
+
+    Parameters
+    ----------
+    file_name : string
+        filename without extensions
+
+    totals: numpy.array
+        total count of each base, as returned by processes_genome
+
+    fileOut: file
+        output GC file if the -gc flag is used, otherwise None
+
+    composition: bool
+        if True, the count of each base and the GC and AT skews are written after the GC content
+
+'''
+
+def writes_gc(file_name, totals, fileOut, composition=False):
+    # the GC content, from the counts of the bases
+    line = '{}: {:.2f}%' .format(file_name, GC_counts(totals))
+    # if the --composition flag is used, adds the count of each base and the skews
+    if composition:
+        comp = counts_composition(totals)
+        line += ' (A: {A}, C: {C}, G: {G}, T: {T}, N: {N}, GC skew: {GC_skew:.4f}, AT skew: {AT_skew:.4f})' .format(**comp)
+    # if the -gc flag is used
+    if fileOut:
+        # prints the filename and the GC content to the out_gc file
+        fileOut.write(line + '\n')
+    # if not, prints to the terminal
+    else:
+        # prints the filename and the GC content to the console
+        print(line)
+
+
+#%% BATCH MODE
+
+# each batch worker sets up its own backend once (render.initializes_renderer), so that R is never shared
+# between processes or threads
+
+''' PROCESSES_BATCH
+
+    Parameters
+    ----------
+    genome_path : string
+        path to the input genome file
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    options: dict
+        the other parameters of processes_file (records, regions, decompress_threads) and processes_genome (out_path, store_dir,
+        workers, max_points, decimation, use_cache, cache_dir, window, window_step, window_format)
+
+    render_options: dict
+        the parameters of renders_plot (out_format, plot_ws, window_plot, format_jobs), or None with --no-plot
+
+    Returns
+    -------
+    status: dict
+        genome path, list of the names and base counts of its records, 'ok' or 'failed', error message and time in seconds
+
+'''
+
+def processes_batch(genome_path, tr_matrix, options, render_options):
+    start = time.perf_counter()
+    status = {'genome': genome_path, 'results': [], 'status': 'ok', 'error': ''}
+    # any error is reported in the status, so one failing genome does not stop the others
+    try:
+        with open(genome_path, 'rb') as genome_input:
+            # each batch worker draws its own plots, with its own backend
+            renders = functools.partial(renders_plot, **render_options) if render_options is not None else skips_plot
+            status['results'] = processes_file(genome_input, tr_matrix, renders, **options)
+    except Exception as error:
+        status['status'] = 'failed'
+        status['error'] = '{}: {}' .format(type(error).__name__, error)
+    status['time'] = time.perf_counter() - start
+    return(status)
+
+
+''' SKIPS_PLOT
+
+    Parameters
+    ----------
+    plot : dict
+        plot of one genome, as returned by prepares_plot
+
+'''
+
+# with --no-plot, only the GC content (and the sliding-window profile) are written, and no backend is set up
+def skips_plot(plot):
+    return
+
+
+''' RENDERS_PLOT_WITH
+
+    Parameters
+    ----------
+    out_format: list or string
+        format(s) in which to save the plots
+
+    plot_ws, window_plot, format_jobs:
+        as in renders_plot
+
+    Returns
+    -------
+    renders: function
+        renders_plot with these options, to be given to processes_file
+
+'''
+
+def renders_plot_with(out_format, plot_ws=False, window_plot=False, format_jobs=1):
+    out_format = [out_format] if isinstance(out_format, str) else out_format
+    return(functools.partial(renders_plot, out_format=out_format, plot_ws=plot_ws, window_plot=window_plot, format_jobs=format_jobs))
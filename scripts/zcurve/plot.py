@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/plot.py
+
+- General description:
+This module draws the Z-curve, W/S and sliding-window plots with matplotlib, as an alternative to the R functions of
+Zcurve_func.R and WS_func.R (--backend matplotlib). The plots are drawn straight from the numpy arrays, without
+starting R and without converting the coordinates to a dataframe, so it also works on computers without R or without
+access to CRAN. The plots look like the R ones: the same titles, axes, colour scales and sizes.
+
+- Procedure:
+1. matplotlib is set to the Agg backend, which draws in memory and does not need a display
+2. each plot is drawn once in a matplotlib figure: the Z-curve as a 3D line coloured by the position in the sequence
+(as lines3D of plot3D), the W/S disparity as a line coloured by its value (as geom_line of ggplot2), and the sliding-window
+profile as three panels sharing the x-axis
+3. the raster formats (png, jpeg, tiff, bmp) are all encoded from one Agg image of the figure, in parallel threads
+(Pillow releases the GIL while it compresses); the vector formats (pdf, svg, eps) are drawn again by their own
+matplotlib backend, one after the other
+4. the time taken by each format is returned, as for the R functions
+
+- List of user-defined functions:
+1. plots_zcurve: draws the 3D Z-curve and saves it in all formats
+2. plots_ws: draws the W/S disparity along the sequence and saves it in all formats
+3. plots_windows: draws the GC content, GC skew and cumulative GC skew of the sliding windows and saves it in all formats
+4. saves_formats: saves a figure in all formats, drawing the raster image only once
+5. encodes_raster: worker function, saves the raster image in one format
+
+- List of imported modules:
+1. time: to measure the time taken by each format
+2. concurrent.futures: to encode the raster formats in parallel threads
+3. numpy: to build the segments of the lines
+4. matplotlib and mpl_toolkits.mplot3d: to draw the plots
+5. PIL (Pillow, installed with matplotlib): to encode the raster image in each format
+
+- Possible errors addressed in the module:
+1. ValueError: if a format cannot be saved by matplotlib or Pillow
+
+"""
+#%% IMPORT MODULES
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import matplotlib
+# draws in memory, without a display; set before pyplot is imported
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LinearSegmentedColormap, Normalize
+from mpl_toolkits.mplot3d.art3d import Line3DCollection
+from PIL import Image
+
+# formats encoded from the raster image, with the name used by Pillow
+RASTER_FORMATS = {'png': 'PNG', 'jpeg': 'JPEG', 'jpg': 'JPEG', 'tiff': 'TIFF', 'tif': 'TIFF', 'bmp': 'BMP'}
+
+# default continuous colour scale of ggplot2, used by plotWS
+GGPLOT_GRADIENT = LinearSegmentedColormap.from_list('ggplot_gradient', ['#132B43', '#56B1F7'])
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''PLOTS_ZCURVE
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns
+
+    step: numpy.array
+        position of each point in the sequence, starting from 1, used for the colour scale
+
+    out_name: string
+        full path of the plot, without the extension
+
+    out_format: list
+        list of all formats in which to save the plot
+
+    plot_title: string
+        main title of the plot
+
+    jobs: int
+        number of raster formats encoded at the same time, 0 for one thread per format
+
+    Returns
+    -------
+    timings: dict
+        time taken to save each format in seconds
+
+'''
+
+def plots_zcurve(coord, step, out_name, out_format, plot_title, jobs=0):
+    # 700x350 pixels, as the raster plots of plotZcurve
+    figure = plt.figure(figsize=(7, 3.5), dpi=100)
+    axes = figure.add_subplot(projection='3d')
+    # one segment between each pair of consecutive points, coloured by the position in the sequence (jet, as lines3D)
+    line = Line3DCollection(np.stack([coord[:-1], coord[1:]], axis=1), cmap='jet',
+                            norm=Normalize(step[0], step[-1]), linewidths=0.8)
+    line.set_array(step[1:])
+    axes.add_collection3d(line)
+    # a collection does not change the limits of the axes, so they are set from the coordinates
+    for set_lim, values in zip([axes.set_xlim, axes.set_ylim, axes.set_zlim], coord.T):
+        set_lim(values.min(), values.max())
+    # same point of view and axes titles as the R plot, see README for more details
+    axes.view_init(elev=40, azim=-50)
+    axes.set_xlabel('R/Y disparity')
+    axes.set_ylabel('M/K disparity')
+    axes.set_zlabel('W/S disparity')
+    axes.set_title(plot_title)
+    figure.colorbar(line, ax=axes, label='Sequence length', shrink=0.7, pad=0.15)
+    timings = saves_formats(figure, out_name, out_format, 100, jobs)
+    plt.close(figure)
+    return(timings)
+
+
+'''PLOTS_WS
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns; only Z is plotted
+
+    step: numpy.array
+        position of each point in the sequence, starting from 1, used for the x-axis
+
+    out_name, out_format, plot_title, jobs:
+        as in plots_zcurve
+
+    Returns
+    -------
+    timings: dict
+        time taken to save each format in seconds
+
+'''
+
+def plots_ws(coord, step, out_name, out_format, plot_title, jobs=0):
+    # 7x7 inches at 300 dpi, as ggsave in plotWS
+    figure, axes = plt.subplots(figsize=(7, 7), dpi=300)
+    # line coloured by the W/S disparity, with the default colour scale of ggplot2
+    points = np.column_stack([step, coord[:, 2]])
+    line = LineCollection(np.stack([points[:-1], points[1:]], axis=1), cmap=GGPLOT_GRADIENT,
+                          norm=Normalize(coord[:, 2].min(), coord[:, 2].max()))
+    line.set_array(coord[1:, 2])
+    axes.add_collection(line)
+    axes.autoscale_view()
+    # labels for x and y axes, legend and main plot title
+    axes.set_xlabel('Sequence length', fontsize=12, fontweight='bold')
+    axes.set_ylabel('W/S disparity', fontsize=12, fontweight='bold')
+    axes.set_title(plot_title, loc='left')
+    figure.colorbar(line, ax=axes, label='W/S values')
+    # empty background, with the axis lines only
+    axes.spines[['top', 'right']].set_visible(False)
+    timings = saves_formats(figure, out_name, out_format, 300, jobs)
+    plt.close(figure)
+    return(timings)
+
+
+'''PLOTS_WINDOWS
+
+    Parameters
+    ----------
+    windows: dict
+        sliding-window profile, as returned by calculates_windows (core.py)
+
+    out_name, out_format, plot_title, jobs:
+        as in plots_zcurve
+
+    Returns
+    -------
+    timings: dict
+        time taken to save each format in seconds
+
+'''
+
+def plots_windows(windows, out_name, out_format, plot_title, jobs=0):
+    # centre of each window -> used for x-axis
+    position = (windows['start'] + windows['end']) / 2
+    # 7x7 inches at 300 dpi, as ggsave in plotWindows; one panel per profile, each with its own y-axis
+    figure, panels = plt.subplots(3, 1, sharex=True, figsize=(7, 7), dpi=300)
+    for axes, column, measure in zip(panels, ['gc', 'gc_skew', 'cum_gc_skew'], ['GC content (%)', 'GC skew', 'Cumulative GC skew']):
+        axes.plot(position, windows[column], color='steelblue')
+        axes.set_title(measure, fontsize=12, fontweight='bold')
+        axes.spines[['top', 'right']].set_visible(False)
+    panels[-1].set_xlabel('Sequence length', fontsize=12, fontweight='bold')
+    figure.suptitle(plot_title, x=0.02, ha='left')
+    figure.tight_layout()
+    timings = saves_formats(figure, out_name, out_format, 300, jobs)
+    plt.close(figure)
+    return(timings)
+
+
+'''SAVES_FORMATS
+
+    Parameters
+    ----------
+    figure: matplotlib.figure.Figure
+        figure to be saved
+
+    out_name: string
+        full path of the plot, without the extension
+
+    out_format: list
+        list of all formats in which to save the plot
+
+    dpi: int
+        resolution of the raster formats
+
+    jobs: int
+        number of raster formats encoded at the same time, 0 for one thread per format
+
+    Returns
+    -------
+    timings: dict
+        time taken to save each format in seconds, in the order of out_format; the first raster format includes the
+        time taken to draw the raster image
+
+'''
+
+def saves_formats(figure, out_name, out_format, dpi, jobs=0):
+    timings = {}
+    raster_formats = [file_format for file_format in out_format if file_format.lower() in RASTER_FORMATS]
+    if raster_formats:
+        # the figure is drawn once in the Agg canvas, and the same image is encoded in each raster format
+        start = time.perf_counter()
+        figure.set_dpi(dpi)
+        figure.canvas.draw()
+        # copied, since the vector formats drawn meanwhile may reuse the buffer of the canvas
+        image = Image.frombuffer('RGBA', figure.canvas.get_width_height(), figure.canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1).copy()
+        draw_time = time.perf_counter() - start
+        with ThreadPoolExecutor(jobs or len(raster_formats)) as pool:
+            encoded = pool.map(encodes_raster, [image]*len(raster_formats), [out_name]*len(raster_formats), raster_formats, [dpi]*len(raster_formats))
+            # the vector formats are drawn in this thread meanwhile, since a figure cannot be drawn by two threads at once
+            for file_format in out_format:
+                if file_format not in raster_formats:
+                    start = time.perf_counter()
+                    figure.savefig('{}.{}' .format(out_name, file_format), format=file_format)
+                    timings[file_format] = time.perf_counter() - start
+            raster_timings = dict(zip(raster_formats, encoded))
+        raster_timings[raster_formats[0]] += draw_time
+        timings.update(raster_timings)
+    else:
+        for file_format in out_format:
+            start = time.perf_counter()
+            figure.savefig('{}.{}' .format(out_name, file_format), format=file_format)
+            timings[file_format] = time.perf_counter() - start
+    # same order as the formats given by the user
+    return({file_format: timings[file_format] for file_format in out_format})
+
+
+'''ENCODES_RASTER
+
+    Parameters
+    ----------
+    image: PIL.Image
+        raster image of the figure, in RGBA
+
+    out_name: string
+        full path of the plot, without the extension
+
+    file_format: string
+        one of RASTER_FORMATS
+
+    dpi: int
+        resolution written in the file
+
+    Returns
+    -------
+    seconds: float
+        time taken to encode and write the file
+
+'''
+
+def encodes_raster(image, out_name, file_format, dpi):
+    start = time.perf_counter()
+    pil_format = RASTER_FORMATS[file_format.lower()]
+    # each thread saves its own copy, since Pillow keeps the options of the format being saved in the image itself;
+    # JPEG and BMP have no transparency, so the image is flattened on the white background of the figure
+    image = image.convert('RGB') if pil_format in ['JPEG', 'BMP'] else image.copy()
+    image.save('{}.{}' .format(out_name, file_format), format=pil_format, dpi=(dpi, dpi))
+    return(time.perf_counter() - start)
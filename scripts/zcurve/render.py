@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: zcurve/render.py
+
+- General description:
+This module draws the Z-curve, W/S and sliding-window plots, with one of RENDER_BACKENDS: 'r', the R functions plotZcurve
+(Zcurve_func.R), plotWS and plotWindows (WS_func.R), or 'matplotlib', the same plots drawn with matplotlib (plot.py),
+which does not need R. It is used by plotZcurve.py (in its own process, in the batch workers or in the R process of the
+rendering pipeline) and by the render workers of the web interface: each process sets up its backend once, and then
+receives the coordinates as numpy arrays, or as compact binary arrays (bytes) when they are sent to another process;
+for R, they are converted to an R dataframe without pandas.
+
+- Procedure:
+1. initializes_renderer is run once in each process: for R, it imports rpy2, checks the R packages and
+creates the STAP modules from the R scripts (each with formats_func.R, shared by both); for matplotlib, it only imports plot.py, so R is never started
+2. renders_plots rebuilds the numpy arrays from the bytes received, and gives them to draws_plots
+3. draws_plots calls the functions of the backend: for R, the arrays are converted to an R dataframe first, and the
+sliding-window profile, if any, column by column too. Each plot is drawn once and all the formats are saved at the
+same time, and the time of each format is printed with reports_timings
+
+- List of user-defined functions:
+1. initializes_renderer: sets up the backend (R and the R functions, or matplotlib) in the current process
+2. converts_coord: converts the numpy arrays to an R dataframe, column by column
+3. renders_plots: draws the Z-curve plot and optionally the W/S and sliding-window plots from the binary arrays
+4. warms_renderer: waits until all workers run it, so that each worker is started and sets up R, then returns its process id
+5. converts_windows: converts the sliding-window profile to an R dataframe, column by column
+6. reports_timings: prints the time taken to save each format of a plot
+7. draws_plots: draws the Z-curve plot and optionally the W/S and sliding-window plots from the numpy arrays, with the
+backend of the process
+
+- List of imported modules:
+1. os: to build the paths to the R scripts and to get the process id
+2. numpy: to rebuild the arrays from the bytes received
+3. rpy2 and plot.py (matplotlib): imported only inside the functions, so that importing this module does not
+start R or load matplotlib
+4. metrics: to measure the conversion and each plot with --profile
+
+- Possible errors addressed in the module:
+1. ValueError: if the backend is not one of RENDER_BACKENDS
+
+"""
+#%% IMPORT MODULES
+
+import os
+import numpy as np
+
+# backends which can draw the plots, shared with the command line options
+from .defaults import RENDER_BACKENDS
+# time, CPU and memory of each stage, with --profile
+from .metrics import measures_stage
+
+# backend of this process and its functions (the R modules, or the plot module), set up by initializes_renderer
+render_state = {'backend': None, 'Zcurve': None, 'WSplot': None, 'plots': None}
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''INITIALIZES_RENDERER
+
+    Parameters
+    ----------
+    script_path: string
+        path to the folder containing the R scripts
+
+    backend: string
+        one of RENDER_BACKENDS
+
+'''
+
+def initializes_renderer(script_path, backend='r'):
+    if backend == 'matplotlib':
+        # matplotlib is imported here, so the processes using R do not load it
+        from . import plot
+        render_state['plots'] = plot
+        render_state['backend'] = backend
+        return
+    if backend != 'r':
+        raise ValueError('Unknown backend {}, please choose one of {}' .format(backend, RENDER_BACKENDS))
+    # rpy2 is imported here, so R is started only in the processes which draw the plots with R
+    import rpy2.robjects.packages as rpackages
+    from rpy2.robjects.vectors import StrVector
+    from rpy2.robjects.packages import STAP
+    # defines a list of packages needed for the R functions to run
+    packageNames = ['plot3D', 'ggplot2']
+    # imports a R package which is used to check if the packages in packageNames are installed
+    utils = rpackages.importr('utils')
+    # checks if the libraries are installed, and installs the missing ones; CRAN is contacted only in that case,
+    # so computers without internet access can use R once the packages are installed
+    packnames_to_install = [x for x in packageNames if not rpackages.isinstalled(x)]
+    if len(packnames_to_install) > 0:
+        # defines which CRAN mirror to check, commonly is 1
+        utils.chooseCRANmirror(ind=1)
+        utils.install_packages(StrVector(packnames_to_install))
+    # imports the libraries from R
+    for package in packageNames:
+        rpackages.importr(package)
+    # runsFormats, which saves the formats of a plot at the same time, is shared by both R scripts
+    with open(os.path.join(script_path, 'formats_func.R'), 'r') as R_func:
+        formats_func = R_func.read()
+    # creates the two custom modules from the R scripts, each with its own copy of runsFormats
+    for script_name, module_name in [('Zcurve_func.R', 'Zcurve'), ('WS_func.R', 'WSplot')]:
+        with open(os.path.join(script_path, script_name), 'r') as R_func:
+            render_state[module_name] = STAP(formats_func + '\n' + R_func.read(), module_name)
+    render_state['backend'] = backend
+
+
+'''CONVERTS_COORD
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns
+
+    step: numpy.array
+        position of each point in the sequence, starting from 1
+
+    Returns
+    -------
+    r_coord: R object
+        R dataframe with the columns X, Y, Z and step
+
+'''
+
+def converts_coord(coord, step):
+    import rpy2.robjects as robjects
+    # each column is copied directly into an R vector, without going through pandas
+    columns = {'X': robjects.FloatVector(coord[:, 0]),
+               'Y': robjects.FloatVector(coord[:, 1]),
+               'Z': robjects.FloatVector(coord[:, 2]),
+               # R integers stop at 2^31 - 1, so the positions are doubles, which are exact up to 2^53
+               'step': robjects.FloatVector(np.asarray(step, dtype=np.float64))}
+    r_coord = robjects.DataFrame(columns)
+    return(r_coord)
+
+
+'''RENDERS_PLOTS
+
+    Parameters
+    ----------
+    coord_bytes: bytes
+        X, Y and Z coordinates, as float64 values in row order (numpy.ndarray.tobytes)
+
+    step_bytes: bytes
+        position of each point in the sequence, as int64 values
+
+    out_name, ws_out_name, out_format, plot_title, windows, windows_out_name, format_jobs:
+        as in draws_plots
+
+    Returns
+    -------
+    pid: int
+        id of the process which drew the plots
+
+'''
+
+def renders_plots(coord_bytes, step_bytes, out_name, ws_out_name, out_format, plot_title, windows=None, windows_out_name=None, format_jobs=1):
+    # rebuilds the arrays without copying the bytes
+    coord = np.frombuffer(coord_bytes, dtype=np.float64).reshape(-1, 3)
+    step = np.frombuffer(step_bytes, dtype=np.int64)
+    draws_plots(coord, step, out_name, ws_out_name, out_format, plot_title, windows, windows_out_name, format_jobs)
+    return(os.getpid())
+
+
+'''WARMS_RENDERER
+
+    Parameters
+    ----------
+    barrier: multiprocessing barrier (from a manager) or None
+        if given, the call waits until all workers reach it, so that each worker runs exactly one call
+
+    Returns
+    -------
+    pid: int
+        id of the process, once its R functions are set up
+
+'''
+
+def warms_renderer(barrier=None):
+    if barrier is not None:
+        # a worker which is already set up cannot take a second call, so the pool has to start all its workers
+        barrier.wait()
+    return(os.getpid())
+
+
+'''CONVERTS_WINDOWS
+
+    Parameters
+    ----------
+    windows: dict
+        sliding-window profile, as returned by calculates_windows
+
+    Returns
+    -------
+    r_windows: R object
+        R dataframe with one column for each array of the profile
+
+'''
+
+def converts_windows(windows):
+    import rpy2.robjects as robjects
+    # all columns are doubles: the positions are integers, but R integers stop at 2^31 - 1
+    columns = {column: robjects.FloatVector(np.asarray(values, dtype=np.float64)) for column, values in windows.items()}
+    r_windows = robjects.DataFrame(columns)
+    return(r_windows)
+
+
+'''REPORTS_TIMINGS
+
+    Parameters
+    ----------
+    plot_name: string
+        name of the plot, used in the message
+
+    plot_title: string
+        main title of the plot
+
+    timings: dict or R object
+        time taken to save each format in seconds, as a dictionary (matplotlib) or as a vector named after the formats
+        (R functions)
+
+'''
+
+def reports_timings(plot_name, plot_title, timings):
+    # the R functions return a named vector
+    if not isinstance(timings, dict):
+        timings = dict(zip(timings.names, timings))
+    # the formats were saved at the same time, so the slowest one is the time taken by the plot
+    print('Saved the {} of {}: {}' .format(plot_name, plot_title, ', '.join('{} {:.2f} s' .format(file_format, seconds)
+                                                                           for file_format, seconds in timings.items())), flush=True)
+
+
+'''DRAWS_PLOTS
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns
+
+    step: numpy.array
+        position of each point in the sequence, starting from 1
+
+    out_name: string
+        full path of the Z-curve plot, without the extension
+
+    ws_out_name: string
+        full path of the W/S plot, without the extension, or None to skip it
+
+    out_format: list
+        list of all formats in which to save the plots
+
+    plot_title: string
+        main title of the plots
+
+    windows: dict
+        sliding-window profile, as returned by calculates_windows (core.py), or None to skip its plot
+
+    windows_out_name: string
+        full path of the sliding-window plot, without the extension
+
+    format_jobs: int
+        number of formats saved at the same time (forked processes with R, threads for the raster formats with
+        matplotlib), 1 for one after the other, 0 for one per format
+
+'''
+
+def draws_plots(coord, step, out_name, ws_out_name, out_format, plot_title, windows=None, windows_out_name=None, format_jobs=1):
+    # with --profile, each plot is measured as a stage of the genome, with the number of points drawn
+    if render_state['backend'] == 'matplotlib':
+        # the plots are drawn from the numpy arrays, without any conversion
+        plots = render_state['plots']
+        with measures_stage('plot_zcurve', plot_title) as record:
+            reports_timings('Z-curve', plot_title, plots.plots_zcurve(coord, step, out_name, out_format, plot_title, format_jobs))
+            record['bases'] = len(coord)
+        if ws_out_name:
+            with measures_stage('plot_ws', plot_title) as record:
+                reports_timings('W/S plot', plot_title, plots.plots_ws(coord, step, ws_out_name, out_format, plot_title, format_jobs))
+                record['bases'] = len(coord)
+        if windows is not None:
+            with measures_stage('plot_windows', plot_title) as record:
+                reports_timings('sliding-window profile', plot_title, plots.plots_windows(windows, windows_out_name, out_format, plot_title, format_jobs))
+                record['bases'] = len(windows['start'])
+        return
+    # for R, the coordinates are converted once, and used by both plots
+    with measures_stage('convert', plot_title) as record:
+        r_coord = converts_coord(coord, step)
+        record['bases'] = len(coord)
+    with measures_stage('plot_zcurve', plot_title) as record:
+        reports_timings('Z-curve', plot_title, render_state['Zcurve'].plotZcurve(r_coord, out_name, out_format, plot_title, jobs=format_jobs))
+        record['bases'] = len(coord)
+    if ws_out_name:
+        with measures_stage('plot_ws', plot_title) as record:
+            reports_timings('W/S plot', plot_title, render_state['WSplot'].plotWS(r_coord, ws_out_name, out_format, plot_title, jobs=format_jobs))
+            record['bases'] = len(coord)
+    if windows is not None:
+        with measures_stage('plot_windows', plot_title) as record:
+            reports_timings('sliding-window profile', plot_title, render_state['WSplot'].plotWindows(converts_windows(windows), windows_out_name,
+                                                                                                      out_format, plot_title, jobs=format_jobs))
+            record['bases'] = len(windows['start'])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: tests/test_cache.py
+
+- General description:
+Tests of the cache of plotZcurve.py (scripts/zcurve/pipeline.py and scripts/zcurve/cache.py): the key of a file, with
+and without --cache-hash, and the size limit of the cache.
+
+- Usage:
+It is run from the parent directory of the repo, as:
+
+python -m pytest tests
+
+- List of imported modules:
+1. os, sys, time: to find the zcurve package and to edit the files
+2. numpy: to create the coordinates
+3. pytest: to run the tests, in a temporary folder (tmp_path)
+
+"""
+#%% IMPORT MODULES
+
+import os
+import sys
+import time
+import numpy as np
+
+# the zcurve package is found in the scripts folder of the repo, as in plotZcurve.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from zcurve import cache
+from zcurve.pipeline import hashes_genome, stores_cache
+
+
+#%% TESTS
+
+# the key changes when the file is edited, and with --cache-hash it follows the content, wherever the file is
+def test_key_follows_file(tmp_path):
+    genome = tmp_path / 'a.fna'
+    genome.write_bytes(b'>a\nACGT\n')
+    with open(genome, 'rb') as genome_input:
+        key, content_key = hashes_genome(genome_input), hashes_genome(genome_input, True)
+        # the content hash goes back to the start of the file
+        assert genome_input.tell() == 0
+    copy = tmp_path / 'b.fna'
+    copy.write_bytes(b'>a\nACGT\n')
+    with open(copy, 'rb') as genome_input:
+        assert hashes_genome(genome_input) != key
+        assert hashes_genome(genome_input, True) == content_key
+    time.sleep(0.01)
+    genome.write_bytes(b'>a\nACGA\n')
+    with open(genome, 'rb') as genome_input:
+        assert hashes_genome(genome_input) != key
+        assert hashes_genome(genome_input, True) != content_key
+
+
+# the oldest genomes are removed when the cache is full, and a genome larger than the cache is not saved
+def test_cache_size_limit(tmp_path):
+    coord = np.zeros((1000, 3))
+    totals = np.zeros(4, dtype=np.int64)
+    max_bytes = int(coord.nbytes * 2.5)
+    for key in ['first', 'second', 'third']:
+        stores_cache(str(tmp_path), key, coord, totals, None, max_bytes)
+        # the modification time of meta.json orders the genomes
+        time.sleep(0.01)
+    assert cache.loads_entry(str(tmp_path), 'first') is None
+    assert cache.loads_entry(str(tmp_path), 'third') is not None
+    stores_cache(str(tmp_path), 'large', np.zeros((10000, 3)), totals, None, max_bytes)
+    assert cache.loads_entry(str(tmp_path), 'large') is None
+
+
+# the disk-backed array of --out-of-core is linked into the cache, not copied
+def test_store_is_linked(tmp_path):
+    store_path = str(tmp_path / 'a_coord.npy')
+    coord = np.lib.format.open_memmap(store_path, mode='w+', dtype=np.float64, shape=(100, 3))
+    stores_cache(str(tmp_path), 'a', coord, np.zeros(4, dtype=np.int64), store_path)
+    assert os.path.samefile(store_path, os.path.join(cache.entry_path(str(tmp_path), 'a'), 'coord.npy'))
+
+
+# the temporary folders are removed only once they were left behind for longer than TMP_MAX_AGE
+def test_evicts_old_tmp_entries(tmp_path):
+    recent = cache.creates_tmp_entry(str(tmp_path))
+    old = cache.creates_tmp_entry(str(tmp_path))
+    age = time.time() - cache.TMP_MAX_AGE - 60
+    os.utime(old, (age, age))
+    cache.evicts_entries(str(tmp_path), 0)
+    assert os.path.isdir(recent) and not os.path.exists(old)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: tests/test_core.py
+
+- General description:
+Regression tests of the vectorized Z-curve calculations (scripts/zcurve/core.py): the coordinates are compared with
+those of the original per-base loop of plotZcurve.py v1.0.0, rebuilt here, on the zika genome of the samples and on
+a few edge cases (a sequence split across chunks and workers, lower and upper case input, a 1-base sequence, a file
+without sequence). The decimation is checked too: the number of points kept, and LTTB against one bucket at a time; and the sliding windows
+against the count of each window on its own.
+
+- Usage:
+It is run from the parent directory of the repo, as:
+
+python -m pytest tests
+
+- List of imported modules:
+1. os, sys, io: to find the zcurve package and the sample genome
+2. numpy: to compare the coordinates
+3. pytest: to run the tests, in a temporary folder (tmp_path) for the out-of-core store
+
+"""
+#%% IMPORT MODULES
+
+import os
+import sys
+import io
+import numpy as np
+import pytest
+
+# the zcurve package is found in the scripts folder of the repo, as in plotZcurve.py
+repo_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(repo_path, 'scripts'))
+from zcurve.core import calculates_coord, calculates_coord_parallel, reads_seq, scans_genome, writes_coord_store, decimates_coord, decimates_lttb
+from zcurve.core import calculates_windows, counts_gc_limits
+from zcurve.core import TR_MATRIX, InvalidInput
+
+# sample genome of the repo
+ZIKA_PATH = os.path.join(repo_path, 'examples', 'samples_data', 'zika_genome.fna')
+
+
+#%% USER-DEFINED PYTHON FUNCTIONS
+
+'''CREATES_MATRIX_LOOP
+
+    Parameters
+    ----------
+    seq: string
+        nucleotide sequence, in lower case
+
+    tr_matrix: numpy.array
+        transformation matrix to calculate the coordinates
+
+    Returns
+    -------
+    coord: numpy.array
+        X, Y and Z coordinates of each position, calculated one base at a time as in creates_matrix of v1.0.0
+
+'''
+
+def creates_matrix_loop(seq, tr_matrix):
+    bases_freq = {'a':0, 'g':0, 'c':0, 't':0}
+    coordinates = {'x':[], 'y':[], 'z':[]}
+    for i in range(len(seq)):
+        bases_freq[seq[i]] += 1/(len(seq)+1)
+        freq_values=list(bases_freq.values())
+        for index,coord in enumerate(coordinates.keys()):
+            coordinates[coord].append(np.sum(freq_values*tr_matrix[index]))
+    return(np.column_stack(list(coordinates.values())))
+
+
+'''READS_ZIKA
+
+    Returns
+    -------
+    seq: string
+        sequence of the zika genome, read as plotZcurve.py does (lower case, without header and newlines)
+
+'''
+
+def reads_zika():
+    with open(ZIKA_PATH, 'rb') as genome:
+        return(reads_seq(genome, start_line=2))
+
+
+'''DECIMATES_LTTB_LOOP
+
+    Parameters
+    ----------
+    coord: numpy.array
+        X, Y and Z coordinates as columns
+
+    max_points: int
+        target number of points, at least 3
+
+    Returns
+    -------
+    index: numpy.array
+        indices of the points kept by LTTB, calculated one bucket at a time
+
+'''
+
+def decimates_lttb_loop(coord, max_points):
+    bounds = np.linspace(1, len(coord) - 1, max_points - 1).astype(np.int64)
+    index = [0]
+    for bucket in range(max_points - 2):
+        block = coord[bounds[bucket]:bounds[bucket + 1]]
+        # average of the bucket after, or the last point after the last bucket
+        following = coord[bounds[bucket + 1]:bounds[bucket + 2]].mean(axis=0) if bucket < max_points - 3 else coord[-1]
+        area = np.linalg.norm(np.cross(block - coord[index[-1]], following - coord[index[-1]]), axis=1)
+        index.append(bounds[bucket] + int(area.argmax()))
+    return(np.array(index + [len(coord) - 1]))
+
+
+#%% TESTS
+
+# the sequence in memory, as in the default mode of plotZcurve.py
+def test_zika_matches_loop():
+    seq = reads_zika()
+    assert np.allclose(calculates_coord(seq, TR_MATRIX), creates_matrix_loop(seq, TR_MATRIX))
+
+
+# the sequence split in chunks calculated by several workers, whose limits fall inside the sequence
+@pytest.mark.parametrize('workers, chunk_size', [(1, 1 << 20), (2, 1000), (3, 997)])
+def test_zika_parallel_matches_loop(workers, chunk_size):
+    seq = reads_zika()
+    coord, totals = calculates_coord_parallel(seq, TR_MATRIX, workers, chunk_size=chunk_size)
+    assert np.allclose(coord, creates_matrix_loop(seq, TR_MATRIX))
+    assert totals.sum() == len(seq)
+
+
+# the coordinates do not change at the limit between two chunks, nor with the number of workers
+def test_chunk_boundary():
+    seq = reads_zika()
+    serial, totals = calculates_coord_parallel(seq, TR_MATRIX, 1)
+    chunked, chunked_totals = calculates_coord_parallel(seq, TR_MATRIX, 2, chunk_size=len(seq) // 2 + 1)
+    assert np.allclose(serial, chunked)
+    assert np.array_equal(totals, chunked_totals)
+
+
+# the reader lowers the sequence, and the lookup table accepts both cases
+def test_lower_and_upper_case():
+    seq = reads_zika()
+    mixed = ''.join(base.upper() if i % 3 else base for i, base in enumerate(seq[:500]))
+    fasta = io.BytesIO(b'>mixed\n' + mixed.encode('ascii') + b'\n')
+    assert reads_seq(fasta, start_line=1) == seq[:500]
+    assert np.allclose(calculates_coord(mixed, TR_MATRIX), creates_matrix_loop(seq[:500], TR_MATRIX))
+    assert np.allclose(calculates_coord(seq[:500].upper(), TR_MATRIX), calculates_coord(seq[:500], TR_MATRIX))
+
+
+# a sequence of 1 base has one point
+@pytest.mark.parametrize('base', ['a', 'g', 'c', 't'])
+def test_one_base(base):
+    coord = calculates_coord(base, TR_MATRIX)
+    assert coord.shape == (1, 3)
+    assert np.allclose(coord, creates_matrix_loop(base, TR_MATRIX))
+    parallel, totals = calculates_coord_parallel(base, TR_MATRIX, 2)
+    assert np.allclose(parallel, coord)
+
+
+# a file with only a header is rejected in memory, in the upload stream and out of core alike
+@pytest.mark.parametrize('fasta', [b'>empty\n', b'>empty', b'>empty\n\n'])
+def test_no_sequence(fasta, tmp_path):
+    with pytest.raises(InvalidInput):
+        reads_seq(io.BytesIO(fasta))
+    with pytest.raises(InvalidInput):
+        scans_genome(io.BytesIO(fasta))
+    with pytest.raises(InvalidInput):
+        writes_coord_store(io.BytesIO(fasta), TR_MATRIX, str(tmp_path / 'coord.npy'))
+
+
+# the decimation never keeps more points than asked, even with very few points
+@pytest.mark.parametrize('method', ['stride', 'minmax', 'lttb'])
+def test_decimation_size(method):
+    coord = calculates_coord(reads_zika(), TR_MATRIX)
+    for max_points in list(range(1, 20)) + [1000]:
+        decimated, step = decimates_coord(coord, max_points, method)
+        assert 0 < len(decimated) <= max_points
+        # the first and the last positions are kept, as soon as there is room for both
+        assert step[0] == 1 and (max_points < 2 or step[-1] == len(coord))
+
+
+# LTTB keeps the same points as one bucket at a time, with narrow and wide buckets, and blocks of any size
+@pytest.mark.parametrize('max_points, chunk_size', [(3, 1 << 20), (5000, 1 << 20), (5000, 100), (1000, 7), (50, 1 << 20)])
+def test_lttb_matches_loop(max_points, chunk_size):
+    coord = np.cumsum(np.random.default_rng(max_points).normal(size=(20000, 3)), axis=0)
+    assert np.array_equal(decimates_lttb(coord, max_points, chunk_size), decimates_lttb_loop(coord, max_points))
+
+
+# the sliding windows are the same as each window counted on its own, also when the window and the step are coprime
+# and the sequence is read in pieces which do not follow the windows
+@pytest.mark.parametrize('window, step', [(100, 100), (1000, 999), (7, 13), (50, 1), (10259, 1), (10261, 5)])
+def test_windows_match_loop(window, step):
+    seq = reads_zika()
+    windows = calculates_windows([seq[:1234], seq[1234:5000], seq[5000:]], window, step)
+    starts = range(0, len(seq) - window + 1, step)
+    assert len(windows['start']) == len(starts)
+    gc = [seq.count('g', start, start + window) + seq.count('c', start, start + window) for start in starts]
+    assert np.allclose(windows['gc'], np.array(gc) * 100 / window)
+    g_starts, c_starts, g_ends, c_ends = counts_gc_limits([seq], window, step, piece_size=997)
+    assert np.array_equal(g_ends - g_starts, [seq.count('g', start, start + window) for start in starts])
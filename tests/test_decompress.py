@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: tests/test_decompress.py
+
+- General description:
+Tests of the compressed inputs (scripts/zcurve/decompress.py): the data read is the decompressed file, and the records
+of a multi-record file are counted, since they are read as one sequence.
+
+- Usage:
+It is run from the parent directory of the repo, as:
+
+python -m pytest tests
+
+- List of imported modules:
+1. os, sys, io, gzip: to find the zcurve package and to compress the test files
+2. pytest: to run the tests
+
+"""
+#%% IMPORT MODULES
+
+import os
+import sys
+import io
+import gzip
+import pytest
+
+# the zcurve package is found in the scripts folder of the repo, as in plotZcurve.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from zcurve.decompress import opens_genome
+
+
+#%% TESTS
+
+# the records are counted once, whatever the size of the reads, and also when the file is read again from its start
+@pytest.mark.parametrize('size', [1, 2, 7, 1 << 20])
+def test_counts_headers(size):
+    fasta = b'>a\nACGT\n>b\nGG\n>c\n>d\nT\n'
+    genome = opens_genome(io.BytesIO(gzip.compress(fasta)))
+    data = b''.join(iter(lambda: genome.read(size), b''))
+    assert data == fasta
+    assert genome.headers == 4
+    genome.seek(0)
+    genome.read()
+    assert genome.headers == 4
+
+
+# a > inside a line is not a header
+def test_counts_only_headers():
+    genome = opens_genome(io.BytesIO(gzip.compress(b'>a >b\nAC>GT\n')))
+    genome.read()
+    assert genome.headers == 1
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Author: Aura Zelco
+
+Title: tests/test_index.py
+
+- General description:
+Tests of the index of the FASTA files (scripts/zcurve/index.py), used by --records and --region.
+
+- Usage:
+It is run from the parent directory of the repo, as:
+
+python -m pytest tests
+
+- List of imported modules:
+1. os, sys: to find the zcurve package
+2. pytest: to run the tests, in a temporary folder (tmp_path)
+
+"""
+#%% IMPORT MODULES
+
+import os
+import sys
+import pytest
+
+# the zcurve package is found in the scripts folder of the repo, as in plotZcurve.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from zcurve.core import InvalidInput
+from zcurve.index import builds_index, opens_records
+
+
+#%% TESTS
+
+# an empty file is not a fasta file, and cannot be memory-mapped
+def test_empty_file(tmp_path):
+    genome = tmp_path / 'empty.fa'
+    genome.write_bytes(b'')
+    with pytest.raises(InvalidInput):
+        builds_index(str(genome))
+    # an index written before the file was emptied
+    with pytest.raises(InvalidInput):
+        opens_records(str(genome), [('a', 4, 3, 4, 5)])
+
+
+# each record is found, with its length and the layout of its lines
+def test_builds_index(tmp_path):
+    genome = tmp_path / 'multi.fa'
+    genome.write_bytes(b'>a first\nACGT\nAC\n>b\nGGGG\n')
+    assert builds_index(str(genome)) == [('a', 6, 9, 4, 5), ('b', 4, 20, 4, 5)]